@@ -0,0 +1,221 @@
+# send the status messages to every web browser watching, as server-sent
+# events. Each message is turned into an event once and put in a ring of the
+# latest events, each browser reads the ring from its own cursor, so adding a
+# browser costs no more work per message. Progress messages are coalesced,
+# only the latest in each interval is sent, and keepalives are sent as SSE
+# comments, which keep the connection open without a message to handle
+
+# Example usage:
+# broadcast = Broadcast(intervals={"copydata": 0.5})
+# msg.connect({"/photos/copydata": broadcast.publish, ...})  # in its own thread
+#
+# def stream():  # one for each browser
+#     for chunk in broadcast.events():
+#         yield chunk
+#
+# or from an asyncio server, once the loop is running
+# broadcast.attach_loop(asyncio.get_running_loop())
+# async for chunk in broadcast.aevents():
+#     await response.write(chunk)
+
+import json
+import time
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger("broadcast")
+
+# events kept for browsers that have fallen behind, one further behind than
+# this skips to the oldest event still kept
+RING_SIZE = 256
+# minimum seconds between events on these topics, keyed by topic name without
+# the /photos/ prefix, only the latest message in each interval is sent
+COALESCE_INTERVALS = {"copydata": 0.25}
+KEEPALIVE_TOPIC = "/photos/keepalive"
+# seconds without anything to send before a browser is sent a comment anyway,
+# so proxies and phones do not close the connection
+IDLE_KEEPALIVE = 15
+
+
+# ----------------------------------------------------------------------------
+def sse_event(topic, data):
+    """a message as the event the status page expects
+
+    Returns:
+        bytes
+    """
+    return f"data: {json.dumps({'message': {'topic': topic, 'payload': data}})}\n\n".encode()
+
+
+class Broadcast:
+    """Broadcast
+    a ring of the latest events, shared by every browser
+
+    Args:
+        size      (int)     events kept in the ring
+        intervals (dict)    minimum seconds between events, keyed by topic name
+                            without the /photos/ prefix, overrides
+                            COALESCE_INTERVALS, 0 sends every message
+    """
+
+    def __init__(self, size=RING_SIZE, intervals=None) -> None:
+        self.size = size
+        self.ring = [None] * size
+        # sequence number of the next event, the event is at seq % size
+        self.seq = 0
+        self.keepalives = 0
+        self.cond = threading.Condition()
+        self.intervals = {}
+        for name, interval in {**COALESCE_INTERVALS, **(intervals or {})}.items():
+            if interval:
+                self.intervals[f"/photos/{name}"] = float(interval)
+        self.last_sent = {}
+        self.pending = {}
+        self.timers = {}
+        self.stats = {"messages": 0, "events": 0, "coalesced": 0, "skipped": 0}
+        # for aevents(), set and replaced whenever there is something new
+        self.loop = None
+        self.wakeup = None
+
+    # ----------------------------------------------------------------------------
+    def attach_loop(self, loop):
+        """wake the aevents() readers on an asyncio loop when there is
+        something new, messages can still be published from any thread"""
+        self.loop = loop
+        self.wakeup = asyncio.Event()
+
+    # ----------------------------------------------------------------------------
+    def _notify(self):
+        # call with self.cond held
+        self.cond.notify_all()
+        if self.loop:
+            self.loop.call_soon_threadsafe(self._wake)
+
+    # ----------------------------------------------------------------------------
+    def _wake(self):
+        # in the loop's thread
+        wakeup, self.wakeup = self.wakeup, asyncio.Event()
+        wakeup.set()
+
+    # ----------------------------------------------------------------------------
+    def _append(self, event):
+        # call with self.cond held
+        self.ring[self.seq % self.size] = event
+        self.seq += 1
+        self.stats["events"] += 1
+        self._notify()
+
+    # ----------------------------------------------------------------------------
+    def _flush_pending(self):
+        # call with self.cond held, sends what was held back before a state change
+        for timer in self.timers.values():
+            timer.cancel()
+        for key, event in self.pending.items():
+            self.last_sent[key] = time.monotonic()
+            self._append(event)
+        self.pending = {}
+        self.timers = {}
+
+    # ----------------------------------------------------------------------------
+    def _send_pending(self, key):
+        with self.cond:
+            self.timers.pop(key, None)
+            event = self.pending.pop(key, None)
+            if event:
+                self.last_sent[key] = time.monotonic()
+                self._append(event)
+
+    # ----------------------------------------------------------------------------
+    def publish(self, topic, data):
+        """a handler for Messaging.connect, adds the message for every browser"""
+        with self.cond:
+            self.stats["messages"] += 1
+            if topic == KEEPALIVE_TOPIC:
+                self.keepalives += 1
+                self._notify()
+                return
+
+            event = sse_event(topic, data)
+            interval = self.intervals.get(topic)
+            if not interval:
+                self._flush_pending()
+                self._append(event)
+                return
+
+            key = (topic, (data or {}).get("device", ""))
+            now = time.monotonic()
+            wait = self.last_sent.get(key, 0) + interval - now
+            if wait > 0:
+                if key in self.pending:
+                    self.stats["coalesced"] += 1
+                self.pending[key] = event
+                if key not in self.timers:
+                    timer = threading.Timer(wait, self._send_pending, (key,))
+                    timer.daemon = True
+                    self.timers[key] = timer
+                    timer.start()
+                return
+            self.last_sent[key] = now
+            self._append(event)
+
+    # ----------------------------------------------------------------------------
+    def read(self, cursor, keepalives, timeout=IDLE_KEEPALIVE):
+        """wait for events after cursor
+
+        Args:
+            cursor     (int)    sequence number of the next event to read
+            keepalives (int)    the keepalive count last seen
+            timeout    (float)  seconds to wait
+
+        Returns:
+            (cursor, keepalives, events) events is a list of bytes, empty if
+            there was only a keepalive or the wait timed out
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq > cursor or self.keepalives != keepalives, timeout)
+            if self.seq - cursor > self.size:
+                self.stats["skipped"] += self.seq - self.size - cursor
+                cursor = self.seq - self.size
+            events = [self.ring[i % self.size] for i in range(cursor, self.seq)]
+            return self.seq, self.keepalives, events
+
+    # ----------------------------------------------------------------------------
+    def events(self, timeout=IDLE_KEEPALIVE):
+        """what to send one browser, forever, starting from the next message
+
+        Yields:
+            bytes, the waiting events together, or an SSE comment
+        """
+        with self.cond:
+            cursor, keepalives = self.seq, self.keepalives
+        while True:
+            cursor, keepalives, events = self.read(cursor, keepalives, timeout)
+            if events:
+                yield b"".join(events)
+            else:
+                yield b": keepalive\n\n"
+
+    # ----------------------------------------------------------------------------
+    async def aevents(self, timeout=IDLE_KEEPALIVE):
+        """as events(), for a server running on the loop given to attach_loop()
+
+        Yields:
+            bytes, the waiting events together, or an SSE comment
+        """
+        with self.cond:
+            cursor, keepalives = self.seq, self.keepalives
+        while True:
+            # taken before reading, so a wake up in between is not missed
+            wakeup = self.wakeup
+            cursor, seen, events = self.read(cursor, keepalives, 0)
+            if events:
+                yield b"".join(events)
+            elif seen != keepalives:
+                yield b": keepalive\n\n"
+            else:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+            keepalives = seen
@@ -0,0 +1,198 @@
+# catalog of every photo and video in the store, when it was taken and on what,
+# so questions like "how many shots on 2026-07-11" or "what has not been backed
+# up" are a query rather than a walk of the store. The date index of symlinks
+# can be made again from it at any time
+
+# Example usage:
+# catalog = Catalog('/home/user/usb_data/gnarlypi.db')
+# catalog.add_many([(path, os.stat(path), '2025-07-11 09:20:30+0000', 'OM-1')])
+# for day, count in catalog.days():
+#     print(day, count)
+
+import os
+import time
+import logging
+import threading
+
+from .db import open_db
+
+logger = logging.getLogger("catalog")
+
+
+class Catalog:
+    """Catalog
+    a row for each file in the store with its size, mtime, the UTC time it
+    was taken, the camera, its extension, when it was added to the catalog
+    and when it was last backed up (synced), which is NULL until it is
+
+    Args:
+        filepath (str)      the database file, shared with the index state
+    """
+
+    def __init__(self, filepath) -> None:
+        self.filepath = filepath
+        self.lock = threading.Lock()
+        self.db = open_db(filepath)
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS photos "
+                "(path TEXT PRIMARY KEY, size INTEGER, mtime REAL, utc TEXT, day TEXT, "
+                "camera TEXT, ext TEXT, added REAL, synced REAL)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS photos_day ON photos (day)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS photos_synced ON photos (synced)")
+
+    # ----------------------------------------------------------------------------
+    def add_many(self, items):
+        """add or update files in one transaction, a file that has changed is
+        no longer counted as synced
+
+        Args:
+            items (iterable)    of (path, os.stat, utc, camera), with utc as
+                                "YYYY-MM-DD HH:MM:SS+0000"
+        """
+        now = time.time()
+        rows = [
+            (path, stat.st_size, stat.st_mtime, utc, utc[:10], camera, os.path.splitext(path)[1][1:].upper(), now)
+            for path, stat, utc, camera in items
+        ]
+        with self.lock:
+            with self.db:
+                self.db.executemany(
+                    "INSERT INTO photos (path, size, mtime, utc, day, camera, ext, added) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (path) DO UPDATE SET size = excluded.size, mtime = excluded.mtime, "
+                    "utc = excluded.utc, day = excluded.day, camera = excluded.camera, "
+                    "synced = CASE WHEN photos.size = excluded.size AND photos.mtime = excluded.mtime "
+                    "THEN photos.synced ELSE NULL END",
+                    rows,
+                )
+        return len(rows)
+
+    # ----------------------------------------------------------------------------
+    def forget_many(self, paths):
+        """remove files that are no longer in the store"""
+        with self.lock:
+            with self.db:
+                self.db.executemany("DELETE FROM photos WHERE path = ?", ((path,) for path in paths))
+
+    # ----------------------------------------------------------------------------
+    def paths(self):
+        """the paths of everything in the catalog, as a set"""
+        with self.lock:
+            return {row[0] for row in self.db.execute("SELECT path FROM photos")}
+
+    # ----------------------------------------------------------------------------
+    def sizes(self):
+        """the size of everything in the catalog, keyed by path"""
+        with self.lock:
+            return dict(self.db.execute("SELECT path, size FROM photos"))
+
+    # ----------------------------------------------------------------------------
+    def days(self):
+        """the number of files taken on each day
+
+        Returns:
+            list of (day as YYYY-MM-DD, count)
+        """
+        with self.lock:
+            return self.db.execute("SELECT day, COUNT(*) FROM photos GROUP BY day ORDER BY day").fetchall()
+
+    # ----------------------------------------------------------------------------
+    def cameras(self):
+        """the number of files from each camera
+
+        Returns:
+            list of (camera, count), camera is None when it is not known
+        """
+        with self.lock:
+            return self.db.execute(
+                "SELECT camera, COUNT(*) FROM photos GROUP BY camera ORDER BY COUNT(*) DESC"
+            ).fetchall()
+
+    # ----------------------------------------------------------------------------
+    def files(self, day=None, camera=None, ext=None, unsynced=False):
+        """the files matching all of the given conditions
+
+        Args:
+            day      (str)      YYYY-MM-DD
+            camera   (str)      camera model
+            ext      (str)      extension without the dot, e.g. ORF
+            unsynced (bool)     only files that have not been backed up
+
+        Returns:
+            list of (path, size, utc, camera)
+        """
+        where = []
+        args = []
+        if day:
+            where.append("day = ?")
+            args.append(day)
+        if camera:
+            where.append("camera = ?")
+            args.append(camera)
+        if ext:
+            where.append("ext = ?")
+            args.append(ext.upper().lstrip("."))
+        if unsynced:
+            where.append("synced IS NULL")
+        sql = "SELECT path, size, utc, camera FROM photos"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        with self.lock:
+            return self.db.execute(sql + " ORDER BY utc, path", args).fetchall()
+
+    # ----------------------------------------------------------------------------
+    def dates(self):
+        """the path and UTC time of every file, to make the date index from
+
+        Returns:
+            list of (path, utc)
+        """
+        with self.lock:
+            return self.db.execute("SELECT path, utc FROM photos").fetchall()
+
+    # ----------------------------------------------------------------------------
+    def mark_synced(self, before, paths=None):
+        """record a backup, either of the given paths or of everything added to
+        the catalog before the backup started
+
+        Args:
+            before (float)      time.time() when the backup started
+            paths  (iterable)   just these files, when known
+        """
+        now = time.time()
+        with self.lock:
+            with self.db:
+                if paths is None:
+                    cursor = self.db.execute(
+                        "UPDATE photos SET synced = ? WHERE synced IS NULL AND added <= ?", (now, before)
+                    )
+                    count = cursor.rowcount
+                else:
+                    count = 0
+                    for path in paths:
+                        count += self.db.execute("UPDATE photos SET synced = ? WHERE path = ?", (now, path)).rowcount
+        logger.info(f"marked {count} files as synced")
+        return count
+
+    # ----------------------------------------------------------------------------
+    def stats(self):
+        """totals for the whole catalog
+
+        Returns:
+            dict of files, bytes, unsynced, first and last day
+        """
+        with self.lock:
+            files, size, first, last = self.db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), MIN(day), MAX(day) FROM photos"
+            ).fetchone()
+            unsynced = self.db.execute("SELECT COUNT(*) FROM photos WHERE synced IS NULL").fetchone()[0]
+        return {"files": files, "bytes": size, "unsynced": unsynced, "first": first, "last": last}
+
+    # ----------------------------------------------------------------------------
+    def get(self, path):
+        """the UTC time and camera of a file, or None if it is not in the catalog"""
+        with self.lock:
+            row = self.db.execute("SELECT utc, camera FROM photos WHERE path = ?", (path,)).fetchone()
+        return tuple(row) if row else None
@@ -0,0 +1,210 @@
+# copy the contents of one open file to another, reporting progress as it goes
+#
+# Example usage:
+# with open(src, "rb") as f_in, open(dst, "wb") as f_out:
+#     copied = copy_stream("pipelined", f_in, f_out, progress=lambda n: print(n))
+
+import os
+import errno
+import queue
+import logging
+import threading
+
+logger = logging.getLogger("copier")
+
+ONE_MB = 1024 * 1024
+READ_SIZE = 16 * ONE_MB
+# number of chunk buffers shared between the reader and the writer threads
+RING_BUFFERS = 3
+
+# errors that mean the kernel cannot copy between this pair of files/filesystems
+UNSUPPORTED_ERRNOS = frozenset(
+    [errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF]
+)
+
+
+# ----------------------------------------------------------------------------
+def buffered_copy(f_in, f_out, chunk_size=READ_SIZE, progress=None, hasher=None):
+    """copy in a single thread, reading a chunk then writing it out
+
+    Args:
+        f_in       (file)       source opened for binary reading
+        f_out      (file)       destination opened for binary writing
+        chunk_size (int)        bytes to read at a time
+        progress   (callable)   called with the number of bytes copied so far
+                                after each chunk is written
+        hasher     (hashlib)    optional hash object, updated with every chunk so
+                                the file can be checksummed without reading it again
+
+    Returns:
+        (int) the number of bytes copied
+    """
+    copied = 0
+    while chunk := f_in.read(chunk_size):
+        f_out.write(chunk)
+        if hasher:
+            hasher.update(chunk)
+        copied += len(chunk)
+        if progress:
+            progress(copied)
+
+    return copied
+
+
+# ----------------------------------------------------------------------------
+def pipelined_copy(f_in, f_out, chunk_size=READ_SIZE, progress=None, hasher=None, buffers=RING_BUFFERS):
+    """copy with a reader thread filling a small ring of reusable buffers while
+    the calling thread writes them out, so that reading from the card and writing
+    to the store overlap rather than taking turns
+
+    Args are the same as buffered_copy, plus
+        buffers    (int)        number of chunk buffers in the ring, at least 2
+
+    Returns:
+        (int) the number of bytes copied
+    """
+    free = queue.Queue()
+    filled = queue.Queue()
+    for _ in range(max(2, buffers)):
+        free.put(bytearray(chunk_size))
+    errors = []
+
+    def reader():
+        try:
+            while True:
+                buf = free.get()
+                # the writer gave up, no point reading any more
+                if buf is None:
+                    return
+                size = f_in.readinto(buf)
+                if not size:
+                    return
+                filled.put((buf, size))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            # always wake the writer, even on errors
+            filled.put(None)
+
+    thread = threading.Thread(target=reader, name="copy-reader", daemon=True)
+    thread.start()
+
+    copied = 0
+    try:
+        while (item := filled.get()) is not None:
+            buf, size = item
+            with memoryview(buf) as view:
+                f_out.write(view[:size])
+                if hasher:
+                    hasher.update(view[:size])
+            copied += size
+            free.put(buf)
+            if progress:
+                progress(copied)
+    finally:
+        # release the reader if it is waiting on a buffer
+        free.put(None)
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+    return copied
+
+
+# ----------------------------------------------------------------------------
+def _copy_file_range(in_fd, out_fd, count, in_offset, out_offset):
+    return os.copy_file_range(in_fd, out_fd, count, in_offset, out_offset)
+
+
+def _sendfile(in_fd, out_fd, count, in_offset, out_offset):
+    # sendfile writes at the current position of out_fd
+    os.lseek(out_fd, out_offset, os.SEEK_SET)
+    return os.sendfile(out_fd, in_fd, in_offset, count)
+
+
+KERNEL_CALLS = []
+if hasattr(os, "copy_file_range"):
+    KERNEL_CALLS.append(_copy_file_range)
+if hasattr(os, "sendfile"):
+    KERNEL_CALLS.append(_sendfile)
+
+
+# ----------------------------------------------------------------------------
+def kernel_copy(f_in, f_out, chunk_size=READ_SIZE, progress=None, hasher=None):
+    """copy inside the kernel with copy_file_range, or sendfile when that is not
+    possible, so the data never passes through python. Copies chunk_size bytes
+    per call so that progress is still reported. When neither works for this
+    pair of filesystems it carries on from wherever it got to with buffered_copy
+
+    Args are the same as buffered_copy, as the data never reaches python a
+    hasher cannot be fed, so with one the pipelined copy is used instead
+
+    Returns:
+        (int) the number of bytes copied
+    """
+    if hasher:
+        return pipelined_copy(f_in, f_out, chunk_size, progress, hasher)
+
+    in_fd = f_in.fileno()
+    out_fd = f_out.fileno()
+    # anything python has buffered must be on disk before the kernel writes
+    f_out.flush()
+    in_start = f_in.tell()
+    out_start = f_out.tell()
+    expected = os.fstat(in_fd).st_size - in_start
+    copied = 0
+
+    for call in KERNEL_CALLS:
+        try:
+            while copied < expected:
+                sent = call(in_fd, out_fd, chunk_size, in_start + copied, out_start + copied)
+                if not sent:
+                    break
+                copied += sent
+                if progress:
+                    progress(copied)
+
+            if copied >= expected:
+                f_in.seek(in_start + copied)
+                f_out.seek(out_start + copied)
+                return copied
+            # some filesystems just return 0 rather than an error
+            logger.debug(f"{call.__name__} stopped at {copied} of {expected} bytes")
+        except OSError as e:
+            if e.errno not in UNSUPPORTED_ERRNOS:
+                raise
+            logger.debug(f"{call.__name__} not supported here: {e}")
+
+    # no kernel copy for this pair of files, finish off the slow way
+    f_in.seek(in_start + copied)
+    f_out.seek(out_start + copied)
+    already = copied
+
+    def offset_progress(count):
+        progress(already + count)
+
+    return already + buffered_copy(f_in, f_out, chunk_size, offset_progress if progress else None)
+
+
+COPY_METHODS = {
+    "buffered": buffered_copy,
+    "pipelined": pipelined_copy,
+    "kernel": kernel_copy,
+}
+
+
+# ----------------------------------------------------------------------------
+def copy_stream(method, f_in, f_out, chunk_size=READ_SIZE, progress=None, hasher=None):
+    """copy f_in to f_out with the named method, unknown names fall back to
+    the buffered copy
+
+    Returns:
+        (int) the number of bytes copied
+    """
+    copier = COPY_METHODS.get(method)
+    if not copier:
+        logger.warning(f"unknown copy method '{method}', using buffered")
+        copier = buffered_copy
+
+    return copier(f_in, f_out, chunk_size, progress, hasher)
@@ -0,0 +1,32 @@
+# common setup for the sqlite databases gnarlypi keeps in its store
+
+import os
+import sqlite3
+
+# how long to wait for another gnarly process to finish writing, in seconds
+BUSY_TIMEOUT = 30
+
+
+def open_db(filepath):
+    """open (creating if needed) a sqlite database in WAL mode, so that readers
+    in other gnarly processes are never blocked by a writer
+
+    The connection may be shared between threads, callers are expected to
+    serialise their own writes
+
+    Args:
+        filepath (str)  path to the database file
+
+    Returns:
+        sqlite3.Connection
+    """
+    parent = os.path.dirname(filepath)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+
+    db = sqlite3.connect(filepath, timeout=BUSY_TIMEOUT, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    # in WAL mode NORMAL is still safe against corruption, it just may lose the
+    # last transactions on power loss, which a manifest rebuild recovers
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
@@ -0,0 +1,266 @@
+# a display model shared by the status devices. Each /photos/* message is
+# reduced into a small DisplayState, and a RenderLoop draws only the latest
+# state at a fixed rate, from its own thread. A burst of copydata messages
+# becomes a single frame, and each status device only has to draw a state
+
+# Example usage:
+# def render(state):
+#     if state.screen == "copy" and state.copy:
+#         print(f"{state.copy.files_copied}/{state.copy.files_total}", end="\r")
+#
+# renderer = RenderLoop(render, rate=10)
+# renderer.start()
+# msg.connect(renderer.handlers())
+
+import time
+import logging
+import threading
+from collections import namedtuple
+
+logger = logging.getLogger("display_state")
+
+# the most frames a second a RenderLoop draws
+RENDER_RATE = 10
+# seconds between frames when nothing has changed, so clocks keep ticking
+RENDER_TICK = 1.0
+
+TOPICS = [
+    "/photos/error",
+    "/photos/ready",
+    "/photos/startcopy",
+    "/photos/endcopy",
+    "/photos/copydata",
+    "/photos/waitremove",
+    "/photos/devicedata",
+    "/photos/diskfull",
+    "/photos/keepalive",
+    "/photos/fivelines",
+    "/photos/cls",
+]
+
+
+# ----------------------------------------------------------------------------
+def ratio(numerator, denominator):
+    """numerator / denominator kept between 0 and 1, 0 if there is no denominator"""
+    if not denominator:
+        return 0.0
+    return max(0.0, min(1.0, numerator / denominator))
+
+
+# ----------------------------------------------------------------------------
+def human_rate(bps):
+    """bytes a second as a short string, e.g. 12M, 640K or 512"""
+    bps = int(bps)
+    if bps >= 1024 * 1024:
+        return f"{int(bps / (1024 * 1024))}M"
+    if bps >= 1024:
+        return f"{int(bps / 1024)}K"
+    return f"{bps}"
+
+
+# ----------------------------------------------------------------------------
+def lit_pixels(fraction, count):
+    """how many of a row of count pixels to light to show a fraction"""
+    return int(max(0.0, min(1.0, fraction)) * count)
+
+
+class CopyProgress(
+    namedtuple("CopyProgress", ["fromfile", "tofile", "size", "copied", "files_copied", "files_total", "bps", "rsync"])
+):
+    """CopyProgress
+    the latest copydata message, bps is worked out from when the file
+    started if the message did not give it"""
+
+    __slots__ = ()
+
+    @property
+    def file_ratio(self):
+        return ratio(self.copied, self.size)
+
+    @property
+    def files_ratio(self):
+        return ratio(self.files_copied, self.files_total)
+
+
+class DiskUsage(namedtuple("DiskUsage", ["sd_size", "sd_free", "hd_size", "hd_free"])):
+    """DiskUsage
+    the latest devicedata message, sizes in bytes"""
+
+    __slots__ = ()
+
+    @property
+    def sd_ratio(self):
+        return ratio(self.sd_size - self.sd_free, self.sd_size)
+
+    @property
+    def hd_ratio(self):
+        return ratio(self.hd_size - self.hd_free, self.hd_size)
+
+
+# screen is what the status devices should be showing, one of idle, ready,
+# copy, copied, waitremove, error, diskfull, lines or cls. message is the
+# text for ready and diskfull, error is (msg, msg2, level), lines and color
+# are from fivelines, copy is None until the first copydata of a copy,
+# alive counts keepalives, epoch is from the latest message and
+# file_started is the epoch the current file started copying
+DisplayState = namedtuple(
+    "DisplayState",
+    ["screen", "message", "error", "lines", "color", "copy", "disks", "alive", "epoch", "file_started"],
+)
+
+INITIAL_STATE = DisplayState("idle", "", None, [], None, None, None, 0, 0, 0)
+
+
+# ----------------------------------------------------------------------------
+def reduce_message(state, topic, data):
+    """the state after a message, the state passed in is not changed
+
+    Args:
+        state (DisplayState)
+        topic (str)     e.g. /photos/copydata
+        data  (dict)    the decoded message
+
+    Returns:
+        a new DisplayState, or the same one for a topic it does not know
+    """
+    data = data or {}
+    epoch = data.get("_epoch", state.epoch)
+    if topic == "/photos/copydata":
+        started = state.file_started
+        if not data.get("copied") or not state.copy or state.copy.fromfile != data.get("fromfile"):
+            started = epoch
+        bps = data.get("bps")
+        if not bps and data.get("copied") and epoch > started:
+            bps = data["copied"] / (epoch - started)
+        copy = CopyProgress(
+            data.get("fromfile", ""),
+            data.get("tofile", ""),
+            data.get("size", 0),
+            data.get("copied", 0),
+            data.get("files_copied", 0),
+            data.get("files_total", 0),
+            int(bps or 0),
+            data.get("rsync", False),
+        )
+        return state._replace(screen="copy", copy=copy, epoch=epoch, file_started=started)
+    if topic == "/photos/devicedata":
+        disks = DiskUsage(data.get("sd_size", 0), data.get("sd_free", 0), data.get("hd_size", 0), data.get("hd_free", 0))
+        return state._replace(disks=disks, epoch=epoch)
+    if topic == "/photos/keepalive":
+        return state._replace(alive=state.alive + 1, epoch=epoch)
+    if topic == "/photos/startcopy":
+        return state._replace(screen="copy", copy=None, error=None, epoch=epoch, file_started=epoch)
+    if topic == "/photos/endcopy":
+        return state._replace(screen="copied", epoch=epoch)
+    if topic == "/photos/ready":
+        return state._replace(screen="ready", message=data.get("msg", ""), error=None, epoch=epoch)
+    if topic == "/photos/waitremove":
+        return state._replace(screen="waitremove", epoch=epoch)
+    if topic == "/photos/error":
+        error = (data.get("msg", ""), data.get("msg2", ""), data.get("level", ""))
+        return state._replace(screen="error", error=error, epoch=epoch)
+    if topic == "/photos/diskfull":
+        return state._replace(screen="diskfull", message=data.get("diskname", ""), epoch=epoch)
+    if topic == "/photos/fivelines":
+        return state._replace(screen="lines", lines=data.get("lines", [])[:5], color=data.get("color"), epoch=epoch)
+    if topic == "/photos/cls":
+        return state._replace(screen="cls", epoch=epoch)
+    return state
+
+
+class RenderLoop:
+    """RenderLoop
+    reduces messages into the latest DisplayState as they arrive, and calls
+    render with it from a thread of its own, at most rate times a second and
+    only when it has changed, or every tick seconds for a clock
+
+    Args:
+        render (callable)   called with the DisplayState, never from more than
+                            one thread at once
+        rate   (float)      the most frames a second
+        tick   (float)      seconds between frames when nothing has changed,
+                            0 to only draw changes
+    """
+
+    def __init__(self, render, rate=RENDER_RATE, tick=RENDER_TICK) -> None:
+        self.render = render
+        self.interval = 1 / rate if rate else 0
+        self.tick = tick
+        self.state = INITIAL_STATE
+        self.cond = threading.Condition()
+        # held while drawing, so others can wait for a frame to finish
+        self.lock = threading.Lock()
+        self.version = 0
+        self.rendered = -1
+        self.stopped = False
+        self.thread = None
+        self.stats = {"messages": 0, "frames": 0}
+
+    # ----------------------------------------------------------------------------
+    def update(self, topic, data):
+        """a handler for Messaging.connect, it only updates the state so the
+        messaging thread is never held up by drawing"""
+        with self.cond:
+            state = reduce_message(self.state, topic, data)
+            self.stats["messages"] += 1
+            if state is not self.state:
+                self.state = state
+                self.version += 1
+                self.cond.notify()
+
+    # ----------------------------------------------------------------------------
+    def handlers(self, topics=None):
+        """a handler for each topic, to pass to Messaging.connect"""
+        return {topic: self.update for topic in topics or TOPICS}
+
+    # ----------------------------------------------------------------------------
+    def redraw(self):
+        """draw the state again even though it has not changed, e.g. after the
+        terminal is resized"""
+        with self.cond:
+            self.version += 1
+            self.cond.notify()
+
+    # ----------------------------------------------------------------------------
+    def stop(self):
+        """stop drawing, waits for a frame being drawn to finish so the caller
+        can draw something of its own"""
+        with self.lock:
+            self.stopped = True
+
+    # ----------------------------------------------------------------------------
+    def _next_state(self, last_frame):
+        with self.cond:
+            while self.rendered == self.version:
+                timeout = None
+                if self.tick:
+                    timeout = last_frame + self.tick - time.monotonic()
+                    if timeout <= 0:
+                        break
+                self.cond.wait(timeout)
+            self.rendered = self.version
+            return self.state
+
+    # ----------------------------------------------------------------------------
+    def run(self):
+        """draw frames forever, or until stop()"""
+        last_frame = 0
+        while True:
+            state = self._next_state(last_frame)
+            with self.lock:
+                if self.stopped:
+                    return
+                try:
+                    self.render(state)
+                except Exception:
+                    logger.exception("failed to draw the display")
+            self.stats["frames"] += 1
+            last_frame = time.monotonic()
+            # anything arriving meanwhile is drawn as one frame
+            time.sleep(self.interval)
+
+    # ----------------------------------------------------------------------------
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
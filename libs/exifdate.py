@@ -0,0 +1,271 @@
+# find when a photo or video was taken by reading just the headers of the file,
+# walking straight to the EXIF DateTimeOriginal and OffsetTimeOriginal tags in
+# JPEG and TIFF based RAW files, or the creation time of the movie header in
+# MOV/MP4/CR3 files, rather than loading and parsing all of the metadata
+
+# Example usage:
+# date = read_date('/home/user/usb_data/files/DCIM/100OLYMP/P7110109.ORF')
+# if date:
+#     original, offset = date
+# info = read_info('/home/user/usb_data/files/DCIM/100OLYMP/P7110109.ORF')
+# camera = info["camera"] if info else None
+
+import os
+import struct
+import logging
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger("exifdate")
+
+# bytes read from the start of the file, enough for the headers of most files
+WINDOW_SIZE = 64 * 1024
+# give up after this many JPEG segments or ISOBMFF boxes, damaged files can loop
+MAX_SEGMENTS = 64
+
+TAG_MODEL = 0x0110
+TAG_EXIF_IFD = 0x8769
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_OFFSET_TIME_ORIGINAL = 0x9011
+TIFF_ASCII = 2
+
+# ISOBMFF times are seconds since the start of 1904
+MP4_EPOCH = datetime(1904, 1, 1, tzinfo=timezone.utc)
+# the Canon CR3 uuid box, holding the EXIF as TIFF structures in CMT boxes
+CR3_UUID = bytes.fromhex("85c0b687820f11e08111f4ce462b6a48")
+
+
+class HeaderReader:
+    """HeaderReader
+    pread from a file, using a window already read from the start of the
+    file when it covers the bytes wanted
+
+    Args:
+        fd (int)    file descriptor open for reading
+    """
+
+    def __init__(self, fd) -> None:
+        self.fd = fd
+        self.size = os.fstat(fd).st_size
+        self.window = os.pread(fd, WINDOW_SIZE, 0)
+
+    # ----------------------------------------------------------------------------
+    def read(self, offset, size):
+        if offset < 0 or size < 0:
+            return b""
+        if offset + size <= len(self.window):
+            return self.window[offset : offset + size]
+        return os.pread(self.fd, size, offset)
+
+
+# ----------------------------------------------------------------------------
+def _tiff_info(reader, base, exif_only=False):
+    """walk the TIFF structure at base, picking up the camera model from IFD0,
+    then to the Exif IFD for the dates. With exif_only the first IFD is the
+    Exif IFD, as in the CR3 CMT2 box
+
+    Returns:
+        dict of original, offset and camera strings, any may be None
+    """
+    info = {"original": None, "offset": None, "camera": None}
+    header = reader.read(base, 8)
+    if len(header) < 8 or header[:2] not in (b"II", b"MM"):
+        return info
+    # the magic number varies with RAW formats (ORF, RW2), so it is not checked
+    endian = "<" if header[:2] == b"II" else ">"
+
+    def ifd_entries(offset):
+        count_bytes = reader.read(base + offset, 2)
+        if len(count_bytes) < 2:
+            return
+        (count,) = struct.unpack(endian + "H", count_bytes)
+        entries = reader.read(base + offset + 2, count * 12)
+        for i in range(0, len(entries) - 11, 12):
+            yield struct.unpack(endian + "HHI4s", entries[i : i + 12])
+
+    def ascii_value(kind, count, value):
+        if kind != TIFF_ASCII:
+            return None
+        if count <= 4:
+            data = value[:count]
+        else:
+            (offset,) = struct.unpack(endian + "I", value)
+            data = reader.read(base + offset, count)
+        return data.split(b"\0", 1)[0].decode("ascii", errors="replace").strip() or None
+
+    (ifd0,) = struct.unpack(endian + "I", header[4:])
+    if exif_only:
+        exif_ifd = ifd0
+    else:
+        exif_ifd = None
+        for tag, kind, count, value in ifd_entries(ifd0):
+            if tag == TAG_MODEL:
+                info["camera"] = ascii_value(kind, count, value)
+            elif tag == TAG_EXIF_IFD:
+                (exif_ifd,) = struct.unpack(endian + "I", value)
+    if exif_ifd is None:
+        return info
+
+    for tag, kind, count, value in ifd_entries(exif_ifd):
+        if tag == TAG_DATETIME_ORIGINAL:
+            info["original"] = ascii_value(kind, count, value)
+        elif tag == TAG_OFFSET_TIME_ORIGINAL:
+            info["offset"] = ascii_value(kind, count, value)
+    return info
+
+
+# ----------------------------------------------------------------------------
+def jpeg_exif_offset(reader, start=0):
+    """the offset of the TIFF structure in the APP1 Exif segment of the JPEG
+    at start, or None if it does not have one"""
+    pos = start + 2
+    for _ in range(MAX_SEGMENTS):
+        marker = reader.read(pos, 4)
+        if len(marker) < 4 or marker[0] != 0xFF:
+            break
+        # start of scan, the image data follows and there are no more headers
+        if marker[1] == 0xDA:
+            break
+        (length,) = struct.unpack(">H", marker[2:])
+        if marker[1] == 0xE1 and reader.read(pos + 4, 6) == b"Exif\0\0":
+            return pos + 10
+        pos += 2 + length
+    return None
+
+
+# ----------------------------------------------------------------------------
+def _jpeg_info(reader, start=0):
+    """find the APP1 Exif segment of a JPEG and read the dates from it"""
+    base = jpeg_exif_offset(reader, start)
+    if base is None:
+        return {}
+    return _tiff_info(reader, base)
+
+
+# ----------------------------------------------------------------------------
+def iter_boxes(reader, start, end):
+    """the (type, payload offset, payload size) of the ISOBMFF boxes between start and end"""
+    pos = start
+    for _ in range(MAX_SEGMENTS):
+        if pos + 8 > end:
+            return
+        header = reader.read(pos, 16)
+        if len(header) < 8:
+            return
+        size, kind = struct.unpack(">I4s", header[:8])
+        header_size = 8
+        if size == 1 and len(header) == 16:
+            (size,) = struct.unpack(">Q", header[8:])
+            header_size = 16
+        elif size == 0:
+            # runs to the end of the file
+            size = end - pos
+        if size < header_size:
+            return
+        yield kind, pos + header_size, size - header_size
+        pos += size
+
+
+# ----------------------------------------------------------------------------
+def _mvhd_date(reader, offset):
+    data = reader.read(offset, 12)
+    if len(data) < 12:
+        return None
+    if data[0] == 1:
+        (created,) = struct.unpack(">Q", data[4:12])
+    else:
+        (created,) = struct.unpack(">I", data[4:8])
+    # cameras without a clock set write 0
+    if not created:
+        return None
+    return (MP4_EPOCH + timedelta(seconds=created)).strftime("%Y:%m:%d %H:%M:%S")
+
+
+# ----------------------------------------------------------------------------
+def _isobmff_info(reader):
+    """dates from a MOV/MP4/CR3, the EXIF in a CR3 is preferred as it has the
+    local time and offset, the movie header creation time is in UTC"""
+    info = {}
+    created = None
+    for kind, offset, size in iter_boxes(reader, 0, reader.size):
+        if kind != b"moov":
+            continue
+        for child, child_offset, child_size in iter_boxes(reader, offset, offset + size):
+            if child == b"mvhd":
+                created = _mvhd_date(reader, child_offset)
+            elif child == b"uuid" and reader.read(child_offset, 16) == CR3_UUID:
+                for cmt, cmt_offset, cmt_size in iter_boxes(
+                    reader, child_offset + 16, child_offset + child_size
+                ):
+                    if cmt == b"CMT1":
+                        info["camera"] = _tiff_info(reader, cmt_offset)["camera"]
+                    elif cmt == b"CMT2":
+                        exif = _tiff_info(reader, cmt_offset, exif_only=True)
+                        info["original"] = exif["original"]
+                        info["offset"] = exif["offset"]
+        break
+
+    if not info.get("original") and created:
+        info["original"] = created
+        info["offset"] = "00:00"
+    return info
+
+
+# ----------------------------------------------------------------------------
+def read_info(path):
+    """when a photo or video was taken and the camera that took it, from its
+    headers
+
+    Args:
+        path (str)      the file to read
+
+    Returns:
+        dict with original as "YYYY:MM:DD HH:MM:SS", offset as "+HH:MM" and the
+        camera model, any may be None, or None if the file cannot be read
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError as e:
+        logger.debug(f"cannot open {path}: {e}")
+        return None
+
+    try:
+        reader = HeaderReader(fd)
+        magic = reader.window[:16]
+        if magic[:2] == b"\xff\xd8":
+            info = _jpeg_info(reader)
+        elif magic[:2] in (b"II", b"MM"):
+            info = _tiff_info(reader, 0)
+        elif magic[4:8] == b"ftyp" or magic[4:8] in (b"moov", b"mdat", b"wide", b"free"):
+            info = _isobmff_info(reader)
+        elif magic.startswith(b"FUJIFILMCCD-RAW"):
+            # RAF has a JPEG preview with the EXIF at an offset given in the header
+            (jpeg,) = struct.unpack(">I", reader.read(84, 4))
+            info = _jpeg_info(reader, jpeg)
+            if not info.get("camera"):
+                info["camera"] = reader.read(28, 32).split(b"\0", 1)[0].decode("ascii", errors="replace") or None
+        else:
+            return None
+    except (OSError, struct.error) as e:
+        logger.debug(f"cannot read the headers of {path}: {e}")
+        return None
+    finally:
+        os.close(fd)
+
+    return {"original": info.get("original"), "offset": info.get("offset"), "camera": info.get("camera")}
+
+
+# ----------------------------------------------------------------------------
+def read_date(path):
+    """when a photo or video was taken, from its headers
+
+    Args:
+        path (str)      the file to read
+
+    Returns:
+        (original, offset) with original as "YYYY:MM:DD HH:MM:SS" and offset as
+        "+HH:MM" or None when the file does not say, or None if no date was found
+    """
+    info = read_info(path)
+    if not info or not info["original"]:
+        return None
+    return info["original"], info["offset"]
@@ -0,0 +1,155 @@
+# send only the parts of a PIL image that have changed to an SPI display such
+# as the ST7789 on the mini PiTFT. Drawing code marks the boxes it draws in,
+# when the display is updated each box is compared with what was last sent,
+# and only the pixels that really changed are sent, as a window of the display
+
+# Example usage:
+# frame = FrameDiff(disp, image, rotation=90)
+# draw.rectangle((0, 16, 240, 32), fill="#000000")
+# frame.mark((0, 16, 241, 33))
+# frame.flush()
+
+import math
+
+from PIL import ImageChops
+
+# the commands and window address sent before the pixels of each window
+WINDOW_OVERHEAD = 11
+# RGB565, 2 bytes a pixel
+BYTES_PER_PIXEL = 2
+
+
+# ----------------------------------------------------------------------------
+def merge_boxes(boxes):
+    """merge boxes that overlap or touch, so a run of lines is sent as one
+    window rather than one each
+
+    Args:
+        boxes (list)    of (x0, y0, x1, y1), x1 and y1 are not included
+
+    Returns:
+        list of boxes, none of them overlapping or touching
+    """
+    merged = []
+    for box in sorted(boxes, key=lambda b: (b[1], b[0])):
+        # the box grows as it takes in others, so it may then touch ones
+        # it did not before
+        overlapping = True
+        while overlapping:
+            overlapping = False
+            for other in merged:
+                if box[0] <= other[2] and other[0] <= box[2] and box[1] <= other[3] and other[1] <= box[3]:
+                    merged.remove(other)
+                    box = (min(box[0], other[0]), min(box[1], other[1]), max(box[2], other[2]), max(box[3], other[3]))
+                    overlapping = True
+                    break
+        merged.append(box)
+    return merged
+
+
+# ----------------------------------------------------------------------------
+def window_origin(box, size, rotation):
+    """where a box of the image is on the display, once rotated as
+    disp.image() rotates it, counter clockwise
+
+    Args:
+        box      (tuple)    (x0, y0, x1, y1) in the image
+        size     (tuple)    (width, height) of the image
+        rotation (int)      0, 90, 180 or 270
+
+    Returns:
+        (x, y) of the top left corner of the window on the display
+    """
+    x0, y0, x1, y1 = box
+    width, height = size
+    if rotation == 90:
+        return y0, width - x1
+    if rotation == 180:
+        return width - x1, height - y1
+    if rotation == 270:
+        return height - y1, x0
+    return x0, y0
+
+
+class FrameDiff:
+    """FrameDiff
+    keeps a copy of the frame last sent to the display, and sends only the
+    marked boxes that differ from it
+
+    Args:
+        disp     (object)   display with image(img, rotation, x, y), such as
+                            adafruit_rgb_display's ST7789
+        image    (Image)    the PIL RGB image that is drawn on
+        rotation (int)      as passed to disp.image()
+        partial  (bool)     send windows of the display, when False the whole
+                            frame is sent whenever anything has changed
+    """
+
+    def __init__(self, disp, image, rotation=0, partial=True) -> None:
+        self.disp = disp
+        self.image = image
+        self.rotation = rotation
+        self.partial = partial
+        # what the display is showing, None until the first frame is sent
+        self.shown = None
+        self.dirty = []
+        self.stats = {"updates": 0, "skipped": 0, "windows": 0, "bytes": 0}
+
+    # ----------------------------------------------------------------------------
+    def mark(self, box):
+        """note that a box of the image has been drawn in
+
+        Args:
+            box (tuple)     (x0, y0, x1, y1), x1 and y1 are not included,
+                            floats are rounded outwards
+        """
+        width, height = self.image.size
+        x0 = max(0, math.floor(box[0]))
+        y0 = max(0, math.floor(box[1]))
+        x1 = min(width, math.ceil(box[2]))
+        y1 = min(height, math.ceil(box[3]))
+        if x0 < x1 and y0 < y1:
+            self.dirty.append((x0, y0, x1, y1))
+
+    # ----------------------------------------------------------------------------
+    def mark_all(self):
+        self.dirty = [(0, 0, *self.image.size)]
+
+    # ----------------------------------------------------------------------------
+    def _send(self, box):
+        region = self.image if box == (0, 0, *self.image.size) else self.image.crop(box)
+        x, y = window_origin(box, self.image.size, self.rotation)
+        self.disp.image(region, self.rotation, x, y)
+        self.shown.paste(region, box[:2])
+        self.stats["windows"] += 1
+        self.stats["bytes"] += WINDOW_OVERHEAD + (box[2] - box[0]) * (box[3] - box[1]) * BYTES_PER_PIXEL
+
+    # ----------------------------------------------------------------------------
+    def flush(self):
+        """send whatever has changed in the marked boxes
+
+        Returns:
+            number of windows sent, 0 if nothing had changed
+        """
+        dirty, self.dirty = self.dirty, []
+        full = (0, 0, *self.image.size)
+        if self.shown is None:
+            # nothing to compare the first frame with
+            self.shown = self.image.copy()
+            changes = [full]
+        else:
+            changes = []
+            for box in merge_boxes(dirty):
+                changed = ImageChops.difference(self.image.crop(box), self.shown.crop(box)).getbbox()
+                if changed:
+                    changes.append((box[0] + changed[0], box[1] + changed[1], box[0] + changed[2], box[1] + changed[3]))
+            if changes and not self.partial:
+                changes = [full]
+
+        for box in changes:
+            self._send(box)
+        if changes:
+            self.stats["updates"] += 1
+        elif dirty:
+            self.stats["skipped"] += 1
+        return len(changes)
@@ -0,0 +1,225 @@
+# content hashes of the files in the store, used to find the same shot coming
+# in again from a different card or folder
+
+# Example usage:
+# hashes = HashIndex('/home/user/usb_data/gnarlypi.db')
+# partial = partial_hash(src_path, size)
+# for path, full in hashes.candidates(size, partial):
+#     ...
+
+import os
+import mmap
+import errno
+import hashlib
+import logging
+import threading
+
+from .db import open_db
+
+logger = logging.getLogger("hashindex")
+
+# bytes read from each end of a file for the quick partial hash
+HEAD_TAIL_SIZE = 64 * 1024
+READ_SIZE = 16 * 1024 * 1024
+
+
+# ----------------------------------------------------------------------------
+def new_hasher():
+    """the hash used for whole files, feed it the chunks as they are copied"""
+    return hashlib.blake2b(digest_size=32)
+
+
+# ----------------------------------------------------------------------------
+def partial_hash(path, size=None):
+    """quick hash of the size, the first and the last HEAD_TAIL_SIZE bytes of a
+    file, files that differ here cannot be the same
+
+    Args:
+        path (str)      the file to hash
+        size (int)      size of the file, if known
+
+    Returns:
+        (str) hex digest
+    """
+    if size is None:
+        size = os.path.getsize(path)
+    hasher = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as f:
+        hasher.update(f.read(HEAD_TAIL_SIZE))
+        if size > HEAD_TAIL_SIZE:
+            f.seek(max(HEAD_TAIL_SIZE, size - HEAD_TAIL_SIZE))
+            hasher.update(f.read(HEAD_TAIL_SIZE))
+    return hasher.hexdigest()
+
+
+# ----------------------------------------------------------------------------
+def full_hash(path):
+    """hash the whole of a file, only used on files already in the store"""
+    hasher = new_hasher()
+    with open(path, "rb") as f:
+        while chunk := f.read(READ_SIZE):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+# ----------------------------------------------------------------------------
+def _read_hash(fd, chunk_size):
+    hasher = new_hasher()
+    # mmap memory is page aligned, which O_DIRECT reads need
+    with mmap.mmap(-1, chunk_size) as buf, memoryview(buf) as view:
+        while size := os.readv(fd, [buf]):
+            hasher.update(view[:size])
+    return hasher.hexdigest()
+
+
+def uncached_hash(path, chunk_size=READ_SIZE):
+    """hash the whole of a file as it is on the device rather than what is in
+    the page cache, to check that what was written can be read back. Uses
+    O_DIRECT, or on filesystems that refuse that, drops the file from the cache
+    first. The file should have been fsync'd
+
+    Args:
+        path       (str)    the file to hash
+        chunk_size (int)    bytes per read, a multiple of the page size
+
+    Returns:
+        (str) hex digest
+    """
+    direct = getattr(os, "O_DIRECT", 0)
+    if direct:
+        try:
+            fd = os.open(path, os.O_RDONLY | direct)
+            try:
+                return _read_hash(fd, chunk_size)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            if e.errno != errno.EINVAL:
+                raise
+            logger.debug(f"O_DIRECT not supported for {path}, dropping cache instead")
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        return _read_hash(fd, chunk_size)
+    finally:
+        os.close(fd)
+
+
+class HashIndex:
+    """HashIndex
+    partial and full content hashes for the files in the store, paths are
+    relative to the files directory. The full hash is only filled in when it is
+    known, either calculated during a copy or when it was first needed to
+    confirm a duplicate
+
+    Args:
+        filepath (str)      the database file, shared with the manifest
+    """
+
+    def __init__(self, filepath) -> None:
+        self.filepath = filepath
+        self.lock = threading.Lock()
+        self.db = open_db(filepath)
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS hashes (path TEXT PRIMARY KEY, size INTEGER, partial TEXT, full TEXT)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS hashes_partial ON hashes (size, partial)")
+
+    # ----------------------------------------------------------------------------
+    def candidates(self, size, partial):
+        """files in the store that may have the same content
+
+        Returns:
+            list of (path, full hash or None)
+        """
+        with self.lock:
+            return self.db.execute(
+                "SELECT path, full FROM hashes WHERE size = ? AND partial = ?", (size, partial)
+            ).fetchall()
+
+    # ----------------------------------------------------------------------------
+    def record(self, path, size, partial, full=None):
+        """add or replace a file in the index"""
+        with self.lock:
+            with self.db:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO hashes (path, size, partial, full) VALUES (?, ?, ?, ?)",
+                    (path, size, partial, full),
+                )
+
+    # ----------------------------------------------------------------------------
+    def set_full(self, path, full):
+        """fill in the full hash of a file already in the index"""
+        with self.lock:
+            with self.db:
+                self.db.execute("UPDATE hashes SET full = ? WHERE path = ?", (full, path))
+
+    # ----------------------------------------------------------------------------
+    def forget(self, path):
+        """remove a file that is no longer in the store"""
+        with self.lock:
+            with self.db:
+                self.db.execute("DELETE FROM hashes WHERE path = ?", (path,))
+
+    # ----------------------------------------------------------------------------
+    def find_duplicate(self, root, size, partial, full, exclude=None):
+        """look for a file in the store with the same content, calculating any
+        full hashes that are not yet known from the stored copies
+
+        Args:
+            root    (str)   the files directory the paths are relative to
+            size    (int)   size of the new file
+            partial (str)   partial hash of the new file
+            full    (str)   full hash of the new file
+            exclude (str)   path of the new file itself
+
+        Returns:
+            (str) full path of the matching file or None
+        """
+        for path, known in self.candidates(size, partial):
+            if path == exclude:
+                continue
+            stored = os.path.join(root, path)
+            if known is None:
+                try:
+                    known = full_hash(stored)
+                except OSError:
+                    # removed from the store since it was indexed
+                    self.forget(path)
+                    continue
+                self.set_full(path, known)
+            if known == full and os.path.exists(stored):
+                return stored
+        return None
+
+    # ----------------------------------------------------------------------------
+    def rebuild(self, root):
+        """index the partial hashes of all the files under root, full hashes
+        are worked out later, only when needed
+
+        Returns:
+            (int) the number of files indexed
+        """
+        rows = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            for filename in filenames:
+                if filename.endswith((".tmp", ".tmp.resume")):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    size = os.path.getsize(path)
+                    rows.append((os.path.relpath(path, root), size, partial_hash(path, size), None))
+                except OSError as e:
+                    logger.warning(f"cannot hash {path}: {e}")
+
+        with self.lock:
+            with self.db:
+                self.db.execute("DELETE FROM hashes")
+                self.db.executemany(
+                    "INSERT INTO hashes (path, size, partial, full) VALUES (?, ?, ?, ?)", rows
+                )
+
+        logger.info(f"rebuilt hash index from {root}, {len(rows)} files")
+        return len(rows)
@@ -0,0 +1,276 @@
+# a local message hub, gnarly processes on the same pi publish and subscribe
+# through a unix socket rather than each keeping its own connection to the MQTT
+# server. The hub passes messages on without decoding them, and bin/gnarly_hub
+# bridges them to and from MQTT for anything not on the pi
+#
+# each message is a line, "<op> <topic> <json>\n", op is P to publish, R to
+# publish and retain, and S to subscribe, with the topics in place of the json
+
+# Example usage:
+# hub = Hub('/tmp/gnarlypi.hub')
+# hub.serve_forever()
+#
+# client = HubClient('/tmp/gnarlypi.hub')
+# client.publish('/photos/ready', '{"msg": "ready"}')
+# client.subscribe(['/photos/copydata'])
+# for topic, payload in client.messages():
+#     print(topic, json.loads(payload))
+
+import os
+import socket
+import logging
+import selectors
+import threading
+from collections import deque
+
+logger = logging.getLogger("hub")
+
+DEFAULT_SOCKET = "/tmp/gnarlypi.hub"
+PUBLISH = b"P"
+RETAIN = b"R"
+SUBSCRIBE = b"S"
+READ_SIZE = 64 * 1024
+# a subscriber this far behind is not keeping up, it is dropped rather than
+# holding everything else up
+MAX_BACKLOG = 4 * 1024 * 1024
+
+
+# ----------------------------------------------------------------------------
+def topic_matches(pattern, topic):
+    """does topic match a subscription, with the MQTT wildcards + for one
+    level and # for everything below"""
+    if pattern == topic or pattern == "#":
+        return True
+    parts = pattern.split("/")
+    levels = topic.split("/")
+    for i, part in enumerate(parts):
+        if part == "#":
+            return True
+        if i >= len(levels) or (part != "+" and part != levels[i]):
+            return False
+    return len(parts) == len(levels)
+
+
+class HubClient:
+    """HubClient
+    a connection to the hub, for Messaging to publish and subscribe through
+
+    Args:
+        path (str)      the hub's unix socket
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET) -> None:
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.send_lock = threading.Lock()
+
+    # ----------------------------------------------------------------------------
+    def _send(self, line):
+        with self.send_lock:
+            self.sock.sendall(line)
+
+    # ----------------------------------------------------------------------------
+    def publish(self, topic, payload, retain=False):
+        """send a message, payload is the JSON as a str"""
+        self._send(b"%s %s %s\n" % (RETAIN if retain else PUBLISH, topic.encode(), payload.encode()))
+
+    # ----------------------------------------------------------------------------
+    def subscribe(self, topics):
+        self._send(b"%s %s\n" % (SUBSCRIBE, " ".join(topics).encode()))
+
+    # ----------------------------------------------------------------------------
+    def messages(self):
+        """the messages for the subscribed topics, until the hub goes away
+
+        Yields:
+            (topic, payload) both as str
+        """
+        partial = b""
+        while data := self.sock.recv(READ_SIZE):
+            lines = (partial + data).split(b"\n")
+            partial = lines.pop()
+            for line in lines:
+                op, topic, payload = line.split(b" ", 2)
+                yield topic.decode(), payload.decode()
+
+    # ----------------------------------------------------------------------------
+    def close(self):
+        self.sock.close()
+
+
+class Hub:
+    """Hub
+    passes each message published by a client to every client subscribed to
+    its topic, keeping the last retained message on each topic for new
+    subscribers. Runs in a single thread, a slow subscriber does not hold up
+    the others
+
+    Args:
+        path   (str)        the unix socket to listen on
+        bridge (callable)   called with (topic, payload, retain) as bytes for
+                            every message published by a client
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET, bridge=None) -> None:
+        self.path = path
+        self.bridge = bridge
+        self.selector = selectors.DefaultSelector()
+        # socket: {"buffer", "topics", "backlog", "pending" bytes in the backlog}
+        self.clients = {}
+        # topic: the line to send to new subscribers
+        self.retained = {}
+        # messages from other threads, e.g. the MQTT bridge, waiting to be sent
+        self.injected = deque()
+        self.wake_read, self.wake_write = socket.socketpair()
+        self.wake_read.setblocking(False)
+        self.selector.register(self.wake_read, selectors.EVENT_READ, self._woken)
+
+        if os.path.exists(path):
+            os.remove(path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        # every gnarly process runs as the same user
+        os.chmod(path, 0o600)
+        self.server.listen()
+        self.server.setblocking(False)
+        self.selector.register(self.server, selectors.EVENT_READ, self._accept)
+
+    # ----------------------------------------------------------------------------
+    def _accept(self, sock):
+        conn, addr = sock.accept()
+        conn.setblocking(False)
+        self.clients[conn] = {"buffer": b"", "topics": [], "backlog": deque(), "pending": 0}
+        self.selector.register(conn, selectors.EVENT_READ, self._read)
+
+    # ----------------------------------------------------------------------------
+    def _drop(self, conn):
+        if conn in self.clients:
+            self.selector.unregister(conn)
+            del self.clients[conn]
+            conn.close()
+
+    # ----------------------------------------------------------------------------
+    def _read(self, conn):
+        try:
+            data = conn.recv(READ_SIZE)
+        except OSError:
+            data = b""
+        if not data:
+            self._drop(conn)
+            return
+        client = self.clients[conn]
+        lines = (client["buffer"] + data).split(b"\n")
+        client["buffer"] = lines.pop()
+        for line in lines:
+            # a client can be dropped part way through, e.g. for falling behind
+            if conn not in self.clients:
+                return
+            self._handle(conn, line)
+
+    # ----------------------------------------------------------------------------
+    def _handle(self, conn, line):
+        op, _, rest = line.partition(b" ")
+        if op == SUBSCRIBE:
+            topics = rest.decode().split()
+            self.clients[conn]["topics"].extend(topics)
+            for topic, retained in list(self.retained.items()):
+                if any(topic_matches(pattern, topic) for pattern in topics):
+                    self._queue(conn, retained)
+        elif op in (PUBLISH, RETAIN):
+            topic, _, payload = rest.partition(b" ")
+            self._deliver(topic, payload, op == RETAIN)
+            if self.bridge:
+                self.bridge(topic, payload, op == RETAIN)
+        else:
+            logger.warning(f"unknown message from a client: {line[:80]}")
+
+    # ----------------------------------------------------------------------------
+    def _deliver(self, topic, payload, retain):
+        line = b"%s %s %s\n" % (PUBLISH, topic, payload)
+        name = topic.decode()
+        if retain:
+            self.retained[name] = line
+        for conn, client in list(self.clients.items()):
+            if any(topic_matches(pattern, name) for pattern in client["topics"]):
+                self._queue(conn, line)
+
+    # ----------------------------------------------------------------------------
+    def _queue(self, conn, line):
+        client = self.clients.get(conn)
+        if not client:
+            return
+        if not client["backlog"]:
+            try:
+                sent = conn.send(line)
+            except BlockingIOError:
+                sent = 0
+            except OSError:
+                self._drop(conn)
+                return
+            if sent == len(line):
+                return
+            line = line[sent:]
+            self.selector.modify(conn, selectors.EVENT_READ | selectors.EVENT_WRITE, self._ready)
+        client["backlog"].append(line)
+        client["pending"] += len(line)
+        if client["pending"] > MAX_BACKLOG:
+            logger.warning("dropping a subscriber that is not keeping up")
+            self._drop(conn)
+
+    # ----------------------------------------------------------------------------
+    def _ready(self, conn, mask=selectors.EVENT_WRITE):
+        # the socket is readable or writable, either may be why we were called
+        if mask & selectors.EVENT_READ:
+            self._read(conn)
+        client = self.clients.get(conn)
+        if not client or not mask & selectors.EVENT_WRITE:
+            return
+        backlog = client["backlog"]
+        while backlog:
+            line = backlog[0]
+            try:
+                sent = conn.send(line)
+            except BlockingIOError:
+                return
+            except OSError:
+                self._drop(conn)
+                return
+            client["pending"] -= sent
+            if sent < len(line):
+                backlog[0] = line[sent:]
+                return
+            backlog.popleft()
+        self.selector.modify(conn, selectors.EVENT_READ, self._read)
+
+    # ----------------------------------------------------------------------------
+    def inject(self, topic, payload, retain=False):
+        """deliver a message from another thread to the subscribers, it is
+        not passed to the bridge, as that is where it came from
+
+        Args:
+            topic   (str)
+            payload (bytes)     the JSON
+            retain  (bool)
+        """
+        self.injected.append((topic.encode(), payload, retain))
+        self.wake_write.send(b"\0")
+
+    # ----------------------------------------------------------------------------
+    def _woken(self, sock):
+        try:
+            sock.recv(READ_SIZE)
+        except BlockingIOError:
+            pass
+        while self.injected:
+            self._deliver(*self.injected.popleft())
+
+    # ----------------------------------------------------------------------------
+    def serve_forever(self):
+        logger.info(f"hub listening on {self.path}")
+        while True:
+            for key, mask in self.selector.select():
+                if key.data == self._ready:
+                    self._ready(key.fileobj, mask)
+                else:
+                    key.data(key.fileobj)
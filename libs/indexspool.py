@@ -0,0 +1,143 @@
+# batches of copied files waiting to be indexed, written to spool files in the
+# store so that nothing is lost if the indexer is not running or the pi is
+# turned off, the indexer removes each spool file once it has been indexed
+
+# Example usage:
+# gnarlypi
+# spool = IndexSpool('/home/user/usb_data', 100, status.indexbatch)
+# spool.add('/home/user/usb_data/files/DCIM/100OLYMP/P7110109.ORF', 'sda1')
+# spool.close('sda1')
+#
+# gnarly_indexer
+# for spool_file in pending_batches('/home/user/usb_data'):
+#     filenames = read_batch(spool_file)
+
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger("indexspool")
+
+# directory in the store holding the spool files
+SPOOL_DIR = "indexspool"
+# still being added to, only gnarlypi should touch these
+OPEN_EXT = ".open"
+# complete and waiting for the indexer
+BATCH_EXT = ".batch"
+
+
+# ----------------------------------------------------------------------------
+def spool_dir(store):
+    return os.path.join(store, SPOOL_DIR)
+
+
+# ----------------------------------------------------------------------------
+def pending_batches(store):
+    """the complete spool files waiting to be indexed, oldest first
+
+    Args:
+        store (str)     the gnarlypi store directory
+
+    Returns:
+        list of (str) spool file paths
+    """
+    path = spool_dir(store)
+    if not os.path.isdir(path):
+        return []
+    return sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith(BATCH_EXT))
+
+
+# ----------------------------------------------------------------------------
+def read_batch(spool_file):
+    """the filenames in a spool file, one per line
+
+    Returns:
+        list of (str) filenames, empty if the spool file has already gone
+    """
+    try:
+        with open(spool_file) as f:
+            return [line.rstrip("\n") for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+class IndexSpool:
+    """IndexSpool
+    collects the files copied from each device into spool files, when a spool
+    file has batch_size files in it, or the device has been copied, it is
+    closed and announce is called with its path
+
+    Args:
+        store      (str)        the gnarlypi store directory
+        batch_size (int)        most files in a batch
+        announce   (callable)   called with the path and count of each complete
+                                spool file, e.g. status.indexbatch
+    """
+
+    def __init__(self, store, batch_size, announce) -> None:
+        self.path = spool_dir(store)
+        self.batch_size = max(1, batch_size)
+        self.announce = announce
+        self.lock = threading.Lock()
+        # device: [spool file path, open file, count]
+        self.batches = {}
+        os.makedirs(self.path, exist_ok=True)
+
+    # ----------------------------------------------------------------------------
+    def add(self, filename, device=""):
+        """add a copied file to the batch for its device"""
+        with self.lock:
+            batch = self.batches.get(device)
+            if not batch:
+                name = f"{time.strftime('%Y%m%d-%H%M%S')}-{time.monotonic_ns()}-{device or 'card'}{OPEN_EXT}"
+                path = os.path.join(self.path, name)
+                batch = [path, open(path, "a"), 0]
+                self.batches[device] = batch
+            batch[1].write(f"{filename}\n")
+            # written through to the OS, so a crash of gnarlypi does not lose it
+            batch[1].flush()
+            batch[2] += 1
+            if batch[2] < self.batch_size:
+                return
+            del self.batches[device]
+
+        self._finish(batch)
+
+    # ----------------------------------------------------------------------------
+    def close(self, device=""):
+        """finish the batch for a device, call this when the device has been copied"""
+        with self.lock:
+            batch = self.batches.pop(device, None)
+        if batch:
+            self._finish(batch)
+
+    # ----------------------------------------------------------------------------
+    def _finish(self, batch):
+        path, f, count = batch
+        os.fsync(f.fileno())
+        f.close()
+        done = path[: -len(OPEN_EXT)] + BATCH_EXT
+        os.rename(path, done)
+        logger.debug(f"index batch {done} with {count} files")
+        self.announce(done, count)
+
+    # ----------------------------------------------------------------------------
+    def recover(self):
+        """finish any spool files left open when gnarlypi last stopped, call
+        this at startup before adding anything
+
+        Returns:
+            (int) the number of spool files recovered
+        """
+        recovered = 0
+        for name in sorted(os.listdir(self.path)):
+            if not name.endswith(OPEN_EXT):
+                continue
+            path = os.path.join(self.path, name)
+            with open(path, "a") as f:
+                self._finish([path, f, len(read_batch(path))])
+            recovered += 1
+        if recovered:
+            logger.info(f"recovered {recovered} index batches")
+        return recovered
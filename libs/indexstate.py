@@ -0,0 +1,161 @@
+# what the indexer has already linked, so a re-index only needs to look at the
+# files that have been added, changed, moved or removed since
+
+# Example usage:
+# state = IndexState('/home/user/usb_data/gnarlypi.db')
+# known = state.entries()
+# state.record(src_path, file_key(os.stat(src_path)), '2025/2025-07-11/P7110109.ORF')
+
+import os
+import re
+import logging
+import threading
+
+from .db import open_db
+
+logger = logging.getLogger("indexstate")
+
+# a symlink name with a number added to make it unique, e.g. P7110109-3.ORF
+SUFFIXED_NAME = re.compile(r"^(.*)-(\d+)$")
+
+
+# ----------------------------------------------------------------------------
+def file_key(stat):
+    """what identifies a version of a file, if any of these change it needs
+    indexing again
+
+    Args:
+        stat (os.stat_result)   of the source file
+
+    Returns:
+        (inode, mtime in ns, size)
+    """
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class IndexState:
+    """IndexState
+    each source file that has been indexed, with the key of the version that
+    was indexed and the symlink made for it, relative to the index directory.
+    Also the next free number for each symlink name in each index directory,
+    so unique names can be found without trying each number in turn
+
+    Args:
+        filepath (str)      the database file, shared with the manifest
+    """
+
+    def __init__(self, filepath) -> None:
+        self.filepath = filepath
+        self.lock = threading.Lock()
+        self.db = open_db(filepath)
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS indexed "
+                "(path TEXT PRIMARY KEY, inode INTEGER, mtime INTEGER, size INTEGER, link TEXT)"
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS link_names "
+                "(dir TEXT, name TEXT, next INTEGER, PRIMARY KEY (dir, name))"
+            )
+        # dir: {name: next free number}
+        self.names = {}
+
+    # ----------------------------------------------------------------------------
+    def entries(self):
+        """everything indexed so far
+
+        Returns:
+            dict of path: ((inode, mtime, size), link)
+        """
+        with self.lock:
+            rows = self.db.execute("SELECT path, inode, mtime, size, link FROM indexed").fetchall()
+        return {path: ((inode, mtime, size), link) for path, inode, mtime, size, link in rows}
+
+    # ----------------------------------------------------------------------------
+    def count(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM indexed").fetchone()[0]
+
+    # ----------------------------------------------------------------------------
+    def link_for(self, path):
+        """the symlink made for a source file, relative to the index directory, or None"""
+        with self.lock:
+            row = self.db.execute("SELECT link FROM indexed WHERE path = ?", (path,)).fetchone()
+        return row[0] if row else None
+
+    # ----------------------------------------------------------------------------
+    def _dir_names(self, target_dir):
+        # the first time a directory is used, the saved numbers are loaded or
+        # if there are none, the directory is read once to find them
+        names = self.names.get(target_dir)
+        if names is not None:
+            return names
+
+        names = dict(
+            self.db.execute("SELECT name, next FROM link_names WHERE dir = ?", (target_dir,)).fetchall()
+        )
+        if not names and os.path.isdir(target_dir):
+            for entry in os.listdir(target_dir):
+                base, ext = os.path.splitext(entry)
+                match = SUFFIXED_NAME.match(base)
+                if match:
+                    name = f"{match.group(1)}{ext}"
+                    names[name] = max(names.get(name, 1), int(match.group(2)) + 1)
+        self.names[target_dir] = names
+        return names
+
+    # ----------------------------------------------------------------------------
+    def next_number(self, target_dir, name):
+        """the next number to try when name is already used in target_dir"""
+        with self.lock:
+            return self._dir_names(target_dir).get(name, 1)
+
+    # ----------------------------------------------------------------------------
+    def used_number(self, target_dir, name, number):
+        """number has been used for name in target_dir, the next one is free"""
+        with self.lock:
+            self._dir_names(target_dir)[name] = number + 1
+            with self.db:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO link_names (dir, name, next) VALUES (?, ?, ?)",
+                    (target_dir, name, number + 1),
+                )
+
+    # ----------------------------------------------------------------------------
+    def record(self, path, key, link):
+        """remember that path, as identified by key, is linked as link"""
+        self.record_many([(path, key, link)])
+
+    # ----------------------------------------------------------------------------
+    def record_many(self, items):
+        """record a list of (path, key, link) in one transaction"""
+        rows = [(path, *key, link) for path, key, link in items]
+        with self.lock:
+            with self.db:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO indexed (path, inode, mtime, size, link) VALUES (?, ?, ?, ?, ?)",
+                    rows,
+                )
+
+    # ----------------------------------------------------------------------------
+    def forget_many(self, paths):
+        """remove source files that are no longer in the store"""
+        with self.lock:
+            with self.db:
+                self.db.executemany("DELETE FROM indexed WHERE path = ?", ((path,) for path in paths))
+
+    # ----------------------------------------------------------------------------
+    def clear_names(self):
+        """forget the saved symlink numbers, when the index directories have been replaced"""
+        with self.lock:
+            with self.db:
+                self.db.execute("DELETE FROM link_names")
+            self.names = {}
+
+    # ----------------------------------------------------------------------------
+    def clear(self):
+        """forget everything, before a full rebuild"""
+        with self.lock:
+            with self.db:
+                self.db.execute("DELETE FROM indexed")
+        self.clear_names()
@@ -11,13 +11,16 @@ class Lock:
     prevents main app from running when sub-apps want to do things
 
     Args:
-        filename (str)  File to be used as the lockfile,
-                        there is a default for gnarlypi
+        filename  (str)     File to be used as the lockfile,
+                            there is a default for gnarlypi
+        keep_file (bool)    leave the lockfile in place when released, for
+                            locks taken often, isLocked() cannot then be used
 
     """
 
-    def __init__(self, lockfile=LOCKFILE) -> None:
+    def __init__(self, lockfile=LOCKFILE, keep_file=False) -> None:
         self.lockfile = lockfile
+        self.keep_file = keep_file
         self.lock = fasteners.InterProcessLock(self.lockfile)
 
     """wait for the gnarlypi lock file to be acquired"""
@@ -25,11 +28,16 @@ class Lock:
         self.lock.acquire()
 
 
+    """take the lock if no one else has it, without waiting, True if taken"""
+    def tryLock( self):
+        return self.lock.acquire(blocking=False)
+
+
     """release for the gnarlypi lock file"""
     def releaseLock( self):
         self.lock.release()
         # Release the lock and delete the lock file
-        if os.path.exists(self.lockfile):
+        if not self.keep_file and os.path.exists(self.lockfile):
             os.remove(self.lockfile)
         
     """test if the lockfile is present"""
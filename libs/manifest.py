@@ -0,0 +1,110 @@
+# record of every file already copied into the store, so a re-inserted card can
+# be checked with a dictionary lookup rather than stat'ing the store for each file
+
+# Example usage:
+# manifest = Manifest('/home/user/usb_data/gnarlypi.db')
+# if not manifest.contains('DCIM/100OLYMP/P7110109.ORF', size, mtime):
+#     copy it then
+#     manifest.record('DCIM/100OLYMP/P7110109.ORF', size, mtime)
+
+import os
+import logging
+import threading
+
+from .db import open_db
+
+logger = logging.getLogger("manifest")
+
+
+class Manifest:
+    """Manifest
+    the files in the store, keyed by their path relative to the files directory
+    along with the size and mtime (in whole seconds) of the source they were
+    copied from. The whole manifest is held in memory for lookups, the sqlite
+    database keeps it between runs
+
+    Args:
+        filepath (str)      the database file, created if missing
+    """
+
+    def __init__(self, filepath) -> None:
+        self.filepath = filepath
+        # a missing manifest needs to be rebuilt from the store
+        self.existed = os.path.exists(filepath)
+        self.lock = threading.Lock()
+        self.db = open_db(filepath)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS manifest (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER)"
+        )
+        self.db.commit()
+        self.entries = {
+            path: (size, mtime)
+            for path, size, mtime in self.db.execute("SELECT path, size, mtime FROM manifest")
+        }
+        logger.info(f"manifest {filepath} has {len(self.entries)} files")
+
+    # ----------------------------------------------------------------------------
+    def contains(self, path, size, mtime):
+        """is this version of the file already in the store
+
+        Args:
+            path  (str)         path relative to the files directory
+            size  (int)         size of the source file
+            mtime (float)       modification time of the source file
+
+        Returns:
+            True if the file has been copied already
+        """
+        return self.entries.get(path) == (size, int(mtime))
+
+    # ----------------------------------------------------------------------------
+    def record(self, path, size, mtime):
+        """remember a file that is now in the store, call this after the file
+        has been renamed into place
+
+        Args are the same as contains
+        """
+        with self.lock:
+            with self.db:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO manifest (path, size, mtime) VALUES (?, ?, ?)",
+                    (path, size, int(mtime)),
+                )
+            self.entries[path] = (size, int(mtime))
+
+    # ----------------------------------------------------------------------------
+    def rebuild(self, root):
+        """throw away the manifest and rebuild it from the files under root,
+        partially copied .tmp files and their .resume sidecars are left out
+
+        Args:
+            root (str)      the files directory of the store
+
+        Returns:
+            (int) the number of files in the manifest
+        """
+        entries = {}
+        for dirpath, dirnames, filenames in os.walk(root):
+            for filename in filenames:
+                if filename.endswith((".tmp", ".tmp.resume")):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError as e:
+                    logger.warning(f"cannot add {path} to the manifest: {e}")
+                    continue
+                entries[os.path.relpath(path, root)] = (stat.st_size, int(stat.st_mtime))
+
+        with self.lock:
+            with self.db:
+                self.db.execute("DELETE FROM manifest")
+                self.db.executemany(
+                    "INSERT INTO manifest (path, size, mtime) VALUES (?, ?, ?)",
+                    ((path, size, mtime) for path, (size, mtime) in entries.items()),
+                )
+            self.entries = entries
+        self.existed = True
+
+        logger.info(f"rebuilt manifest from {root}, {len(entries)} files")
+        return len(entries)
@@ -3,10 +3,15 @@
 # http://www.steves-internet-guide.com/client-connections-python-mqtt/
 
 import paho.mqtt.client as paho
+import os
 import json
 import time
 import logging
+import threading
 import uuid
+from collections import deque
+
+from .hub import HubClient
 
 logger = logging.getLogger("messaging")
 
@@ -14,17 +19,55 @@ FIRST_RECONNECT_DELAY = 1
 RECONNECT_RATE = 2
 MAX_RECONNECT_COUNT = 12
 MAX_RECONNECT_DELAY = 60
+# how often a publisher that fell back to MQTT tries the hub again
+HUB_RETRY = 30
+# messages waiting for the sender thread, beyond this coalesce and drop
+# messages are thrown away, keep messages are only thrown away past KEEP_LIMIT
+QUEUE_SIZE = 500
+KEEP_LIMIT = 5000
+# what happens to a message when one on the same topic, and for the same
+# device, is still waiting, coalesce replaces the waiting one, drop and keep
+# queue it behind, but when the queue is full drop messages are thrown away.
+# Anything not listed is keep
+PUBLISH_POLICIES = {
+    "/photos/copydata": "coalesce",
+    "/photos/devicedata": "coalesce",
+    "/photos/fivelines": "coalesce",
+    "/photos/keepalive": "drop",
+}
 
 
 class Messaging:
-
-    def __init__(self) -> None:
+    """Messaging
+    publish and subscribe to the gnarlypi topics, through the local hub
+    (bin/gnarly_hub) when one is given and running, otherwise through MQTT
+
+    Messages are published from a queue by a sender thread, so a caller is
+    never held up while the connection is made again
+
+    Args:
+        hub      (str)      the hub's unix socket, e.g. config.get("messaging.hub"),
+                            None to always use MQTT
+        policies (dict)     coalesce, drop or keep, keyed by topic, overrides
+                            PUBLISH_POLICIES
+    """
+
+    def __init__(self, hub=None, policies=None) -> None:
+        self.policies = {**PUBLISH_POLICIES, **(policies or {})}
+        self.queue_cond = threading.Condition()
+        self._reset_queue()
+        self.hub_path = hub
+        self.hub = None
+        self.hub_retry = 0
         self.connected = False
         self.client = None
         self.topic_handlers = {}
         self.server = ""
         self.subscribe_qos = 1
+        self.on_subscribed = None
         self.loop_started = False
+        # several copy threads may publish at once, only one should reconnect
+        self.connect_lock = threading.Lock()
 
     # ----------------------------------------------------------------------------
     def on_disconnect(self, client, userdata, disconnect_flags, reason_code, properties):
@@ -96,6 +139,8 @@ class Messaging:
                 self.client.subscribe(topic, qos=self.subscribe_qos)
             # Catch anything else
             self.client.subscribe("#", qos=self.subscribe_qos)
+            if self.on_subscribed:
+                self.on_subscribed()
         else:
             logger.info("Failed to connect, return code: {}".format(reason_code))
 
@@ -107,16 +152,39 @@ class Messaging:
         # Identify topic and call appropriate handler function
         # we will ignore the user data and pull out the payload
         # for this usecase not much else is needed
-        topic = message.topic
+        self.dispatch(message.topic, message.payload.decode())
+        # else:
+        #     self.handle_all(client, userdata, message)
+
+
+    # ----------------------------------------------------------------------------
+    def dispatch(self, topic, payload):
+        """call the handler for a topic with the decoded message"""
         if topic in self.topic_handlers:
 
             try:
-                self.topic_handlers[topic](topic=topic, data=json.loads(message.payload.decode()))
+                self.topic_handlers[topic](topic=topic, data=json.loads(payload))
             except Exception as err:
-                logger.info( f"likely message is not JSON topic:{topic}, message:{message.payload.decode()}")
+                logger.info( f"likely message is not JSON topic:{topic}, message:{payload}")
                 logger.info(f"{type(err).__name__} was raised eventually in topics_on_message: {err}")
-        # else:
-        #     self.handle_all(client, userdata, message)
+
+
+    # ----------------------------------------------------------------------------
+    def connect_hub(self):
+        """connect to the local hub, if there is one
+
+        Returns:
+            True if connected
+        """
+        self.hub_retry = time.monotonic() + HUB_RETRY
+        try:
+            self.hub = HubClient(self.hub_path)
+            logger.info(f"Connected to hub: {self.hub_path}")
+            return True
+        except OSError as err:
+            logger.info(f"hub {self.hub_path} is not available ({err}), using MQTT")
+            self.hub = None
+            return False
 
 
     # ----------------------------------------------------------------------------
@@ -124,15 +192,38 @@ class Messaging:
     # will then loop forever waiting for topics to be pubished
 
 
-    def connect(self, handlers=None, server="localhost", port=1883, client_id=None, clean_session=True, subscribe_qos=1):
+    def connect(self, handlers=None, server="localhost", port=1883, client_id=None, clean_session=True, subscribe_qos=1, use_hub=True, on_subscribed=None):
         """
-        Connect to MQTT server with exponential backoff retry.
+        Connect to the hub if there is one, otherwise to the MQTT server with
+        exponential backoff retry.
         Useful for Raspberry Pi startups where MQTT service may not be ready immediately.
+        on_subscribed is called each time the handlers' topics have been
+        subscribed to, including after a reconnect, to catch up on anything
+        published while there was no connection.
         """
         self.server = server
         self.subscribe_qos = subscribe_qos
+        self.on_subscribed = on_subscribed
         
         self.loop_started = False
+
+        if use_hub and self.hub_path and self.connect_hub():
+            if not handlers:
+                return
+            self.topic_handlers = handlers
+            self.hub.subscribe(list(handlers))
+            if on_subscribed:
+                on_subscribed()
+            # loop forever, unless the hub goes away, then carry on over MQTT
+            try:
+                for topic, payload in self.hub.messages():
+                    self.dispatch(topic, payload)
+            except OSError as err:
+                logger.warning(f"lost the hub: {err}")
+            logger.warning("hub closed, subscribing over MQTT instead")
+            self.hub.close()
+            self.hub = None
+            self.hub_path = None
         
         # logger.debug(f"Connecting to MQTT server: {server}:{port}")
 
@@ -188,21 +279,146 @@ class Messaging:
             self.loop_started = True
 
 
+    # ----------------------------------------------------------------------------
+    def _reset_queue(self):
+        # the sender thread does not survive a fork, so start again in the child
+        self.pid = os.getpid()
+        self.sender = None
+        # (topic, device) in the order they are to be sent, with the messages
+        # for each, a coalesced topic only ever has one message waiting for
+        # each device, so cards copied at once do not replace each other
+        self.pending = deque()
+        self.waiting = {}
+        self.depth = 0
+        # topic: {queued, sent, coalesced, dropped, max_depth, latency, max_latency}
+        self.counters = {}
+
     # ----------------------------------------------------------------------------
     def publish(self, subtopic, data=None, retain=False):
         """
-        Publish a message with optional MQTT QoS and retained delivery settings.
+        Queue a message to be published with optional MQTT retained delivery,
+        returns straight away.
         """
         if data is None:
             data = {}
+        # time in seconds since epoch
+        data["_epoch"] = int(time.time())
+        policy = self.policies.get(subtopic, "keep")
+
+        with self.queue_cond:
+            if self.pid != os.getpid():
+                self._reset_queue()
+            counters = self.counters.setdefault(
+                subtopic,
+                {"queued": 0, "sent": 0, "coalesced": 0, "dropped": 0, "max_depth": 0, "latency": 0.0, "max_latency": 0.0},
+            )
+            counters["queued"] += 1
+            key = (subtopic, data.get("device", ""))
+            waiting = self.waiting.get(key)
+            if policy == "coalesce" and waiting:
+                # keep its place in the queue, but send the latest
+                waiting[0] = (data, retain, waiting[0][2])
+                counters["coalesced"] += 1
+                return
+            if self.depth >= (KEEP_LIMIT if policy == "keep" else QUEUE_SIZE):
+                counters["dropped"] += 1
+                if policy == "keep":
+                    logger.error(f"publish queue full, dropped a message to {subtopic}")
+                return
+
+            if waiting is None:
+                waiting = self.waiting[key] = deque()
+            if not waiting or policy != "coalesce":
+                self.pending.append(key)
+            waiting.append((data, retain, time.monotonic()))
+            self.depth += 1
+            counters["max_depth"] = max(counters["max_depth"], self.depth)
+
+            if not self.sender:
+                self.sender = threading.Thread(target=self._sender, daemon=True)
+                self.sender.start()
+            self.queue_cond.notify()
+
+    # ----------------------------------------------------------------------------
+    def _sender(self):
+        """the sender thread, publishes the queued messages in order"""
+        while True:
+            with self.queue_cond:
+                while not self.pending:
+                    self.queue_cond.wait()
+                key = self.pending.popleft()
+                subtopic = key[0]
+                waiting = self.waiting[key]
+                data, retain, queued_at = waiting.popleft()
+                if not waiting:
+                    del self.waiting[key]
+                self.depth -= 1
+
+            self._send(subtopic, data, retain)
+
+            with self.queue_cond:
+                counters = self.counters[subtopic]
+                latency = time.monotonic() - queued_at
+                counters["sent"] += 1
+                counters["latency"] += latency
+                counters["max_latency"] = max(counters["max_latency"], latency)
+                self.queue_cond.notify_all()
+
+    # ----------------------------------------------------------------------------
+    def flush(self, timeout=5):
+        """wait for the queued messages to be sent
+
+        Returns:
+            True if the queue emptied before timeout
+        """
+        end = time.monotonic() + timeout
+        with self.queue_cond:
+            while self.depth and self.pid == os.getpid():
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.queue_cond.wait(remaining)
+        return True
+
+    # ----------------------------------------------------------------------------
+    def stats(self):
+        """the counters for each topic, with the average latency in seconds
+
+        Returns:
+            dict of topic: {queued, sent, coalesced, dropped, max_depth,
+            latency, max_latency}
+        """
+        with self.queue_cond:
+            stats = {}
+            for topic, counters in self.counters.items():
+                stats[topic] = dict(counters)
+                stats[topic]["latency"] = counters["latency"] / counters["sent"] if counters["sent"] else 0.0
+            return stats
+
+    # ----------------------------------------------------------------------------
+    def _send(self, subtopic, data, retain=False):
+        """publish a message now, from the sender thread, connecting again
+        first if needed"""
+        if self.hub_path and not self.hub and time.monotonic() >= self.hub_retry:
+            with self.connect_lock:
+                if not self.hub:
+                    self.connect_hub()
+        if self.hub:
+            try:
+                self.hub.publish(subtopic, json.dumps(data), retain)
+                return
+            except OSError as err:
+                logger.warning(f"lost the hub: {err}, publishing over MQTT")
+                self.hub.close()
+                self.hub = None
 
         # attempt a reconnect if needed
         if not self.connected:
-            self.connect()
+            with self.connect_lock:
+                if not self.connected:
+                    self.connect(use_hub=False)
 
         if self.connected:
-            # time in seconds since epoch
-            data["_epoch"] = int(time.time())
             stats = self.client.publish(f"{subtopic}", json.dumps(data), qos=1, retain=retain)
             # logger.debug(f"Published to {subtopic}: {data}, stats {stats}")
         else:
@@ -216,5 +432,10 @@ class Messaging:
     def client_disconnect(self):
         """
         """
+        # let anything still queued go first
+        self.flush()
+        if self.hub:
+            self.hub.close()
+            self.hub = None
         if self.connected:
             self.client.disconnect()
\ No newline at end of file
@@ -0,0 +1,241 @@
+# keep partly copied files, so a copy that failed part way through (card pulled,
+# read error on a flaky reader) can carry on from where it got to next time
+
+# Example usage:
+# blocks = BlockSums(READ_SIZE, hasher)
+# offset = resume_offset(tmpdest, src_stat, READ_SIZE, blocks, src_path)
+# ... copy from offset, with blocks as the hasher ...
+# on failure
+# save_partial(tmpdest, src_stat, READ_SIZE, blocks.sums)
+
+import os
+import json
+import time
+import zlib
+import logging
+
+logger = logging.getLogger("resume")
+
+# the sidecar beside the .tmp file, holding the source identity and block checksums
+SIDECAR = ".resume"
+
+
+# ----------------------------------------------------------------------------
+def sidecar_name(tmpdest):
+    return f"{tmpdest}{SIDECAR}"
+
+
+# ----------------------------------------------------------------------------
+def block_sums(path, block_size, count=None):
+    """adler32 of each complete block_size block at the start of a file
+
+    Args:
+        path       (str)    the file to checksum
+        block_size (int)    bytes per block
+        count      (int)    stop after this many blocks
+
+    Returns:
+        list of (int) checksums
+    """
+    sums = []
+    with open(path, "rb") as f:
+        while count is None or len(sums) < count:
+            block = f.read(block_size)
+            if len(block) != block_size:
+                break
+            sums.append(zlib.adler32(block))
+    return sums
+
+
+class BlockSums:
+    """BlockSums
+    adler32 of each complete block of the data passed through it, used as the
+    hasher of a copy so the sums are of the source as it was read, rather than
+    of whatever reached the partial file
+
+    Args:
+        block_size (int)        bytes per block
+        hasher     (hashlib)    optional, also fed everything passed through
+    """
+
+    def __init__(self, block_size, hasher=None) -> None:
+        self.block_size = block_size
+        self.hasher = hasher
+        self.sums = []
+        self.block = bytearray()
+
+    # ----------------------------------------------------------------------------
+    def update(self, data):
+        if self.hasher:
+            self.hasher.update(data)
+        view = memoryview(data)
+        while len(view):
+            take = min(len(view), self.block_size - len(self.block))
+            self.block += view[:take]
+            view = view[take:]
+            if len(self.block) == self.block_size:
+                self.sums.append(zlib.adler32(self.block))
+                self.block = bytearray()
+
+
+# ----------------------------------------------------------------------------
+def remove_partial(tmpdest):
+    """delete a partial file and its sidecar, if they exist"""
+    for path in (tmpdest, sidecar_name(tmpdest)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# ----------------------------------------------------------------------------
+def save_partial(tmpdest, src_stat, block_size, sums=None):
+    """keep what has been copied into tmpdest after a copy has failed, with
+    the checksums of its complete blocks, so they can be checked before being
+    trusted next time
+
+    Args:
+        tmpdest    (str)        the partly copied file
+        src_stat   (os.stat)    of the source, so we only resume the same file
+        block_size (int)        bytes per checksummed block
+        sums       (list)       the BlockSums.sums of the source as it was
+                                copied, without them the partial file itself
+                                is checksummed, which only shows it does not
+                                change before it is resumed
+
+    Returns:
+        True if there was something worth keeping
+    """
+    try:
+        with open(tmpdest, "rb+") as f:
+            os.fsync(f.fileno())
+            complete = os.fstat(f.fileno()).st_size // block_size
+        if sums is None:
+            sums = block_sums(tmpdest, block_size)
+        # a block read from the source may not have been written out
+        sums = sums[:complete]
+    except OSError as e:
+        logger.warning(f"cannot keep partial copy {tmpdest}: {e}")
+        sums = []
+
+    if not sums:
+        remove_partial(tmpdest)
+        return False
+
+    # anything after the last complete block is not trusted
+    os.truncate(tmpdest, len(sums) * block_size)
+    with open(sidecar_name(tmpdest), "w") as f:
+        json.dump(
+            {
+                "size": src_stat.st_size,
+                "mtime": src_stat.st_mtime,
+                "block_size": block_size,
+                "sums": sums,
+            },
+            f,
+        )
+    logger.info(f"kept {len(sums) * block_size} bytes of {tmpdest} to resume later")
+    return True
+
+
+# ----------------------------------------------------------------------------
+def resume_offset(tmpdest, src_stat, block_size, hasher=None, src_path=None):
+    """work out where a copy into tmpdest can carry on from. The blocks already
+    in tmpdest are checked against the saved checksums, only the run of good
+    blocks at the start is kept. The sidecar is removed, it is written again
+    if this copy fails too
+
+    Args:
+        tmpdest    (str)        where the file is being copied to
+        src_stat   (os.stat)    of the source file
+        block_size (int)        bytes per checksummed block
+        hasher     (hashlib)    optional, fed the kept blocks so it can carry on
+                                hashing the rest of the file as it is copied,
+                                start with a new one if nothing is resumed
+        src_path   (str)        optional, the last kept block is read again
+                                from the source and must match, a flaky card
+                                is most likely to have gone wrong just before
+                                the copy failed
+
+    Returns:
+        (int) offset to start copying from, 0 if there is nothing to resume
+    """
+    if not os.path.exists(sidecar_name(tmpdest)):
+        # nothing kept, the normal case
+        return 0
+    try:
+        with open(sidecar_name(tmpdest)) as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        remove_partial(tmpdest)
+        return 0
+
+    if (
+        saved.get("size") != src_stat.st_size
+        or saved.get("mtime") != src_stat.st_mtime
+        or saved.get("block_size") != block_size
+    ):
+        logger.info(f"source of {tmpdest} has changed, starting again")
+        remove_partial(tmpdest)
+        return 0
+
+    offset = 0
+    try:
+        with open(tmpdest, "rb") as f:
+            for expected in saved["sums"]:
+                block = f.read(block_size)
+                if len(block) != block_size or zlib.adler32(block) != expected:
+                    logger.warning(f"{tmpdest} is damaged after {offset} bytes")
+                    break
+                if hasher:
+                    hasher.update(block)
+                offset += block_size
+        if offset and src_path:
+            with open(src_path, "rb") as f:
+                f.seek(offset - block_size)
+                if zlib.adler32(f.read(block_size)) != saved["sums"][offset // block_size - 1]:
+                    logger.warning(f"{src_path} does not match what was kept in {tmpdest}, starting again")
+                    offset = 0
+    except OSError as e:
+        logger.warning(f"cannot check {tmpdest}: {e}")
+        offset = 0
+
+    os.remove(sidecar_name(tmpdest))
+    if not offset:
+        remove_partial(tmpdest)
+        return 0
+
+    logger.info(f"resuming {tmpdest} from {offset} bytes")
+    return offset
+
+
+# ----------------------------------------------------------------------------
+def cleanup_partials(root, max_age):
+    """remove partial copies that have not been resumed in time, and any .tmp
+    files without a sidecar, as those cannot be resumed
+
+    Args:
+        root    (str)   directory to search
+        max_age (int)   seconds before a partial copy is given up on
+
+    Returns:
+        (int) number of partial files removed
+    """
+    removed = 0
+    oldest = time.time() - max_age
+    for dirpath, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            if not filename.endswith(".tmp"):
+                continue
+            tmpdest = os.path.join(dirpath, filename)
+            sidecar = sidecar_name(tmpdest)
+            try:
+                if not os.path.exists(sidecar) or os.path.getmtime(sidecar) < oldest:
+                    remove_partial(tmpdest)
+                    removed += 1
+            except OSError as e:
+                logger.warning(f"cannot clean up {tmpdest}: {e}")
+
+    if removed:
+        logger.info(f"removed {removed} stale partial copies from {root}")
+    return removed
@@ -0,0 +1,125 @@
+# parse the output of rsync -i --progress as it arrives, reading the pipe in
+# blocks rather than a line at a time. rsync ends its progress updates with \r
+# and only the last one for each file with \n, so both end a line here, and
+# each line is turned into an event with a single precompiled pattern
+
+# Example usage:
+# proc = subprocess.Popen(["rsync", "-ai", "--progress", src, dst], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+# for event in read_events(proc.stdout.fileno()):
+#     if isinstance(event, FileEvent) and event.transferred:
+#         print("sending", event.path)
+#     elif isinstance(event, ProgressEvent):
+#         print(event.copied, event.bps, event.done)
+
+import os
+import re
+from collections import namedtuple
+
+READ_SIZE = 64 * 1024
+
+# an itemise line, one for each file rsync looks at
+FileEvent = namedtuple("FileEvent", ["flags", "path", "transferred"])
+# a --progress update for the current file, done is True on its last one
+ProgressEvent = namedtuple("ProgressEvent", ["copied", "percent", "bps", "done", "to_check", "total"])
+# anything else, such as a warning or error
+MessageEvent = namedtuple("MessageEvent", ["text"])
+
+# "<11-char-flags> <relative-path>", e.g. ">f+++++++++ photos/IMG_001.jpg"
+ITEMISE = re.compile(rb"([<>ch.][fdLDS]\S*) +(.+)")
+# "    1,048,576 100%   45.23MB/s    0:00:00 (xfr#3, to-chk=97/500)"
+PROGRESS = re.compile(
+    rb" *([\d,]+) +(\d+)% +([\d.]+)([kKMG]?)B/s +\S+(?: +\(xfr#\d+, (?:to|ir)-chk=(\d+)/(\d+)\))?"
+)
+LINE_ENDS = re.compile(rb"[\r\n]")
+
+# Itemise flag prefixes that indicate actual data was transferred.
+# '>' = file sent to remote, '<' = file received, 'c' = checksum transfer.
+TRANSFER_FLAGS = frozenset(b"><c")
+FILE_FLAG = ord("f")
+
+UNITS = {b"": 1, b"k": 1024, b"K": 1024, b"M": 1024 * 1024, b"G": 1024 * 1024 * 1024}
+
+
+# ----------------------------------------------------------------------------
+def parse_line(line):
+    """turn a line of rsync output into an event
+
+    Args:
+        line (bytes)    without its line end
+
+    Returns:
+        FileEvent, ProgressEvent, MessageEvent or None for a blank line
+    """
+    if not line.strip():
+        return None
+    # progress lines start with spaces or digits, itemise lines never do
+    if line[0] in b" 0123456789":
+        match = PROGRESS.match(line)
+        if match:
+            copied, percent, speed, unit, to_check, total = match.groups()
+            return ProgressEvent(
+                int(copied.replace(b",", b"")),
+                int(percent),
+                int(float(speed) * UNITS[unit]),
+                to_check is not None,
+                int(to_check) if to_check is not None else None,
+                int(total) if total is not None else None,
+            )
+    else:
+        match = ITEMISE.fullmatch(line)
+        if match:
+            flags = match.group(1)
+            transferred = flags[0] in TRANSFER_FLAGS and flags[1] == FILE_FLAG
+            return FileEvent(flags.decode(), os.fsdecode(match.group(2)), transferred)
+    return MessageEvent(line.decode(errors="replace").strip())
+
+
+class RsyncParser:
+    """RsyncParser
+    collects output a block at a time, returning the events for the lines
+    that are complete, a partial line is kept until the rest arrives
+    """
+
+    def __init__(self) -> None:
+        self.partial = b""
+
+    # ----------------------------------------------------------------------------
+    def feed(self, data):
+        """add a block of output
+
+        Returns:
+            list of events for the lines it completed
+        """
+        lines = LINE_ENDS.split(self.partial + data)
+        self.partial = lines.pop()
+        events = []
+        for line in lines:
+            event = parse_line(line)
+            if event:
+                events.append(event)
+        return events
+
+    # ----------------------------------------------------------------------------
+    def close(self):
+        """the output has ended, returns any events for a last unterminated line"""
+        event = parse_line(self.partial) if self.partial else None
+        self.partial = b""
+        return [event] if event else []
+
+
+# ----------------------------------------------------------------------------
+def read_events(fd, read_size=READ_SIZE):
+    """the events from a pipe as they arrive, os.read returns whatever is
+    waiting, up to read_size, so updates are not held back to fill a block
+
+    Args:
+        fd        (int)     file descriptor of the pipe, e.g. proc.stdout.fileno()
+        read_size (int)     the most to read at a time
+
+    Yields:
+        events until the pipe is closed
+    """
+    parser = RsyncParser()
+    while data := os.read(fd, read_size):
+        yield from parser.feed(data)
+    yield from parser.close()
@@ -0,0 +1,154 @@
+# run a backup as several rsync processes at once, each with its own share of
+# the files to send, as a single rsync over WiFi rarely gets near what the link
+# can carry. The progress of all of them is merged into one, so the status
+# devices show the backup as a whole
+
+# Example usage:
+# shards = shard_by_size([('index/2026/2026-07-11/P7110109.ORF', 19616732), ...], 3)
+# streams = MultiStream('/home/user/usb_data/index', 'user@nas:/backup', shards, progress=show)
+# ok = streams.run()
+
+import os
+import logging
+import tempfile
+import threading
+import subprocess
+
+from .rsync_parser import FileEvent, ProgressEvent, MessageEvent, read_events
+
+logger = logging.getLogger("rsync_streams")
+
+# as the single rsync run, but without -r as each file is listed
+RSYNC_ARGS = [
+    "rsync", "-ai",
+    "--progress",
+    "--exclude=*.tmp",
+    "--exclude=*.tmp.resume",
+    "--copy-links",
+]
+
+
+# ----------------------------------------------------------------------------
+def transfer_base(source):
+    """the directory rsync paths are relative to, as with rsync a source
+    without a trailing / is itself made in the destination"""
+    return source if source.endswith("/") else os.path.dirname(source) + "/"
+
+
+# ----------------------------------------------------------------------------
+def shard_by_size(files, streams):
+    """share files between streams so each has about the same number of bytes
+    to send, the biggest files are given out first each to the stream with the
+    least so far
+
+    Args:
+        files   (list)  of (path, size)
+        streams (int)   how many shards
+
+    Returns:
+        list of lists of (path, size), without any empty shards
+    """
+    shards = [[] for _ in range(max(1, streams))]
+    totals = [0] * len(shards)
+    for path, size in sorted(files, key=lambda item: item[1], reverse=True):
+        smallest = totals.index(min(totals))
+        shards[smallest].append((path, size))
+        totals[smallest] += size
+    return [shard for shard in shards if shard]
+
+
+class MultiStream:
+    """MultiStream
+    an rsync process per shard, each given its files with --files-from, the
+    progress from them all is reported together
+
+    Args:
+        source      (str)       as given to rsync, the files in the shards are
+                                relative to transfer_base(source)
+        destination (str)       as given to rsync
+        shards      (list)      from shard_by_size
+        args        (list)      the rsync command, without paths
+        progress    (callable)  called with (fromfile, filesize, bytes_copied,
+                                files_copied, file_count, bps), bps and
+                                files_copied are for all of the streams
+    """
+
+    def __init__(self, source, destination, shards, args=None, progress=None) -> None:
+        self.base = transfer_base(source)
+        self.destination = destination
+        self.shards = shards
+        self.args = args or RSYNC_ARGS
+        self.progress = progress
+        self.file_count = sum(len(shard) for shard in shards)
+        self.lock = threading.Lock()
+        self.transferred = 0
+        # the current speed of each stream
+        self.bps = [0] * len(shards)
+        self.failed = []
+
+    # ----------------------------------------------------------------------------
+    def _report(self, stream, fromfile, size, copied, bps=0, done=False):
+        with self.lock:
+            self.bps[stream] = bps
+            if done:
+                self.transferred += 1
+            total_bps = sum(self.bps)
+            transferred = self.transferred
+        if self.progress:
+            self.progress(fromfile, size, copied, transferred, self.file_count, total_bps)
+
+    # ----------------------------------------------------------------------------
+    def _run_stream(self, stream, shard):
+        sizes = dict(shard)
+        with tempfile.NamedTemporaryFile("wb", prefix="gnarly_rsync", suffix=".files") as files_from:
+            files_from.write(b"\0".join(os.fsencode(path) for path, size in shard) + b"\0")
+            files_from.flush()
+            cmd = [*self.args, "--from0", f"--files-from={files_from.name}", self.base, self.destination]
+            logger.debug(f"stream {stream}: {len(shard)} files")
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            current = None
+            current_done = False
+            output = []
+            for event in read_events(proc.stdout.fileno()):
+                if isinstance(event, FileEvent):
+                    current = event.path
+                    current_done = False
+                elif isinstance(event, ProgressEvent) and current:
+                    done = event.done and not current_done
+                    current_done = current_done or done
+                    self._report(
+                        stream,
+                        os.path.join(self.base, current),
+                        sizes.get(current, 0),
+                        event.copied,
+                        event.bps,
+                        done,
+                    )
+                elif isinstance(event, MessageEvent):
+                    output.append(event.text)
+            proc.wait()
+
+        with self.lock:
+            self.bps[stream] = 0
+        if proc.returncode != 0:
+            logger.error(f"rsync stream {stream} exited with code {proc.returncode}: {' '.join(output[-5:])}")
+            with self.lock:
+                self.failed.append(stream)
+
+    # ----------------------------------------------------------------------------
+    def run(self):
+        """run all of the streams and wait for them to finish
+
+        Returns:
+            True if every stream completed without errors
+        """
+        logger.info(f"sending {self.file_count} files in {len(self.shards)} streams")
+        threads = [
+            threading.Thread(target=self._run_stream, args=(stream, shard), daemon=True)
+            for stream, shard in enumerate(self.shards)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return not self.failed
@@ -1,8 +1,32 @@
  #!/usr/bin/env python3
 
+import os
+import time
 import uuid
+import logging
+import threading
 from .messaging import Messaging
 
+logger = logging.getLogger("status")
+
+# minimum seconds between messages on these topics, only the latest message in
+# each interval is sent, older ones are dropped as they are out of date anyway
+COALESCE_INTERVALS = {"copydata": 0.25, "keepalive": 1.0}
+# state changes, any held back messages are sent before these so the displays
+# see the final progress first
+FLUSH_TOPICS = frozenset(
+    [
+        "/photos/startcopy",
+        "/photos/endcopy",
+        "/photos/error",
+        "/photos/diskfull",
+        "/photos/waitremove",
+        "/photos/ready",
+        "/photos/inserted",
+        "/photos/cls",
+    ]
+)
+
 # ----------------------------------------------------------------------------
 
 
@@ -14,11 +38,26 @@ class Status:
     Args:
         server (str)            defaults to localhost
         client_id (str)         unique MQTT client ID. Defaults to a random UUID.
+        intervals (dict)        minimum seconds between messages, keyed by topic
+                                name without the /photos/ prefix, overrides
+                                COALESCE_INTERVALS, 0 sends every message
+        hub       (str)         the local hub's unix socket, None for MQTT only
+        policies  (dict)        how each topic is queued when messages are
+                                waiting to be published, see PUBLISH_POLICIES
     """
     
     
-    def __init__(self, server="localhost", client_id=None) -> None:
+    def __init__(self, server="localhost", client_id=None, intervals=None, hub=None, policies=None) -> None:
         self.server = server
+
+        self.intervals = {}
+        for name, interval in {**COALESCE_INTERVALS, **(intervals or {})}.items():
+            if interval:
+                self.intervals[f"/photos/{name}"] = float(interval)
+        self.coalesce_lock = threading.Lock()
+        # number of messages that were replaced by a later one before being sent
+        self.saved = 0
+        self._reset_coalesce()
         
         # Generate a unique UUID-based client ID if none is provided
         if client_id is None:
@@ -26,11 +65,87 @@ class Status:
         else:
             self.client_id = client_id
 
-        self.msg = Messaging()
+        self.msg = Messaging(hub, policies)
         
         # Pass the client_id explicitly to the Messaging connect method
         self.msg.connect(None, self.server, client_id=self.client_id)
 
+    # ----------------------------------------------------------------------------
+    def _reset_coalesce(self):
+        # timer threads do not survive a fork, so start again in the child
+        self.pid = os.getpid()
+        self.last_sent = {}
+        self.pending = {}
+        self.timers = {}
+
+    # ----------------------------------------------------------------------------
+    def _publish(self, topic, data=None, **kwargs):
+        """publish a message, holding back messages on the coalesced topics
+        when one was sent too recently, a timer sends the latest one when the
+        interval is up. Progress for each device is kept separately
+        """
+        interval = self.intervals.get(topic)
+        if not interval:
+            if topic in FLUSH_TOPICS:
+                # held under the lock, so a timer cannot queue stale progress
+                # after the change of state
+                with self.coalesce_lock:
+                    self._flush_pending()
+                    self.msg.publish(topic, data, **kwargs)
+            else:
+                self.msg.publish(topic, data, **kwargs)
+            return
+
+        key = (topic, (data or {}).get("device", ""))
+        with self.coalesce_lock:
+            if self.pid != os.getpid():
+                self._reset_coalesce()
+            now = time.monotonic()
+            wait = self.last_sent.get(key, 0) + interval - now
+            if wait > 0:
+                if key in self.pending:
+                    self.saved += 1
+                self.pending[key] = (data, kwargs)
+                if key not in self.timers:
+                    timer = threading.Timer(wait, self._send_pending, (key,))
+                    timer.daemon = True
+                    self.timers[key] = timer
+                    timer.start()
+                return
+            self.last_sent[key] = now
+            # publish only queues the message, so it is done under the lock to
+            # keep the messages in order
+            self.msg.publish(topic, data, **kwargs)
+
+    # ----------------------------------------------------------------------------
+    def _send_pending(self, key):
+        with self.coalesce_lock:
+            self.timers.pop(key, None)
+            item = self.pending.pop(key, None)
+            if item:
+                self.last_sent[key] = time.monotonic()
+                data, kwargs = item
+                self.msg.publish(key[0], data, **kwargs)
+
+    # ----------------------------------------------------------------------------
+    def _flush_pending(self):
+        # call with self.coalesce_lock held
+        if self.pid != os.getpid():
+            self._reset_coalesce()
+        for timer in self.timers.values():
+            timer.cancel()
+        pending = self.pending
+        self._reset_coalesce()
+        for (topic, device), (data, kwargs) in pending.items():
+            self.msg.publish(topic, data, **kwargs)
+
+    # ----------------------------------------------------------------------------
+    def flush(self):
+        """send any messages being held back now, the next message on each
+        coalesced topic is then sent straight away"""
+        with self.coalesce_lock:
+            self._flush_pending()
+
     # ----------------------------------------------------------------------------
     def error(self, error_msg, error_lvl=0, msg2=""):
         """error - report an error
@@ -43,7 +158,7 @@ class Status:
                                 status devices
         """
 
-        self.msg.publish(
+        self._publish(
             "/photos/error", {"msg": error_msg, "level": error_lvl, "msg2": msg2}
         )
         print(f"status.py Status error: {error_msg} level: {error_lvl} msg2: {msg2}")
@@ -52,35 +167,51 @@ class Status:
     def ready(self, msg):
         """show that the system is ready to accept an SD card insertion"""
         # print( f"status.py Status ready: {msg}" )
-        self.msg.publish("/photos/ready", {"msg": msg})
+        self._publish("/photos/ready", {"msg": msg})
 
     # ----------------------------------------------------------------------------
     # this may be ignored by some devices
     def card_inserted(self):
         """show that an SD card has been inserted"""
-        self.msg.publish("/photos/inserted")
+        self._publish("/photos/inserted")
 
     # ----------------------------------------------------------------------------
-    def startcopy(self, file_count=0):
-        """show that the overall copy process has started"""
-        self.msg.publish("/photos/startcopy", {"files_total": file_count})
+    def startcopy(self, file_count=0, device=""):
+        """show that the overall copy process has started
+
+        Args:
+            file_count (int)        The number of files to be copied
+            device     (str)        The device being copied, when several are
+                                    copied at the same time
+        """
+        self._publish("/photos/startcopy", {"files_total": file_count, "device": device})
 
     # ----------------------------------------------------------------------------
-    def endcopy(self, files_copied=0, file_count=0):
+    def endcopy(self, files_copied=0, file_count=0, device=""):
         """show that all the file copy operations have concluded
 
         Args:
             files_copied (int)      The number of files copied
             files_total  (int)      The total number of files on the device that
                                     could have been copied
+            device       (str)      The device that was copied
         """
-        self.msg.publish(
+        self._publish(
             "/photos/endcopy",
             {
                 "files_copied": files_copied,
                 "files_total": file_count,
+                "device": device,
             },
         )
+        if self.saved:
+            logger.info(f"status messages saved by coalescing: {self.saved}")
+        for topic, stats in self.msg.stats().items():
+            logger.debug(
+                f"{topic}: sent {stats['sent']}, coalesced {stats['coalesced']}, dropped {stats['dropped']}, "
+                f"max queued {stats['max_depth']}, latency {stats['latency'] * 1000:.1f}ms "
+                f"max {stats['max_latency'] * 1000:.1f}ms"
+            )
 
     # ----------------------------------------------------------------------------
     # status device may choose to ignore this
@@ -95,6 +226,7 @@ class Status:
         file_count=0,
         bps=0,
         rsync=False,
+        device="",
     ):
         """update data during a file copy process
 
@@ -107,9 +239,12 @@ class Status:
             file_count      (int)   total number of files to be copied
             bps             (int)   for secondary programs that perform copy processes,
                                     send the bytes per second
-            
+            rsync           (bool)  the copy is being made by rsync
+            device          (str)   the device being copied from, allows each device
+                                    to have its own progress when copying in parallel
+
         """
-        self.msg.publish(
+        self._publish(
             "/photos/copydata",
             {
                 "fromfile": fromfile,
@@ -120,6 +255,7 @@ class Status:
                 "files_total": file_count,
                 "bps": bps,
                 "rsync": rsync,
+                "device": device,
             },
         )
 
@@ -127,7 +263,7 @@ class Status:
     # waiting for the removal of the SD card
     def waitremove(self):
         """show that system is waiting for the removal of the SD card"""
-        self.msg.publish("/photos/waitremove")
+        self._publish("/photos/waitremove")
 
     # ----------------------------------------------------------------------------
     def diskfull(self, diskname):
@@ -136,7 +272,7 @@ class Status:
         Args:
             diskname (str)      name of the disk that is full, keep it short!
         """
-        self.msg.publish("/photos/diskfull", {"diskname": diskname})
+        self._publish("/photos/diskfull", {"diskname": diskname})
 
     # ----------------------------------------------------------------------------
     def devicedata(self, sd_size, sd_free, hd_size, hd_free):
@@ -148,7 +284,7 @@ class Status:
             hd_size (int)   overall size of the target drive in bytes
             hd_free (int)   number of bytes free on the target drive
         """
-        self.msg.publish(
+        self._publish(
             "/photos/devicedata",
             {
                 "sd_size": sd_size,
@@ -163,7 +299,7 @@ class Status:
     # still working
     def keepalive(self):
         """send a keepalive message"""
-        self.msg.publish("/photos/keepalive")
+        self._publish("/photos/keepalive")
 
     # ----------------------------------------------------------------------------
     def fivelines(self, lines, color=None):
@@ -174,14 +310,14 @@ class Status:
             color  (str)
         """
         # slice to 5 lines
-        self.msg.publish("/photos/fivelines", {"color": color, "lines": lines[:5]})
+        self._publish("/photos/fivelines", {"color": color, "lines": lines[:5]})
 
     # ----------------------------------------------------------------------------
     # allow the caller to clear the display, or the receivers appropriate part
     # of the display
     def clear(self):
         """clear/blank the display"""
-        self.msg.publish("/photos/cls")
+        self._publish("/photos/cls")
 
     # ----------------------------------------------------------------------------
     def app_resume(self):
@@ -190,7 +326,7 @@ class Status:
         Args:
         """
         # slice to a single character
-        self.msg.publish("/photos/app_resume", {})
+        self._publish("/photos/app_resume", {})
 
     # ----------------------------------------------------------------------------
     def indexfile(self, filename):
@@ -202,6 +338,18 @@ class Status:
         # we are going to have the MQTT server remember all the files to be indexed
         # this allows the system to be rebooted etc without losing the filepaths
         # that need indexing, the retained messages will be sent to any new clients that connect
-        self.msg.publish("/photos/indexfile", {"filename": filename}, retain=True)
+        self._publish("/photos/indexfile", {"filename": filename}, retain=True)
+
+   
+    # ----------------------------------------------------------------------------
+    def indexbatch(self, spool_file, count=0):
+        """index a batch of files, listed in a spool file in the store
 
-   
\ No newline at end of file
+        Args:
+            spool_file (str)    full path to the spool file, one filename per line
+            count      (int)    number of files in the batch
+        """
+        # the spool file is what makes the batch durable, the indexer also looks
+        # for any it missed whenever it subscribes and every indexer.spool_scan
+        # seconds, so this does not need to be retained
+        self._publish("/photos/indexbatch", {"spool": spool_file, "count": count})
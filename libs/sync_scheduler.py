@@ -0,0 +1,156 @@
+# decide when gnarly_rsync should back up, rather than waking every few minutes
+# whether or not anything has arrived. A backup starts when new files have
+# been copied or indexed and things have gone quiet for a while, and the target
+# can be reached. A periodic check still runs in case files arrive some other
+# way, and while the target cannot be reached, e.g. when travelling, tries are
+# spaced out more and more
+
+# Example usage:
+# scheduler = SyncScheduler(debounce=30, interval=600, reachable=lambda: target_reachable(target))
+# msg.connect({"/photos/endcopy": scheduler.changed})  # in its own thread
+# while True:
+#     reason = scheduler.wait()
+#     scheduler.done(run_backup())
+
+import time
+import socket
+import logging
+import threading
+
+from .syncer import make_transport, LocalTransport
+
+logger = logging.getLogger("sync_scheduler")
+
+# the messages that mean there are new files in the store
+CHANGE_TOPICS = ["/photos/endcopy", "/photos/indexfile", "/photos/indexbatch"]
+# the first wait after a failed backup, doubled for each failure after that
+RETRY_DELAY = 60
+SSH_PORT = 22
+REACHABLE_TIMEOUT = 3
+
+
+# ----------------------------------------------------------------------------
+def target_reachable(target, timeout=REACHABLE_TIMEOUT):
+    """can the backup target be reached, without logging in, a local path has
+    to exist (be mounted) and for a remote the ssh port has to answer
+
+    Args:
+        target (str)    [user@]host:/path or a local path
+
+    Returns:
+        bool
+    """
+    transport = make_transport(target)
+    if isinstance(transport, LocalTransport):
+        return transport.available()
+    host = transport.host.rpartition("@")[2]
+    try:
+        socket.create_connection((host, SSH_PORT), timeout).close()
+        return True
+    except OSError as e:
+        logger.debug(f"{host} is not reachable: {e}")
+        return False
+
+
+class SyncScheduler:
+    """SyncScheduler
+    collects change events from any thread, and tells the backup loop when to
+    run. The first backup is as soon as things are quiet after starting, in case
+    files arrived while gnarly_rsync was not running
+
+    Args:
+        debounce    (float)     seconds without a change before a backup starts,
+                                so a card being copied is backed up once at the end
+        interval    (float)     seconds between backups when nothing has changed
+        max_backoff (float)     the longest wait between tries while the
+                                target cannot be reached or backups fail
+        reachable   (callable)  returns True if the target can be reached, a
+                                backup is not started when it cannot
+    """
+
+    def __init__(self, debounce=30, interval=600, max_backoff=3600, reachable=None) -> None:
+        self.debounce = debounce
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.reachable = reachable
+        self.cond = threading.Condition()
+        # a count of changes, so ones that arrive during a backup are not lost
+        self.changes = 1
+        self.synced_changes = 0
+        self.running_changes = 0
+        self.last_change = time.monotonic()
+        self.last_try = time.monotonic()
+        self.failures = 0
+
+    # ----------------------------------------------------------------------------
+    def changed(self, topic=None, data=None):
+        """something new is in the store, can be used as a message handler"""
+        with self.cond:
+            self.changes += 1
+            self.last_change = time.monotonic()
+            self.cond.notify()
+        logger.debug(f"change from {topic}")
+
+    # ----------------------------------------------------------------------------
+    def _backoff(self):
+        return min(RETRY_DELAY * 2 ** (self.failures - 1), self.max_backoff)
+
+    # ----------------------------------------------------------------------------
+    def _next(self, now):
+        """the reason a backup is due now, or None and how long to wait"""
+        # files are still arriving until it has been quiet for debounce
+        quiet_at = self.last_change + self.debounce if self.changes != self.synced_changes else None
+        if self.failures:
+            retry_at = max(self.last_try + self._backoff(), quiet_at or 0)
+            if now < retry_at:
+                return None, retry_at - now
+            return "retry", 0
+
+        if quiet_at is not None and now >= quiet_at:
+            return "change", 0
+        periodic_at = self.last_try + self.interval
+        if now >= periodic_at:
+            return "periodic", 0
+        return None, min(quiet_at, periodic_at) - now if quiet_at is not None else periodic_at - now
+
+    # ----------------------------------------------------------------------------
+    def wait(self):
+        """block until a backup should start
+
+        Returns:
+            (str) why, "change", "periodic" or "retry"
+        """
+        while True:
+            with self.cond:
+                reason, timeout = self._next(time.monotonic())
+                if not reason:
+                    self.cond.wait(timeout)
+                    continue
+                self.last_try = time.monotonic()
+                self.running_changes = self.changes
+
+            if self.reachable and not self.reachable():
+                self.done(False, reachable=False)
+                continue
+            logger.info(f"backup due, {reason}")
+            return reason
+
+    # ----------------------------------------------------------------------------
+    def done(self, ok, reachable=True):
+        """a backup has finished, or could not be started
+
+        Args:
+            ok        (bool)    everything was backed up
+            reachable (bool)    False when the target could not be reached
+        """
+        with self.cond:
+            if ok:
+                self.failures = 0
+                # changes that came in while it ran still need a backup
+                self.synced_changes = self.running_changes
+            else:
+                self.failures += 1
+                logger.info(
+                    f"{'target not reachable' if not reachable else 'backup failed'}, "
+                    f"trying again in {self._backoff()}s"
+                )
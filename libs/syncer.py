@@ -0,0 +1,374 @@
+# copy new files from the store to a backup target without running rsync, a
+# manifest of what has already been sent to each target is kept in the store's
+# database, so a cycle only has to look at directories that have changed since
+# the last one, and nothing at all is sent when nothing has changed
+
+# Example usage:
+# syncer = Syncer('/home/user/usb_data/index', 'user@nas:/backup', '/home/user/usb_data/gnarlypi.db')
+# changed, dirs = syncer.changes()
+# sent = syncer.send(changed, dirs, progress=lambda name, size, done, files, count, bps: print(name, done))
+
+import os
+import time
+import shlex
+import fnmatch
+import logging
+import threading
+import subprocess
+
+from .db import open_db
+from .copier import buffered_copy, ONE_MB
+
+logger = logging.getLogger("syncer")
+
+# the same files the rsync backend leaves out
+EXCLUDES = [".DS_store", "leinfo.sav", "*.tmp", "*.tmp.resume"]
+# a file being sent is written under this name next to where it goes, and
+# renamed when complete, so a partial file is never mistaken for a backup
+PARTIAL_SUFFIX = ".gnarlysync"
+# a directory changed this recently may still be getting files, so its mtime
+# is not trusted to mean nothing else will arrive
+SETTLE_SECS = 2
+# ssh shares one connection between all the files in a cycle
+SSH_OPTIONS = [
+    "-o", "BatchMode=yes",
+    "-o", "ConnectTimeout=10",
+    "-o", "ControlMaster=auto",
+    "-o", "ControlPath=/tmp/gnarlysync-%r@%h:%p",
+    "-o", "ControlPersist=60",
+]
+
+
+class SyncManifest:
+    """SyncManifest
+    what has been sent to each target, the size and mtime of each file as it
+    was sent, and the mtime of each source directory once everything in it
+    had been sent
+
+    Args:
+        filepath (str)      the database file, shared with the store manifest
+        target   (str)      the target this manifest is for
+    """
+
+    def __init__(self, filepath, target) -> None:
+        self.target = target
+        self.lock = threading.Lock()
+        self.db = open_db(filepath)
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS sync_files "
+                "(target TEXT, path TEXT, size INTEGER, mtime INTEGER, PRIMARY KEY (target, path))"
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS sync_dirs "
+                "(target TEXT, dir TEXT, mtime INTEGER, PRIMARY KEY (target, dir))"
+            )
+
+    # ----------------------------------------------------------------------------
+    def files(self):
+        """dict of path: (size, mtime) already sent"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT path, size, mtime FROM sync_files WHERE target = ?", (self.target,)
+            ).fetchall()
+        return {path: (size, mtime) for path, size, mtime in rows}
+
+    # ----------------------------------------------------------------------------
+    def dirs(self):
+        """dict of dir: mtime of the directories that were complete"""
+        with self.lock:
+            rows = self.db.execute("SELECT dir, mtime FROM sync_dirs WHERE target = ?", (self.target,)).fetchall()
+        return dict(rows)
+
+    # ----------------------------------------------------------------------------
+    def record_files(self, items):
+        """record a list of (path, size, mtime) as sent"""
+        with self.lock:
+            with self.db:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO sync_files (target, path, size, mtime) VALUES (?, ?, ?, ?)",
+                    ((self.target, path, size, mtime) for path, size, mtime in items),
+                )
+
+    # ----------------------------------------------------------------------------
+    def record_dirs(self, items):
+        """record a list of (dir, mtime) as complete"""
+        with self.lock:
+            with self.db:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO sync_dirs (target, dir, mtime) VALUES (?, ?, ?)",
+                    ((self.target, path, mtime) for path, mtime in items),
+                )
+
+
+class LocalTransport:
+    """LocalTransport
+    send files to a local directory, or a NAS share that is mounted, e.g. over SMB
+
+    Args:
+        root (str)      the directory to copy into
+    """
+
+    def __init__(self, root) -> None:
+        self.root = root
+
+    # ----------------------------------------------------------------------------
+    def available(self):
+        return os.path.isdir(self.root)
+
+    # ----------------------------------------------------------------------------
+    def listing(self):
+        """dict of path: size of everything already in the target"""
+        found = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    found[os.path.relpath(path, self.root)] = os.path.getsize(path)
+                except OSError:
+                    pass
+        return found
+
+    # ----------------------------------------------------------------------------
+    def send(self, src_path, rel_path, mtime, progress=None):
+        """copy src_path to rel_path under the root, keeping its mtime"""
+        dest = os.path.join(self.root, rel_path)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        partial = dest + PARTIAL_SUFFIX
+        try:
+            with open(src_path, "rb") as f_in, open(partial, "wb") as f_out:
+                buffered_copy(f_in, f_out, ONE_MB, progress)
+            os.utime(partial, (mtime, mtime))
+            os.replace(partial, dest)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+
+    # ----------------------------------------------------------------------------
+    def close(self):
+        pass
+
+
+class SSHTransport:
+    """SSHTransport
+    send files over ssh, streaming each one into cat on the remote, ssh must be
+    set up with keys as it is for rsync
+
+    Args:
+        host (str)      [user@]host
+        root (str)      the directory on the remote to copy into
+    """
+
+    def __init__(self, host, root) -> None:
+        self.host = host
+        self.root = root
+        # remote directories already made this cycle
+        self.made_dirs = set()
+
+    # ----------------------------------------------------------------------------
+    def _ssh(self, command, **kwargs):
+        return subprocess.Popen(["ssh", *SSH_OPTIONS, self.host, command], **kwargs)
+
+    # ----------------------------------------------------------------------------
+    def available(self):
+        proc = self._ssh(f"test -d {shlex.quote(self.root)}", stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return proc.wait() == 0
+
+    # ----------------------------------------------------------------------------
+    def listing(self):
+        """dict of path: size of everything already in the target, or None if
+        the remote find cannot list sizes"""
+        proc = self._ssh(
+            f"cd {shlex.quote(self.root)} && find . -type f -printf '%s %P\\n'",
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        out, err = proc.communicate()
+        if proc.returncode != 0:
+            logger.warning(f"cannot list {self.host}:{self.root}: {err.decode(errors='replace').strip()}")
+            return None
+        found = {}
+        for line in out.decode(errors="replace").splitlines():
+            size, _, path = line.partition(" ")
+            if path and size.isdigit():
+                found[path] = int(size)
+        return found
+
+    # ----------------------------------------------------------------------------
+    def send(self, src_path, rel_path, mtime, progress=None):
+        """stream src_path to rel_path under the remote root, keeping its mtime"""
+        dest = os.path.join(self.root, rel_path)
+        partial = shlex.quote(dest + PARTIAL_SUFFIX)
+        command = f"cat > {partial} && touch -d @{int(mtime)} {partial} && mv {partial} {shlex.quote(dest)}"
+        destdir = os.path.dirname(dest)
+        if destdir not in self.made_dirs:
+            command = f"mkdir -p {shlex.quote(destdir)} && {command}"
+
+        proc = self._ssh(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            with open(src_path, "rb") as f_in:
+                buffered_copy(f_in, proc.stdin, ONE_MB, progress)
+            proc.stdin.close()
+            err = proc.stderr.read()
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+        if proc.wait() != 0:
+            raise OSError(f"ssh to {self.host} failed for {rel_path}: {err.decode(errors='replace').strip()}")
+        self.made_dirs.add(destdir)
+
+    # ----------------------------------------------------------------------------
+    def close(self):
+        # stop the shared connection
+        subprocess.run(
+            ["ssh", *SSH_OPTIONS, "-O", "exit", self.host],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        self.made_dirs.clear()
+
+
+# ----------------------------------------------------------------------------
+def make_transport(target):
+    """the transport for an rsync style target, [user@]host:/path for ssh or a
+    local path
+
+    Args:
+        target (str)    as given to rsync
+
+    Returns:
+        LocalTransport or SSHTransport
+    """
+    host, sep, path = target.partition(":")
+    # a local path can have a : in it, but not before the first /
+    if sep and "/" not in host:
+        return SSHTransport(host, path or ".")
+    return LocalTransport(target)
+
+
+class Syncer:
+    """Syncer
+    find what is new in source since the last cycle and send it to target. As
+    with rsync, unless source ends with a / its last directory is made in target
+
+    Args:
+        source    (str)         the directory to back up, symlinks are followed
+        target    (str)         [user@]host:/path or a local path
+        db_file   (str)         the database holding the sync manifest
+        transport (object)      to override the one chosen from target
+        excludes  (list)        filename patterns never sent
+    """
+
+    def __init__(self, source, target, db_file, transport=None, excludes=None) -> None:
+        self.source = source
+        self.prefix = "" if source.endswith("/") else os.path.basename(source)
+        self.transport = transport or make_transport(target)
+        self.manifest = SyncManifest(db_file, target)
+        self.excludes = EXCLUDES if excludes is None else excludes
+
+    # ----------------------------------------------------------------------------
+    def _excluded(self, name):
+        return name.endswith(PARTIAL_SUFFIX) or any(fnmatch.fnmatch(name, pattern) for pattern in self.excludes)
+
+    # ----------------------------------------------------------------------------
+    def changes(self):
+        """walk the source for files that have not been sent, directories with
+        the same mtime as when they were last complete have had nothing added
+        or removed, so their files are not looked at
+
+        Returns:
+            (list of (src_path, rel_path, size, mtime), dict of dir: mtime
+            to record once its files are sent)
+        """
+        sent = self.manifest.files()
+        complete = self.manifest.dirs()
+        now = time.time()
+        changed = []
+        dirs = {}
+        stack = [(self.source.rstrip("/") or "/", self.prefix)]
+        while stack:
+            path, rel = stack.pop()
+            try:
+                mtime = os.stat(path).st_mtime_ns
+                entries = list(os.scandir(path))
+            except OSError as e:
+                logger.warning(f"cannot read {path}: {e}")
+                continue
+            unchanged = complete.get(rel) == mtime
+            for entry in entries:
+                if self._excluded(entry.name):
+                    continue
+                entry_rel = os.path.join(rel, entry.name)
+                try:
+                    if entry.is_dir():
+                        stack.append((entry.path, entry_rel))
+                        continue
+                    if unchanged or not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    # a dangling symlink in the index
+                    continue
+                if sent.get(entry_rel) != (stat.st_size, int(stat.st_mtime)):
+                    changed.append((entry.path, entry_rel, stat.st_size, int(stat.st_mtime)))
+            if not unchanged and now - mtime / 1e9 >= SETTLE_SECS:
+                dirs[rel] = mtime
+
+        changed.sort(key=lambda item: item[1])
+
+        # the first time for a target, anything already there with the same
+        # size was copied some other way, e.g. by rsync, so is not sent again
+        if not sent and changed:
+            existing = self.transport.listing()
+            if existing:
+                already = [item for item in changed if existing.get(item[1]) == item[2]]
+                self.manifest.record_files((rel_path, size, mtime) for src_path, rel_path, size, mtime in already)
+                logger.info(f"{len(already)} files are already in the target")
+                already = set(already)
+                changed = [item for item in changed if item not in already]
+        return changed, dirs
+
+    # ----------------------------------------------------------------------------
+    def send(self, changed, dirs, progress=None):
+        """send the changed files, stopping at the first that fails. Each file is
+        recorded as it is sent, so a cycle that stops part way only sends what
+        is left next time
+
+        Args:
+            changed  (list)         from changes()
+            dirs     (dict)         from changes()
+            progress (callable)     called with (src_path, size, bytes_done,
+                                    files_done, file_count, bps)
+
+        Returns:
+            the number of files sent
+        """
+        sent = 0
+        try:
+            for src_path, rel_path, size, mtime in changed:
+                start = time.monotonic()
+
+                def file_progress(done):
+                    if progress:
+                        elapsed = time.monotonic() - start
+                        bps = int(done / elapsed) if elapsed > 0 else 0
+                        progress(src_path, size, done, sent, len(changed), bps)
+
+                file_progress(0)
+                try:
+                    self.transport.send(src_path, rel_path, mtime, file_progress)
+                except OSError as e:
+                    logger.error(f"failed to send {src_path}: {e}")
+                    break
+                self.manifest.record_files([(rel_path, size, mtime)])
+                sent += 1
+                logger.info(f"sent {sent}/{len(changed)} {rel_path}")
+            else:
+                # only when everything was sent, as a directory recorded as
+                # complete is not looked in again until it changes
+                self.manifest.record_dirs(dirs.items())
+        finally:
+            self.transport.close()
+        return sent
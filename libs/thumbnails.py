@@ -0,0 +1,521 @@
+# previews of the photos and videos in the store, taken from the JPEG previews
+# the cameras embed in their files, so nothing needs to be decoded. They are
+# kept in a cache named by the hash of the preview, limited in size, and made
+# by low priority background workers so they never hold up copying a card
+
+# Example usage:
+# cache = ThumbCache('/home/user/usb_data/thumbs', '/home/user/usb_data/gnarlypi.db', 512)
+# workers = ThumbnailWorkers(cache, workers=1, rate=5, paused=Lock().isLocked)
+# workers.add('/home/user/usb_data/files/DCIM/100OLYMP/P7110109.ORF')
+# thumb = cache.lookup('/home/user/usb_data/files/DCIM/100OLYMP/P7110109.ORF')
+
+import os
+import time
+import queue
+import struct
+import hashlib
+import logging
+import threading
+
+from .db import open_db
+from .exifdate import MAX_SEGMENTS, TAG_EXIF_IFD, HeaderReader, iter_boxes, jpeg_exif_offset
+
+logger = logging.getLogger("thumbnails")
+
+ONE_MB = 1024 * 1024
+# anything bigger than this is not a preview
+MAX_PREVIEW = 16 * ONE_MB
+# the smallest preview at least this many pixels on its longest side is used,
+# rather than the full size one most RAW files also have
+THUMB_SIDE = 320
+# JPEG start of frame markers, holding the image size
+SOF_MARKERS = frozenset([0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF])
+# give up after this many IFDs, damaged files can loop
+MAX_IFDS = 16
+# nice value for the worker threads, as low a priority as there is
+NICENESS = 19
+
+TAG_NEW_SUBFILE_TYPE = 0x00FE
+TAG_COMPRESSION = 0x0103
+TAG_STRIP_OFFSETS = 0x0111
+TAG_STRIP_BYTE_COUNTS = 0x0117
+TAG_SUB_IFDS = 0x014A
+TAG_JPEG_OFFSET = 0x0201
+TAG_JPEG_LENGTH = 0x0202
+# Panasonic RW2 keep a full size preview in IFD0
+TAG_PANASONIC_JPG_FROM_RAW = 0x002E
+TAG_MAKER_NOTE = 0x927C
+TAG_OLYMPUS_CAMERA_SETTINGS = 0x2020
+TAG_OLYMPUS_PREVIEW_START = 0x0101
+TAG_OLYMPUS_PREVIEW_LENGTH = 0x0102
+# the MakerNote headers and where the IFD starts after them
+OLYMPUS_MAKERNOTES = ((b"OLYMPUS\0", 12), (b"OM SYSTEM\0\0\0", 16))
+COMPRESSION_OLD_JPEG = 6
+COMPRESSION_JPEG = 7
+# the Canon CR3 uuid box holding the PRVW preview
+CR3_PREVIEW_UUID = bytes.fromhex("eaf42b5e1c984b88b9fbb7dc406e4d16")
+# Sony keep a thumbnail for each clip in a separate directory
+SONY_CLIP_DIR = "CLIP"
+SONY_THUMB_DIR = "THMBNL"
+VIDEO_EXTENSIONS = (".MP4", ".MOV", ".M4V")
+
+
+# ----------------------------------------------------------------------------
+def _number(entry, endian):
+    """a SHORT or LONG value held in the IFD entry itself, or the offset of
+    the values when they do not fit"""
+    kind, values, value = entry
+    return struct.unpack(endian + "H", value[:2])[0] if kind == 3 else struct.unpack(endian + "I", value)[0]
+
+
+# ----------------------------------------------------------------------------
+def _read_ifd(reader, offset, endian):
+    """the entries of the IFD at offset
+
+    Returns:
+        (tags, next) tags is {tag: (kind, count, value)}, next is the offset
+        of the next IFD in the chain, 0 at the end
+    """
+    count_bytes = reader.read(offset, 2)
+    if len(count_bytes) < 2:
+        return {}, 0
+    (count,) = struct.unpack(endian + "H", count_bytes)
+    entries = reader.read(offset + 2, count * 12)
+    tags = {}
+    for i in range(0, len(entries) - 11, 12):
+        tag, kind, values, value = struct.unpack(endian + "HHI4s", entries[i : i + 12])
+        tags[tag] = (kind, values, value)
+    next_ifd = reader.read(offset + 2 + count * 12, 4)
+    return tags, struct.unpack(endian + "I", next_ifd)[0] if len(next_ifd) == 4 else 0
+
+
+# ----------------------------------------------------------------------------
+def _olympus_previews(reader, base, endian, exif_ifd):
+    """the PreviewImage in the CameraSettings of an Olympus or OM System
+    MakerNote, IFD1 only has a 160x120 thumbnail"""
+    exif, _ = _read_ifd(reader, base + exif_ifd, endian)
+    if TAG_MAKER_NOTE not in exif:
+        return []
+    note = base + _number(exif[TAG_MAKER_NOTE], endian)
+    header = reader.read(note, 16)
+    for magic, ifd_at in OLYMPUS_MAKERNOTES:
+        if header.startswith(magic):
+            break
+    else:
+        return []
+    # the MakerNote has its own byte order, and offsets from its start
+    note_endian = "<" if header[ifd_at - 4 : ifd_at - 2] == b"II" else ">"
+    tags, _ = _read_ifd(reader, note + ifd_at, note_endian)
+    if TAG_OLYMPUS_CAMERA_SETTINGS not in tags:
+        return []
+    settings, _ = _read_ifd(reader, note + _number(tags[TAG_OLYMPUS_CAMERA_SETTINGS], note_endian), note_endian)
+    if TAG_OLYMPUS_PREVIEW_START in settings and TAG_OLYMPUS_PREVIEW_LENGTH in settings:
+        return [
+            (
+                note + _number(settings[TAG_OLYMPUS_PREVIEW_START], note_endian),
+                _number(settings[TAG_OLYMPUS_PREVIEW_LENGTH], note_endian),
+            )
+        ]
+    return []
+
+
+# ----------------------------------------------------------------------------
+def _tiff_previews(reader, base):
+    """the (offset, length) of every JPEG in the IFDs of the TIFF at base,
+    following the IFD chain and any SubIFDs, with the Panasonic JpgFromRaw
+    and the Olympus MakerNote preview"""
+    header = reader.read(base, 8)
+    if len(header) < 8 or header[:2] not in (b"II", b"MM"):
+        return []
+    endian = "<" if header[:2] == b"II" else ">"
+
+    previews = []
+    todo = [struct.unpack(endian + "I", header[4:])[0]]
+    seen = set()
+    while todo and len(seen) < MAX_IFDS:
+        ifd = todo.pop(0)
+        if not ifd or ifd in seen:
+            continue
+        first = not seen
+        seen.add(ifd)
+        tags, next_ifd = _read_ifd(reader, base + ifd, endian)
+
+        if TAG_JPEG_OFFSET in tags and TAG_JPEG_LENGTH in tags:
+            previews.append((base + _number(tags[TAG_JPEG_OFFSET], endian), _number(tags[TAG_JPEG_LENGTH], endian)))
+        elif TAG_COMPRESSION in tags and TAG_STRIP_OFFSETS in tags and TAG_STRIP_BYTE_COUNTS in tags:
+            compression = _number(tags[TAG_COMPRESSION], endian)
+            # compression 7 is also used for lossless raw data, only previews are wanted
+            reduced = TAG_NEW_SUBFILE_TYPE in tags and _number(tags[TAG_NEW_SUBFILE_TYPE], endian) == 1
+            single_strip = tags[TAG_STRIP_OFFSETS][1] == 1
+            if single_strip and (compression == COMPRESSION_OLD_JPEG or (compression == COMPRESSION_JPEG and reduced)):
+                previews.append(
+                    (base + _number(tags[TAG_STRIP_OFFSETS], endian), _number(tags[TAG_STRIP_BYTE_COUNTS], endian))
+                )
+
+        if first and TAG_PANASONIC_JPG_FROM_RAW in tags:
+            # an UNDEFINED run of bytes, the count is its length
+            kind, values, value = tags[TAG_PANASONIC_JPG_FROM_RAW]
+            previews.append((base + struct.unpack(endian + "I", value)[0], values))
+        if first and TAG_EXIF_IFD in tags:
+            previews.extend(_olympus_previews(reader, base, endian, _number(tags[TAG_EXIF_IFD], endian)))
+
+        if TAG_SUB_IFDS in tags:
+            kind, values, value = tags[TAG_SUB_IFDS]
+            if values == 1:
+                todo.append(struct.unpack(endian + "I", value)[0])
+            else:
+                (pointer,) = struct.unpack(endian + "I", value)
+                data = reader.read(base + pointer, values * 4)
+                todo.extend(struct.unpack(endian + "I" * (len(data) // 4), data[: len(data) // 4 * 4]))
+
+        todo.append(next_ifd)
+
+    return previews
+
+
+# ----------------------------------------------------------------------------
+def _cr3_previews(reader):
+    for kind, offset, size in iter_boxes(reader, 0, reader.size):
+        if kind != b"uuid" or reader.read(offset, 16) != CR3_PREVIEW_UUID:
+            continue
+        # 8 bytes of unknown data follow the uuid, then the PRVW box
+        for child, child_offset, child_size in iter_boxes(reader, offset + 24, offset + size):
+            if child == b"PRVW":
+                start = reader.read(child_offset, 64).find(b"\xff\xd8")
+                if start >= 0:
+                    return [(child_offset + start, child_size - start)]
+    return []
+
+
+# ----------------------------------------------------------------------------
+def sony_thumbnail(path):
+    """the THMBNL file Sony cameras make for a clip, e.g. for
+    PRIVATE/M4ROOT/CLIP/C0001.MP4 it is PRIVATE/M4ROOT/THMBNL/C0001T01.JPG"""
+    clip_dir = os.path.dirname(path)
+    if os.path.basename(clip_dir).upper() != SONY_CLIP_DIR:
+        return None
+    name = os.path.splitext(os.path.basename(path))[0]
+    thumb_dir = os.path.join(os.path.dirname(clip_dir), SONY_THUMB_DIR)
+    for candidate in (f"{name}T01.JPG", f"{name}T01.jpg"):
+        thumb = os.path.join(thumb_dir, candidate)
+        if os.path.isfile(thumb):
+            return thumb
+    return None
+
+
+# ----------------------------------------------------------------------------
+def jpeg_size(reader, offset):
+    """the (width, height) of the JPEG at offset from its start of frame, or
+    None if it cannot be found before the image data"""
+    pos = offset + 2
+    for _ in range(MAX_SEGMENTS):
+        marker = reader.read(pos, 9)
+        if len(marker) < 4 or marker[0] != 0xFF or marker[1] == 0xDA:
+            return None
+        if marker[1] in SOF_MARKERS and len(marker) == 9:
+            height, width = struct.unpack(">HH", marker[5:9])
+            return width, height
+        pos += 2 + struct.unpack(">H", marker[2:4])[0]
+    return None
+
+
+# ----------------------------------------------------------------------------
+def pick_preview(reader, previews, min_side=THUMB_SIDE):
+    """the smallest of the previews that is at least min_side pixels on its
+    longest side, or the largest if none are, only those that really are JPEGs
+
+    Args:
+        reader   (HeaderReader)
+        previews (list)     of (offset, length)
+        min_side (int)
+
+    Returns:
+        (offset, length) or None
+    """
+    usable = []
+    for offset, length in previews:
+        if 0 < length <= MAX_PREVIEW and offset + length <= reader.size and reader.read(offset, 2) == b"\xff\xd8":
+            usable.append((offset, length))
+    if not usable:
+        return None
+    big_enough = []
+    for offset, length in usable:
+        size = jpeg_size(reader, offset)
+        if size and max(size) >= min_side:
+            big_enough.append((offset, length))
+    if big_enough:
+        return min(big_enough, key=lambda p: p[1])
+    return max(usable, key=lambda p: p[1])
+
+
+# ----------------------------------------------------------------------------
+def extract_preview(path, min_side=THUMB_SIDE):
+    """the smallest JPEG preview embedded in a photo that is big enough to
+    look at, or the thumbnail for a Sony clip, without decoding any image data
+
+    Args:
+        path     (str)      the photo or video
+        min_side (int)      pixels on the longest side of the smallest
+                            preview wanted, see pick_preview
+
+    Returns:
+        (bytes) the JPEG preview, or None if there is not one
+    """
+    if path.upper().endswith(VIDEO_EXTENSIONS):
+        thumb = sony_thumbnail(path)
+        if thumb:
+            with open(thumb, "rb") as f:
+                return f.read(MAX_PREVIEW)
+
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError as e:
+        logger.debug(f"cannot open {path}: {e}")
+        return None
+
+    try:
+        reader = HeaderReader(fd)
+        magic = reader.window[:16]
+        if magic[:2] == b"\xff\xd8":
+            base = jpeg_exif_offset(reader)
+            previews = _tiff_previews(reader, base) if base is not None else []
+        elif magic[:2] in (b"II", b"MM"):
+            previews = _tiff_previews(reader, 0)
+        elif magic.startswith(b"FUJIFILMCCD-RAW"):
+            previews = [struct.unpack(">II", reader.read(84, 8))]
+        elif magic[4:8] == b"ftyp":
+            previews = _cr3_previews(reader)
+        else:
+            previews = []
+
+        preview = pick_preview(reader, previews, min_side)
+        if preview:
+            return reader.read(*preview)
+    except (OSError, struct.error) as e:
+        logger.debug(f"cannot read a preview from {path}: {e}")
+    finally:
+        os.close(fd)
+
+    return None
+
+
+class ThumbCache:
+    """ThumbCache
+    previews stored by the hash of their content, so the same preview is only
+    kept once, with the source file each came from. When the cache gets bigger
+    than max_size the least recently used previews are removed. Which files
+    have had a preview made is kept apart from the cache, so a removed
+    preview is not made again and the cache settles
+
+    Args:
+        cache_dir (str)     directory to keep the previews in
+        db_file   (str)     the database file, shared with the manifest
+        max_size  (int)     most MB to use for the previews
+    """
+
+    def __init__(self, cache_dir, db_file, max_size) -> None:
+        self.cache_dir = cache_dir
+        self.max_size = max_size * ONE_MB
+        self.lock = threading.Lock()
+        self.db = open_db(db_file)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS thumbs (hash TEXT PRIMARY KEY, size INTEGER, used REAL)")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS thumb_sources "
+                "(path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, hash TEXT)"
+            )
+            # every version of a file a preview has been looked for, found or not
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS thumb_attempts (path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER)"
+            )
+        self.total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM thumbs").fetchone()[0]
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # ----------------------------------------------------------------------------
+    def thumb_path(self, digest):
+        return os.path.join(self.cache_dir, digest[:2], f"{digest}.jpg")
+
+    # ----------------------------------------------------------------------------
+    def has(self, path, stat):
+        """is there already a preview for this version of the file
+
+        Args:
+            path (str)          the source file
+            stat (os.stat)      of the source file
+        """
+        with self.lock:
+            row = self.db.execute(
+                "SELECT hash FROM thumb_sources WHERE path = ? AND mtime = ? AND size = ?",
+                (path, stat.st_mtime_ns, stat.st_size),
+            ).fetchone()
+        return bool(row) and os.path.exists(self.thumb_path(row[0]))
+
+    # ----------------------------------------------------------------------------
+    def attempted(self, path, stat):
+        """has a preview been looked for in this version of the file, whether
+        or not one was found, or it has since been removed from the cache"""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT 1 FROM thumb_attempts WHERE path = ? AND mtime = ? AND size = ?",
+                (path, stat.st_mtime_ns, stat.st_size),
+            ).fetchone()
+        return bool(row)
+
+    # ----------------------------------------------------------------------------
+    def mark_attempted(self, path, stat):
+        with self.lock:
+            with self.db:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO thumb_attempts (path, mtime, size) VALUES (?, ?, ?)",
+                    (path, stat.st_mtime_ns, stat.st_size),
+                )
+
+    # ----------------------------------------------------------------------------
+    def unattempted(self, sizes):
+        """the files no preview has been looked for in, or that have changed
+        size since, without looking at the files themselves
+
+        Args:
+            sizes (dict)    size of each file keyed by path, e.g. Catalog.sizes()
+
+        Returns:
+            list of (str) paths, sorted
+        """
+        with self.lock:
+            done = dict(self.db.execute("SELECT path, size FROM thumb_attempts"))
+        return sorted(path for path, size in sizes.items() if done.get(path) != size)
+
+    # ----------------------------------------------------------------------------
+    def lookup(self, path):
+        """the cached preview of a source file, or None"""
+        with self.lock:
+            row = self.db.execute("SELECT hash FROM thumb_sources WHERE path = ?", (path,)).fetchone()
+            if not row:
+                return None
+            with self.db:
+                self.db.execute("UPDATE thumbs SET used = ? WHERE hash = ?", (time.time(), row[0]))
+        thumb = self.thumb_path(row[0])
+        return thumb if os.path.exists(thumb) else None
+
+    # ----------------------------------------------------------------------------
+    def add(self, path, stat, data):
+        """store the preview of a source file
+
+        Returns:
+            (str) path of the cached preview
+        """
+        digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+        thumb = self.thumb_path(digest)
+        if not os.path.exists(thumb):
+            os.makedirs(os.path.dirname(thumb), exist_ok=True)
+            with open(f"{thumb}.tmp", "wb") as f:
+                f.write(data)
+            os.rename(f"{thumb}.tmp", thumb)
+
+        with self.lock:
+            with self.db:
+                known = self.db.execute("SELECT 1 FROM thumbs WHERE hash = ?", (digest,)).fetchone()
+                self.db.execute(
+                    "INSERT OR REPLACE INTO thumbs (hash, size, used) VALUES (?, ?, ?)",
+                    (digest, len(data), time.time()),
+                )
+                self.db.execute(
+                    "INSERT OR REPLACE INTO thumb_sources (path, mtime, size, hash) VALUES (?, ?, ?, ?)",
+                    (path, stat.st_mtime_ns, stat.st_size, digest),
+                )
+            if not known:
+                self.total += len(data)
+            self._evict()
+        return thumb
+
+    # ----------------------------------------------------------------------------
+    def _evict(self):
+        # called with the lock held
+        while self.total > self.max_size:
+            row = self.db.execute("SELECT hash, size FROM thumbs ORDER BY used LIMIT 1").fetchone()
+            if not row:
+                self.total = 0
+                return
+            digest, size = row
+            with self.db:
+                self.db.execute("DELETE FROM thumbs WHERE hash = ?", (digest,))
+                self.db.execute("DELETE FROM thumb_sources WHERE hash = ?", (digest,))
+            try:
+                os.remove(self.thumb_path(digest))
+            except FileNotFoundError:
+                pass
+            self.total -= size
+            logger.debug(f"removed thumbnail {digest} to keep the cache under {self.max_size // ONE_MB}MB")
+
+
+class ThumbnailWorkers:
+    """ThumbnailWorkers
+    background threads making previews for the files added to them, at the
+    lowest CPU priority and no more than rate files a second between them.
+    They wait while paused() is True, e.g. while gnarlypi is copying a card
+
+    Args:
+        cache   (ThumbCache)    where the previews go
+        workers (int)           number of threads
+        rate    (float)         most files a second, 0 for no limit
+        paused  (callable)      returns True when the workers should wait
+    """
+
+    def __init__(self, cache, workers=1, rate=5, paused=None) -> None:
+        self.cache = cache
+        self.rate = rate
+        self.paused = paused
+        self.queue = queue.Queue()
+        self.rate_lock = threading.Lock()
+        self.next_start = 0
+        self.made = 0
+        for i in range(max(1, workers)):
+            threading.Thread(target=self._worker, name=f"thumbnails-{i}", daemon=True).start()
+
+    # ----------------------------------------------------------------------------
+    def add(self, path):
+        """make a preview of path when there is time"""
+        self.queue.put(path)
+
+    # ----------------------------------------------------------------------------
+    def wait(self):
+        """wait for all the files added so far to be done"""
+        self.queue.join()
+
+    # ----------------------------------------------------------------------------
+    def _throttle(self):
+        if not self.rate:
+            return
+        with self.rate_lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + 1 / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+    # ----------------------------------------------------------------------------
+    def _worker(self):
+        try:
+            # on linux this sets the priority of just this thread
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), NICENESS)
+        except (AttributeError, OSError) as e:
+            logger.debug(f"cannot lower thumbnail priority: {e}")
+
+        while True:
+            path = self.queue.get()
+            try:
+                while self.paused and self.paused():
+                    time.sleep(1)
+                stat = os.stat(path)
+                if self.cache.attempted(path, stat):
+                    continue
+                self._throttle()
+                data = extract_preview(path)
+                if data:
+                    self.cache.add(path, stat, data)
+                    self.made += 1
+                self.cache.mark_attempted(path, stat)
+            except Exception as e:
+                logger.warning(f"cannot make a thumbnail for {path}: {e}")
+            finally:
+                self.queue.task_done()
@@ -309,10 +309,14 @@ function status_fivelines(topic, data) {
 }
 
 // ----------------------------------------------------------------------------
+// keepalives are sent as comments, to keep the connection open, so the clock
+// is ticked here rather than by them
 function status_keepalive(topic, data) {
   update_display(data._epoch);
 }
 
+setInterval(() => update_display(Date.now() / 1000), 1000);
+
 // ----------------------------------------------------------------------------
 function status_cls(topic, data) {
   cls();
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# compare the copy methods in libs/copier.py on large RAW/video sized files
+# run from the tests directory, point --src at the card and --dst at the store
+# to get real numbers, otherwise both default to a temp dir
+#
+# ./bench_copy.py --src /media/sdcard/bench --dst ~/usb_data/bench --size 512
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, "../")
+from libs.copier import COPY_METHODS, ONE_MB, READ_SIZE  # type: ignore
+
+# a typical ORF is about 20MB, a 4K MOV clip can be several GB
+SAMPLES = (("P7110109.ORF", 20), ("C0001.MOV", None))
+
+
+# ----------------------------------------------------------------------------
+def make_sample(path, size_mb):
+    if os.path.exists(path) and os.path.getsize(path) == size_mb * ONE_MB:
+        return
+    print(f"creating {path} ({size_mb}MB)")
+    with open(path, "wb") as f:
+        for _ in range(size_mb):
+            f.write(os.urandom(ONE_MB))
+
+
+# ----------------------------------------------------------------------------
+def drop_cache(path):
+    """ask the kernel to forget the file, so we read from the device and not RAM"""
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+# ----------------------------------------------------------------------------
+def bench(method, src, dst, chunk_size):
+    drop_cache(src)
+    start = time.perf_counter()
+    with open(src, "rb") as f_in, open(dst, "wb") as f_out:
+        copied = COPY_METHODS[method](f_in, f_out, chunk_size)
+        f_out.flush()
+        os.fsync(f_out.fileno())
+    elapsed = time.perf_counter() - start
+    os.remove(dst)
+    return copied, elapsed
+
+
+# ----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark the gnarlypi copy methods")
+    parser.add_argument("--src", help="directory for the sample files, ideally on the SD card")
+    parser.add_argument("--dst", help="directory to copy to, ideally on the store")
+    parser.add_argument("--size", type=int, default=1024, help="size of the MOV sample in MB")
+    parser.add_argument("--chunk", type=int, default=READ_SIZE // ONE_MB, help="chunk size in MB")
+    parser.add_argument("--runs", type=int, default=3, help="runs per method")
+    args = parser.parse_args()
+
+    tmpdir = None
+    if not args.src or not args.dst:
+        tmpdir = tempfile.mkdtemp(prefix="bench_copy")
+    src_dir = args.src or tmpdir
+    dst_dir = args.dst or tmpdir
+    os.makedirs(src_dir, exist_ok=True)
+    os.makedirs(dst_dir, exist_ok=True)
+
+    try:
+        for name, size_mb in SAMPLES:
+            size_mb = size_mb or args.size
+            src = os.path.join(src_dir, name)
+            make_sample(src, size_mb)
+            for method in COPY_METHODS:
+                best = None
+                for _ in range(args.runs):
+                    copied, elapsed = bench(method, src, os.path.join(dst_dir, f"{name}.copy"), args.chunk * ONE_MB)
+                    best = elapsed if best is None else min(best, elapsed)
+                print(f"{name:14} {method:10} {copied / ONE_MB / best:8.1f} MB/s  best of {args.runs}")
+    finally:
+        if tmpdir:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# compare the header only date reader in libs/exifdate.py with piexif.load, as
+# the indexer used before, run from the tests directory. Point it at a directory
+# of sample files from your cameras, otherwise small samples are made up
+#
+# ./bench_exif.py --dir ~/usb_data/files/DCIM --runs 5
+
+import os
+import sys
+import time
+import shutil
+import struct
+import argparse
+import tempfile
+from collections import defaultdict
+
+sys.path.insert(0, "../")
+from libs.exifdate import read_date  # type: ignore
+
+try:
+    import piexif
+except ImportError:
+    piexif = None
+
+
+# ----------------------------------------------------------------------------
+def piexif_date(path):
+    """the old way, load everything and pick out the date"""
+    exif = piexif.load(path)["Exif"]
+    original = exif.get(piexif.ExifIFD.DateTimeOriginal)
+    offset = exif.get(piexif.ExifIFD.OffsetTimeOriginal)
+    if not original:
+        return None
+    return original.decode(), offset.decode() if offset else None
+
+
+# ----------------------------------------------------------------------------
+def make_tiff(endian="<", magic=42):
+    """a TIFF with IFD0 pointing at an Exif IFD holding the two dates, plus
+    a few KB of padding to stand in for the rest of the metadata"""
+    order = b"II" if endian == "<" else b"MM"
+    header = order + struct.pack(endian + "HI", magic, 8)
+    ifd0 = struct.pack(endian + "HHHII", 1, 0x8769, 4, 1, 26) + struct.pack(endian + "I", 0)
+    exif = (
+        struct.pack(endian + "H", 2)
+        + struct.pack(endian + "HHII", 0x9003, 2, 20, 56)
+        + struct.pack(endian + "HHII", 0x9011, 2, 7, 76)
+        + struct.pack(endian + "I", 0)
+    )
+    return header + ifd0 + exif + b"2025:07:11 10:20:30\0+01:00\0" + bytes(64 * 1024)
+
+
+# ----------------------------------------------------------------------------
+def make_samples(path):
+    tiff = make_tiff()
+    app1 = b"Exif\0\0" + tiff[: len(tiff) - 64 * 1024]
+    jpeg = b"\xff\xd8\xff\xe1" + struct.pack(">H", len(app1) + 2) + app1 + b"\xff\xda" + bytes(1024 * 1024)
+    mvhd = struct.pack(">I4sB3sII", 20, b"mvhd", 0, bytes(3), 3835000000, 0)
+    mov = (
+        struct.pack(">I4s", 16, b"ftyp") + b"qt  " + bytes(4)
+        + struct.pack(">I4s", 8 + 4 * 1024 * 1024, b"mdat") + bytes(4 * 1024 * 1024)
+        + struct.pack(">I4s", 8 + len(mvhd), b"moov") + mvhd
+    )
+    samples = {
+        "P7110109.ORF": make_tiff("<", 0x4F52),
+        "DSC_0001.NEF": make_tiff("<"),
+        "IMG_0001.CR2": make_tiff(">"),
+        "P7110110.JPG": jpeg,
+        "C0001.MOV": mov,
+    }
+    for name, data in samples.items():
+        with open(os.path.join(path, name), "wb") as f:
+            f.write(data)
+
+
+# ----------------------------------------------------------------------------
+def bench(func, path, runs):
+    best = None
+    result = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        try:
+            result = func(path)
+        except Exception as e:
+            result = f"error: {type(e).__name__}"
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+# ----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark reading photo dates")
+    parser.add_argument("--dir", help="directory of sample files, searched recursively")
+    parser.add_argument("--runs", type=int, default=5, help="runs per file, the best is kept")
+    args = parser.parse_args()
+
+    tmpdir = None
+    if not args.dir:
+        tmpdir = tempfile.mkdtemp(prefix="bench_exif")
+        make_samples(tmpdir)
+    if not piexif:
+        print("piexif is not installed, only timing the header reader")
+
+    # extension: [files, header time, piexif time, mismatches]
+    totals = defaultdict(lambda: [0, 0.0, 0.0, 0])
+    try:
+        for dirpath, dirnames, filenames in os.walk(args.dir or tmpdir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                ext = os.path.splitext(filename)[1].upper()
+                fast, fast_date = bench(read_date, path, args.runs)
+                total = totals[ext]
+                total[0] += 1
+                total[1] += fast
+                if piexif:
+                    slow, slow_date = bench(piexif_date, path, args.runs)
+                    total[2] += slow
+                    # piexif cannot read videos at all, so only count where it found a date
+                    if isinstance(slow_date, tuple) and slow_date != fast_date:
+                        total[3] += 1
+                        print(f"{path}: header {fast_date} piexif {slow_date}")
+
+        print(f"{'ext':6} {'files':>6} {'header us':>10} {'piexif us':>10} {'speedup':>8} {'differ':>6}")
+        for ext, (count, fast, slow, differ) in sorted(totals.items()):
+            fast_us = fast / count * 1e6
+            slow_us = slow / count * 1e6
+            speedup = f"{slow / fast:7.1f}x" if piexif and fast else "-"
+            print(f"{ext:6} {count:6} {fast_us:10.1f} {slow_us:10.1f} {speedup:>8} {differ:6}")
+    finally:
+        if tmpdir:
+            shutil.rmtree(tmpdir)
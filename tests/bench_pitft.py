@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# replay a transcript made with mqtt2jsonl (see test_status) through a copy of
+# the gnarly_status_pitft screen layout, drawing onto a mocked ST7789, run from
+# the tests directory. The bytes sent over SPI are compared for sending the
+# whole frame on every update, as the pitft used to, the whole frame only when
+# something changed, and only the changed windows with libs/framediff.py
+#
+# ./bench_pitft.py --transcript photo_import.json --repeat 20
+
+import os
+import sys
+import json
+import time
+import argparse
+
+from PIL import Image, ImageDraw, ImageFont
+
+sys.path.insert(0, "../")
+from libs.framediff import FrameDiff, WINDOW_OVERHEAD, BYTES_PER_PIXEL  # type: ignore
+
+FONT = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+
+
+class MockDisplay:
+    """MockDisplay
+    counts what would be sent to an ST7789, each window is rotated and turned
+    into bytes as adafruit_rgb_display does, so that CPU time is included"""
+
+    def __init__(self, baudrate) -> None:
+        self.baudrate = baudrate
+        self.windows = 0
+        self.bytes = 0
+
+    def image(self, img, rotation=0, x=0, y=0):
+        if rotation:
+            img = img.rotate(rotation, expand=True)
+        img.convert("RGB").tobytes()
+        self.windows += 1
+        self.bytes += WINDOW_OVERHEAD + img.size[0] * img.size[1] * BYTES_PER_PIXEL
+
+    def spi_seconds(self):
+        return self.bytes * 8 / self.baudrate
+
+
+class Screen:
+    """Screen
+    the mini pitft layout from gnarly_status_pitft, marking what it draws"""
+
+    def __init__(self, frame, font_size, newline, width, height) -> None:
+        self.frame = frame
+        self.image = frame.image
+        self.draw = ImageDraw.Draw(self.image)
+        self.font = ImageFont.truetype(FONT, font_size) if os.path.exists(FONT) else ImageFont.load_default()
+        self.font_size = font_size
+        self.newline = newline
+        self.width = width
+        self.height = height
+        self.shown_time = ""
+
+    def text(self, xy, txt, color="#FFFFFF", anchor=None):
+        self.draw.text(xy, txt, font=self.font, fill=color, anchor=anchor)
+        self.frame.mark(self.draw.textbbox(xy, txt, font=self.font, anchor=anchor))
+
+    def cls(self):
+        self.draw.rectangle((0, 0, self.width, self.height), fill=0)
+        self.frame.mark_all()
+
+    def clr_line(self, line, fill="#000000"):
+        y = line * self.newline
+        self.draw.rectangle((0, y, self.width, y + self.newline), fill=fill)
+        self.frame.mark((0, y, self.width + 1, y + self.newline + 1))
+
+    def center_line(self, txt, line, color="#FFFFFF", bg="#000000"):
+        self.clr_line(line, bg)
+        self.text((self.width / 2, line * self.newline + self.font_size / 2 + 2), txt, color, "mm")
+
+    def progress(self, text, line, progress, color):
+        y = line * self.newline
+        self.text((0, y), text, color)
+        offset = self.font_size / 2
+        x, y, width, height = 70, y + offset / 2, 170, self.font_size - offset
+        self.draw.rectangle((x, y, x + width, y + height), fill="#000000")
+        self.frame.mark((x, y, x + width + 1, y + height + 1))
+        self.draw.rounded_rectangle((x, y, x + int(width * progress), y + height), fill=color, radius=5)
+
+    def show(self, topic, data):
+        ratio = lambda a, b: max(0.0, min(1.0, a / b)) if b else 0
+        if topic in ("/photos/startcopy", "/photos/endcopy"):
+            self.cls()
+        elif topic == "/photos/ready":
+            self.center_line(data.get("msg", ""), 2, "#000000", "#FFFF00")
+        elif topic == "/photos/waitremove":
+            self.center_line("Remove SD Card / Camera", 2, "#FFFFFF", "#800080")
+        elif topic == "/photos/fivelines":
+            self.cls()
+            for line, txt in enumerate(data["lines"][:5]):
+                self.center_line(txt, line, "#20A020")
+        elif topic == "/photos/devicedata":
+            self.progress("SD", 3, ratio(data["sd_size"] - data["sd_free"], data["sd_size"]), "#FF00FF")
+            self.progress("HD", 4, ratio(data["hd_size"] - data["hd_free"], data["hd_size"]), "#00FFFF")
+        elif topic == "/photos/copydata":
+            if data["size"]:
+                self.progress("Copy", 1, ratio(data["copied"], data["size"]), "#FF0000")
+            self.progress("Files", 2, ratio(data["files_copied"], data["files_total"]), "#FFFF00")
+            self.clr_line(6)
+            self.text((0, 6 * self.newline), "File")
+            self.text((70, 6 * self.newline), f"{data['files_copied']}/{data['files_total']}")
+            self.center_line(f"{int(data['bps'] / 1024)}Kb/s", 7, "#FFFFFF", "#0000FF")
+        # the clock, as update_display draws it
+        now = time.strftime("%X", time.gmtime(data.get("_epoch", 0)))
+        if now != self.shown_time:
+            self.center_line(now, 0)
+            self.shown_time = now
+
+
+# ----------------------------------------------------------------------------
+def replay(messages, mode, args):
+    disp = MockDisplay(args.baudrate)
+    image = Image.new("RGB", (args.width, args.height))
+    frame = FrameDiff(disp, image, args.rotation, partial=mode == "partial")
+    screen = Screen(frame, args.font_size, args.newline, args.width, args.height)
+    frame.flush()
+    start = time.process_time()
+    for topic, data in messages:
+        screen.show(topic, data)
+        if mode == "always":
+            frame.dirty = []
+            disp.image(image, args.rotation)
+        else:
+            frame.flush()
+    return time.process_time() - start, disp
+
+
+# ----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark sending status screens to the pitft")
+    parser.add_argument("--transcript", default="photo_import.json", help="mqtt2jsonl capture of an import")
+    parser.add_argument("--repeat", type=int, default=20, help="times to repeat the transcript")
+    parser.add_argument("--baudrate", type=int, default=64000000, help="SPI clock, as BAUDRATE in gnarly_status_pitft")
+    parser.add_argument("--rotation", type=int, default=90)
+    parser.add_argument("--width", type=int, default=240)
+    parser.add_argument("--height", type=int, default=135)
+    parser.add_argument("--font-size", type=int, default=14)
+    parser.add_argument("--newline", type=int, default=16)
+    args = parser.parse_args()
+
+    messages = []
+    for line in open(args.transcript):
+        message = json.loads(line)
+        messages.append((message["topic"], message["data"]))
+    messages *= args.repeat
+
+    print(f"{len(messages)} messages, {args.width}x{args.height} at {args.baudrate / 1e6:.0f}MHz")
+    print(f"{'mode':8} {'windows':>8} {'KB sent':>9} {'KB/msg':>7} {'cpu ms':>8} {'spi ms':>8} {'max fps':>8}")
+    for mode in ("always", "changed", "partial"):
+        cpu, disp = replay(messages, mode, args)
+        total = cpu + disp.spi_seconds()
+        print(
+            f"{mode:8} {disp.windows:8} {disp.bytes / 1024:9.0f} {disp.bytes / 1024 / len(messages):7.2f}"
+            f" {cpu * 1000:8.1f} {disp.spi_seconds() * 1000:8.1f} {len(messages) / total:8.0f}"
+        )
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# replay a captured rsync run through the old line by line parser and the block
+# parser in libs/rsync_parser.py, run from the tests directory. The copydata
+# messages in a transcript made with mqtt2jsonl (see test_rsync) are turned back
+# into the output rsync -i --progress gave, which is fed through a pipe from cat
+# as it would be from rsync, the CPU time used per MB synced is compared
+#
+# ./bench_rsync_parser.py --transcript rsync.json --repeat 50
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, "../")
+from libs.rsync_parser import ProgressEvent, read_events  # type: ignore
+
+ONE_MB = 1024 * 1024
+
+
+# ----------------------------------------------------------------------------
+def rsync_output(transcript):
+    """the rsync output that would have given the copydata messages
+
+    Returns:
+        (bytes output, bytes synced)
+    """
+    out = []
+    current = None
+    synced = 0
+    xfr = 0
+    for line in open(transcript):
+        message = json.loads(line)
+        if message["topic"] != "/photos/copydata":
+            continue
+        data = message["data"]
+        if data["fromfile"] != current:
+            current = data["fromfile"]
+            out.append(f">f+++++++++ index/{os.path.basename(current)}\n")
+        percent = int(100 * data["copied"] / data["size"]) if data["size"] else 100
+        speed = f"{data['bps'] / ONE_MB:.2f}MB/s"
+        if data["copied"] >= data["size"]:
+            xfr += 1
+            synced += data["size"]
+            total = data["files_total"]
+            out.append(f"{data['copied']:>15,} {percent:3}% {speed:>11}    0:00:05 (xfr#{xfr}, to-chk={total - xfr}/{total})\n")
+        else:
+            out.append(f"{data['copied']:>15,} {percent:3}% {speed:>11}    0:00:03\r")
+    return "".join(out).encode(), synced
+
+
+# ----------------------------------------------------------------------------
+def old_parser(path):
+    """as gnarly_rsync used to, a text mode pipe read a line at a time, with
+    several regexes tried on each line"""
+    proc = subprocess.Popen(["cat", path], stdout=subprocess.PIPE, universal_newlines=True)
+    files = 0
+    while True:
+        line = proc.stdout.readline()
+        if line == "":
+            break
+        line = line.strip()
+        if not line:
+            continue
+        itemise_match = re.match(r"^([<>ch.][fdLDS]\S*)\s+(.+)$", line)
+        if itemise_match:
+            continue
+        progress_match = re.search(r"([\d,]+)\s+\d+%\s+([\d.]+)([MKk]?)B\/s", line)
+        if progress_match:
+            int(progress_match.group(1).replace(",", ""))
+            float(progress_match.group(2))
+            if re.search(r"xfr#\d+", line):
+                files += 1
+    proc.wait()
+    return files
+
+
+# ----------------------------------------------------------------------------
+def new_parser(path):
+    proc = subprocess.Popen(["cat", path], stdout=subprocess.PIPE)
+    files = 0
+    for event in read_events(proc.stdout.fileno()):
+        if isinstance(event, ProgressEvent) and event.done:
+            files += 1
+    proc.wait()
+    return files
+
+
+# ----------------------------------------------------------------------------
+def bench(func, path, runs):
+    best = None
+    result = None
+    for _ in range(runs):
+        start = time.process_time()
+        result = func(path)
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+# ----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark parsing rsync output")
+    parser.add_argument("--transcript", default="rsync.json", help="mqtt2jsonl capture of an rsync run")
+    parser.add_argument("--repeat", type=int, default=50, help="times to repeat the transcript, to make a long run")
+    parser.add_argument("--runs", type=int, default=5, help="runs of each parser, the best is kept")
+    args = parser.parse_args()
+
+    output, synced = rsync_output(args.transcript)
+    if not synced:
+        print(f"no completed files in {args.transcript}")
+        sys.exit(1)
+    output *= args.repeat
+    synced *= args.repeat
+
+    with tempfile.NamedTemporaryFile(prefix="bench_rsync_parser") as f:
+        f.write(output)
+        f.flush()
+        print(f"{len(output) / 1024:.0f}KB of rsync output for {synced / ONE_MB:.0f}MB synced")
+        print(f"{'parser':8} {'files':>6} {'cpu ms':>8} {'us/MB':>8}")
+        for name, func in (("old", old_parser), ("block", new_parser)):
+            cpu, files = bench(func, f.name, args.runs)
+            print(f"{name:8} {files:6} {cpu * 1000:8.1f} {cpu * 1e6 / (synced / ONE_MB):8.2f}")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# time a backup with 1, 2, 3... rsync streams, as gnarly_rsync does with
+# rsync.streams, run from the tests directory. The target defaults to a temp
+# dir, for numbers closer to a NAS use a loopback ssh target such as
+# localhost:/tmp/bench_rsync, or the NAS itself
+#
+# ./bench_rsync_streams.py --files 24 --size 20 --streams 4 --target localhost:/tmp/bench_rsync
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, "../")
+from libs.rsync_streams import MultiStream, shard_by_size  # type: ignore
+
+ONE_MB = 1024 * 1024
+
+
+# ----------------------------------------------------------------------------
+def make_samples(path, count, size_mb):
+    """count files of about size_mb, a few larger and smaller like a real card"""
+    files = []
+    os.makedirs(path, exist_ok=True)
+    for i in range(count):
+        name = f"P71101{i:02}.ORF"
+        size = max(1, int(size_mb * (0.5 + (i % 4) / 2)))
+        with open(os.path.join(path, name), "wb") as f:
+            for _ in range(size):
+                f.write(os.urandom(ONE_MB))
+        files.append((os.path.join(os.path.basename(path), name), size * ONE_MB))
+    return files
+
+
+# ----------------------------------------------------------------------------
+def clear_target(target):
+    host, sep, path = target.partition(":")
+    if sep and "/" not in host:
+        subprocess.run(["ssh", host, f"rm -rf {path}/index"], check=False)
+    else:
+        shutil.rmtree(os.path.join(target, "index"), ignore_errors=True)
+
+
+# ----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark gnarly_rsync with several streams")
+    parser.add_argument("--files", type=int, default=24, help="files to send")
+    parser.add_argument("--size", type=int, default=20, help="average file size in MB")
+    parser.add_argument("--streams", type=int, default=4, help="try from 1 up to this many streams")
+    parser.add_argument("--target", help="where to send to, defaults to a temp dir")
+    args = parser.parse_args()
+
+    if not shutil.which("rsync"):
+        print("rsync is not installed")
+        sys.exit(1)
+
+    tmpdir = tempfile.mkdtemp(prefix="bench_rsync")
+    target = args.target
+    if not target:
+        target = os.path.join(tmpdir, "target")
+        os.makedirs(target)
+    try:
+        source = os.path.join(tmpdir, "index")
+        files = make_samples(source, args.files, args.size)
+        total = sum(size for path, size in files)
+
+        print(f"{'streams':>7} {'seconds':>8} {'MB/s':>8}")
+        for streams in range(1, args.streams + 1):
+            clear_target(target)
+            start = time.perf_counter()
+            ok = MultiStream(source, target, shard_by_size(files, streams)).run()
+            elapsed = time.perf_counter() - start
+            result = f"{total / elapsed / ONE_MB:8.1f}" if ok else "  failed"
+            print(f"{streams:7} {elapsed:8.2f} {result}")
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# check libs/broadcast.py shares events between browsers, skips a slow one
+# forward, and coalesces progress without losing the changes of state
+#
+# ./test_broadcast.py  or  python -m pytest tests/test_broadcast.py
+
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from libs.broadcast import Broadcast, sse_event  # type: ignore
+
+
+# ----------------------------------------------------------------------------
+def decode(event):
+    assert event.startswith(b"data: ") and event.endswith(b"\n\n")
+    return json.loads(event[6:])["message"]
+
+
+# ----------------------------------------------------------------------------
+def test_sse_event():
+    assert decode(sse_event("/photos/ready", {"msg": "ready"})) == {"topic": "/photos/ready", "payload": {"msg": "ready"}}
+
+
+# ----------------------------------------------------------------------------
+def test_ring_skips_a_slow_reader():
+    broadcast = Broadcast(size=4, intervals={"copydata": 0})
+    for n in range(10):
+        broadcast.publish("/photos/fivelines", {"n": n})
+    cursor, keepalives, events = broadcast.read(0, 0, 0)
+    assert cursor == 10
+    # only the newest the ring still holds
+    assert [decode(e)["payload"]["n"] for e in events] == [6, 7, 8, 9]
+    assert broadcast.stats["skipped"] == 6
+
+    broadcast.publish("/photos/fivelines", {"n": 10})
+    cursor, keepalives, events = broadcast.read(cursor, keepalives, 0)
+    assert cursor == 11 and [decode(e)["payload"]["n"] for e in events] == [10]
+
+
+# ----------------------------------------------------------------------------
+def test_coalescing():
+    broadcast = Broadcast(intervals={"copydata": 10})
+    for copied in range(5):
+        broadcast.publish("/photos/copydata", {"copied": copied})
+    # another device's progress is kept separately
+    broadcast.publish("/photos/copydata", {"copied": 50, "device": "sdb1"})
+    broadcast.publish("/photos/endcopy", {})
+    cursor, keepalives, events = broadcast.read(0, 0, 0)
+    messages = [decode(e) for e in events]
+    # the first straight away, the latest held back is sent before the change
+    # of state, never after it
+    assert [m["payload"].get("copied") for m in messages[:2]] == [0, 50]
+    assert messages[2]["payload"]["copied"] == 4
+    assert messages[-1]["topic"] == "/photos/endcopy"
+    assert len(messages) == 4
+    assert broadcast.stats["coalesced"] == 3
+
+
+# ----------------------------------------------------------------------------
+def test_coalesced_sent_when_interval_is_up():
+    broadcast = Broadcast(intervals={"copydata": 0.05})
+    broadcast.publish("/photos/copydata", {"copied": 1})
+    broadcast.publish("/photos/copydata", {"copied": 2})
+    cursor, keepalives, events = broadcast.read(0, 0, 0)
+    assert len(events) == 1
+    cursor, keepalives, events = broadcast.read(cursor, keepalives, 2)
+    assert [decode(e)["payload"]["copied"] for e in events] == [2]
+
+
+# ----------------------------------------------------------------------------
+def test_keepalive_is_not_an_event():
+    broadcast = Broadcast()
+    broadcast.publish("/photos/keepalive", {})
+    cursor, keepalives, events = broadcast.read(0, 0, 0)
+    assert cursor == 0 and keepalives == 1 and events == []
+
+    stream = broadcast.events(timeout=0.01)
+    assert next(stream) == b": keepalive\n\n"
+    broadcast.publish("/photos/ready", {"msg": "ready"})
+    assert decode(next(stream))["topic"] == "/photos/ready"
+
+
+# ----------------------------------------------------------------------------
+def test_aevents():
+    async def main():
+        broadcast = Broadcast()
+        broadcast.attach_loop(asyncio.get_running_loop())
+        stream = broadcast.aevents(timeout=5)
+
+        def publish():
+            time.sleep(0.05)
+            broadcast.publish("/photos/ready", {"msg": "ready"})
+
+        # published from another thread, as the messaging thread does
+        threading.Thread(target=publish).start()
+        event = await asyncio.wait_for(stream.__anext__(), 2)
+        assert decode(event)["topic"] == "/photos/ready"
+        await stream.aclose()
+
+    asyncio.run(main())
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_"):
+            func()
+            print(f"{name} ok")
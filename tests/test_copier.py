@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# check libs/copier.py copies the same bytes whichever method is used, and
+# that the kernel copy carries on the slow way where the kernel cannot copy
+#
+# ./test_copier.py  or  python -m pytest tests/test_copier.py
+
+import os
+import sys
+import errno
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import libs.copier as copier  # type: ignore
+from libs.copier import COPY_METHODS, copy_stream, kernel_copy  # type: ignore
+
+CHUNK = 4096
+DATA = os.urandom(10 * CHUNK + 123)
+
+
+# ----------------------------------------------------------------------------
+@contextlib.contextmanager
+def kernel_calls(*calls):
+    """kernel_copy tries these instead of copy_file_range and sendfile"""
+    saved = list(copier.KERNEL_CALLS)
+    copier.KERNEL_CALLS[:] = calls
+    try:
+        yield
+    finally:
+        copier.KERNEL_CALLS[:] = saved
+
+
+# ----------------------------------------------------------------------------
+def copy(method, offset=0):
+    """copy DATA from offset with method, into a file that already has the
+    part before offset
+
+    Returns:
+        (bytes copied, what the file holds, progress reported)
+    """
+    with tempfile.TemporaryDirectory() as root:
+        src = os.path.join(root, "src")
+        dst = os.path.join(root, "dst")
+        with open(src, "wb") as f:
+            f.write(DATA)
+        with open(dst, "wb") as f:
+            f.write(DATA[:offset])
+        progress = []
+        with open(src, "rb") as f_in, open(dst, "r+b") as f_out:
+            f_in.seek(offset)
+            f_out.seek(offset)
+            copied = method(f_in, f_out, CHUNK, progress.append)
+            assert f_in.tell() == f_out.tell() == len(DATA)
+        with open(dst, "rb") as f:
+            return copied, f.read(), progress
+
+
+# ----------------------------------------------------------------------------
+def test_methods():
+    for name in COPY_METHODS:
+        copied, data, progress = copy(lambda *args: copy_stream(name, *args))
+        assert copied == len(DATA) and data == DATA, name
+        assert progress[-1] == len(DATA), name
+    copied, data, progress = copy(lambda *args: copy_stream("unknown", *args), offset=CHUNK + 5)
+    assert copied == len(DATA) - CHUNK - 5 and data == DATA
+
+
+# ----------------------------------------------------------------------------
+def test_kernel_copy_unsupported():
+    def unsupported(in_fd, out_fd, count, in_offset, out_offset):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    with kernel_calls(unsupported, unsupported):
+        copied, data, progress = copy(kernel_copy, offset=100)
+    assert copied == len(DATA) - 100 and data == DATA
+    assert progress[-1] == copied
+
+
+# ----------------------------------------------------------------------------
+def test_kernel_copy_stops_part_way():
+    calls = []
+
+    def stops(in_fd, out_fd, count, in_offset, out_offset):
+        # copies a few chunks, then returns 0 as some filesystems do
+        calls.append(in_offset)
+        if len(calls) > 3:
+            return 0
+        data = os.pread(in_fd, count, in_offset)
+        return os.pwrite(out_fd, data, out_offset)
+
+    with kernel_calls(stops):
+        copied, data, progress = copy(kernel_copy, offset=7)
+    # carries on from where it got to, without going back over the start
+    assert copied == len(DATA) - 7 and data == DATA
+    assert calls[:3] == [7, 7 + CHUNK, 7 + 2 * CHUNK]
+    assert progress == sorted(progress) and progress[-1] == copied
+
+
+# ----------------------------------------------------------------------------
+def test_kernel_copy_other_errors():
+    def full(in_fd, out_fd, count, in_offset, out_offset):
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    with kernel_calls(full):
+        try:
+            copy(kernel_copy)
+        except OSError as e:
+            assert e.errno == errno.ENOSPC
+        else:
+            assert False, "a full disk is not a reason to copy another way"
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_"):
+            func()
+            print(f"{name} ok")
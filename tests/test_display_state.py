@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# check libs/display_state.py reduces the status messages into the state the
+# status devices draw, and that the render loop draws bursts as one frame
+#
+# ./test_display_state.py  or  python -m pytest tests/test_display_state.py
+
+import os
+import sys
+import time
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from libs.display_state import INITIAL_STATE, RenderLoop, human_rate, lit_pixels, reduce_message  # type: ignore
+
+
+# ----------------------------------------------------------------------------
+def copydata(fromfile, copied, epoch, size=1000):
+    return {
+        "fromfile": fromfile,
+        "tofile": f"/store/{fromfile}",
+        "size": size,
+        "copied": copied,
+        "files_copied": 1,
+        "files_total": 4,
+        "_epoch": epoch,
+    }
+
+
+# ----------------------------------------------------------------------------
+def test_copy_progress():
+    state = reduce_message(INITIAL_STATE, "/photos/startcopy", {"_epoch": 100})
+    assert state.screen == "copy" and state.copy is None
+
+    state = reduce_message(state, "/photos/copydata", copydata("a.ORF", 0, 100))
+    state = reduce_message(state, "/photos/copydata", copydata("a.ORF", 500, 105))
+    assert state.copy.fromfile == "a.ORF"
+    assert state.copy.file_ratio == 0.5 and state.copy.files_ratio == 0.25
+    # worked out from when the file started, as the message has no bps
+    assert state.copy.bps == 100
+
+    # a new file starts the clock again
+    state = reduce_message(state, "/photos/copydata", copydata("b.ORF", 0, 110))
+    assert state.file_started == 110 and state.copy.bps == 0
+
+    state = reduce_message(state, "/photos/endcopy", {"_epoch": 120})
+    assert state.screen == "copied"
+
+
+# ----------------------------------------------------------------------------
+def test_screens():
+    state = reduce_message(INITIAL_STATE, "/photos/error", {"msg": "bad card", "msg2": "sda1", "level": 3})
+    assert state.screen == "error" and state.error == ("bad card", "sda1", 3)
+    state = reduce_message(state, "/photos/ready", {"msg": "insert a card"})
+    assert state.screen == "ready" and state.message == "insert a card" and state.error is None
+    state = reduce_message(state, "/photos/fivelines", {"lines": ["1", "2", "3", "4", "5", "6"], "color": "red"})
+    assert state.screen == "lines" and state.lines == ["1", "2", "3", "4", "5"]
+    state = reduce_message(state, "/photos/diskfull", {"diskname": "store"})
+    assert state.screen == "diskfull" and state.message == "store"
+
+    disks = reduce_message(state, "/photos/devicedata", {"sd_size": 100, "sd_free": 25, "hd_size": 0, "hd_free": 0}).disks
+    assert disks.sd_ratio == 0.75 and disks.hd_ratio == 0.0
+    assert reduce_message(state, "/photos/keepalive", {}).alive == state.alive + 1
+
+
+# ----------------------------------------------------------------------------
+def test_unknown_topic_and_immutability():
+    state = reduce_message(INITIAL_STATE, "/photos/ready", {"msg": "ready"})
+    assert reduce_message(state, "/photos/inserted", {}) is state
+    assert INITIAL_STATE.screen == "idle" and INITIAL_STATE.message == ""
+
+
+# ----------------------------------------------------------------------------
+def test_helpers():
+    assert human_rate(512) == "512"
+    assert human_rate(640 * 1024) == "640K"
+    assert human_rate(12 * 1024 * 1024) == "12M"
+    assert lit_pixels(0.5, 8) == 4
+    assert lit_pixels(1.5, 8) == 8
+    assert lit_pixels(-1, 8) == 0
+
+
+# ----------------------------------------------------------------------------
+def test_render_loop_draws_the_latest():
+    drawn = []
+    done = threading.Event()
+
+    def render(state):
+        drawn.append(state)
+        if state.copy and state.copy.copied == 999:
+            done.set()
+
+    renderer = RenderLoop(render, rate=20, tick=0).start()
+    for copied in range(1000):
+        renderer.update("/photos/copydata", copydata("a.ORF", copied, 100))
+    assert done.wait(5)
+    renderer.stop()
+    # the burst is drawn in a few frames, the last being the latest state
+    assert len(drawn) < 10
+    assert drawn[-1].copy.copied == 999
+    assert renderer.stats["messages"] == 1000
+
+
+# ----------------------------------------------------------------------------
+def test_render_loop_stop():
+    drawn = []
+    renderer = RenderLoop(drawn.append, rate=50, tick=0.01).start()
+    time.sleep(0.1)
+    renderer.stop()
+    count = len(drawn)
+    renderer.update("/photos/ready", {"msg": "ready"})
+    time.sleep(0.1)
+    assert count and len(drawn) == count
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_"):
+            func()
+            print(f"{name} ok")
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# check libs/framediff.py sends the right windows, so the display always ends
+# up showing the image, whatever the rotation. Needs Pillow
+#
+# ./test_framediff.py  or  python -m pytest tests/test_framediff.py
+
+import os
+import sys
+import random
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+ImageDraw = pytest.importorskip("PIL.ImageDraw")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from libs.framediff import FrameDiff, merge_boxes, window_origin  # type: ignore
+
+WIDTH = 240
+HEIGHT = 135
+
+
+class MockDisplay:
+    """MockDisplay
+    what an ST7789 would show, the image is rotated counter clockwise and
+    written at x, y as adafruit_rgb_display does"""
+
+    def __init__(self, rotation) -> None:
+        size = (HEIGHT, WIDTH) if rotation in (90, 270) else (WIDTH, HEIGHT)
+        self.screen = Image.new("RGB", size)
+        self.windows = []
+
+    def image(self, img, rotation, x, y):
+        window = img.rotate(rotation, expand=True)
+        self.screen.paste(window, (x, y))
+        self.windows.append((x, y, window.size))
+
+
+# ----------------------------------------------------------------------------
+def touching(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+# ----------------------------------------------------------------------------
+def test_merge_boxes():
+    assert merge_boxes([]) == []
+    assert merge_boxes([(0, 0, 10, 10), (10, 0, 20, 10)]) == [(0, 0, 20, 10)]
+    assert sorted(merge_boxes([(0, 0, 10, 10), (50, 50, 60, 60)])) == [(0, 0, 10, 10), (50, 50, 60, 60)]
+    # the third box joins the first two once they have been merged
+    assert merge_boxes([(0, 0, 10, 10), (30, 0, 40, 10), (5, 20, 35, 30), (9, 9, 31, 21)]) == [(0, 0, 40, 30)]
+
+
+# ----------------------------------------------------------------------------
+def test_merge_boxes_random():
+    rand = random.Random(27)
+    for _ in range(200):
+        boxes = []
+        for _ in range(rand.randint(1, 12)):
+            x0, y0 = rand.randint(0, WIDTH - 1), rand.randint(0, HEIGHT - 1)
+            boxes.append((x0, y0, rand.randint(x0 + 1, WIDTH), rand.randint(y0 + 1, HEIGHT)))
+        merged = merge_boxes(boxes)
+        for box in boxes:
+            assert any(m[0] <= box[0] and m[1] <= box[1] and box[2] <= m[2] and box[3] <= m[3] for m in merged)
+        for i, a in enumerate(merged):
+            for b in merged[i + 1 :]:
+                assert not touching(a, b)
+
+
+# ----------------------------------------------------------------------------
+@pytest.mark.parametrize("rotation", [0, 90, 180, 270])
+def test_window_origin(rotation):
+    image = Image.new("RGB", (WIDTH, HEIGHT))
+    # every pixel a different colour, so a window in the wrong place shows
+    image.putdata([(x, y, (x + y) % 256) for y in range(HEIGHT) for x in range(WIDTH)])
+    rotated = image.rotate(rotation, expand=True)
+    for box in [(0, 0, 10, 5), (230, 130, 240, 135), (17, 40, 101, 77), (0, 0, WIDTH, HEIGHT)]:
+        window = image.crop(box).rotate(rotation, expand=True)
+        x, y = window_origin(box, image.size, rotation)
+        assert rotated.crop((x, y, x + window.width, y + window.height)).tobytes() == window.tobytes(), box
+
+
+# ----------------------------------------------------------------------------
+@pytest.mark.parametrize("rotation", [0, 90, 180, 270])
+def test_flush_sends_only_changes(rotation):
+    image = Image.new("RGB", (WIDTH, HEIGHT))
+    draw = ImageDraw.Draw(image)
+    disp = MockDisplay(rotation)
+    frame = FrameDiff(disp, image, rotation)
+
+    # the first frame is sent whole
+    assert frame.flush() == 1
+    assert disp.windows[-1][2] == disp.screen.size
+
+    # a marked line where only a few pixels change sends just those
+    draw.rectangle((20, 30, 29, 34), fill="#ff0000")
+    frame.mark((0, 28, WIDTH, 56))
+    assert frame.flush() == 1
+    x, y, size = disp.windows[-1]
+    assert sorted(size) == [5, 10]
+
+    # drawn and marked, but the same as what is shown
+    draw.rectangle((20, 30, 29, 34), fill="#ff0000")
+    frame.mark((0, 28, WIDTH, 56))
+    assert frame.flush() == 0
+    assert frame.stats["skipped"] == 1
+
+    rand = random.Random(rotation)
+    for _ in range(50):
+        x0, y0 = rand.randint(0, WIDTH - 1), rand.randint(0, HEIGHT - 1)
+        box = (x0, y0, rand.randint(x0, WIDTH - 1), rand.randint(y0, HEIGHT - 1))
+        draw.rectangle(box, fill=tuple(rand.randint(0, 255) for _ in range(3)))
+        frame.mark((box[0], box[1], box[2] + 1, box[3] + 1))
+        if rand.random() < 0.3:
+            frame.flush()
+    frame.flush()
+    assert disp.screen.tobytes() == image.rotate(rotation, expand=True).tobytes()
+
+
+if __name__ == "__main__":
+    test_merge_boxes()
+    test_merge_boxes_random()
+    for rotation in (0, 90, 180, 270):
+        test_window_origin(rotation)
+        test_flush_sends_only_changes(rotation)
+    print("framediff ok")
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# check libs/hashindex.py finds a file already in the store by its content,
+# only working out the full hashes of the stored files when it has to
+#
+# ./test_hashindex.py  or  python -m pytest tests/test_hashindex.py
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from libs.hashindex import HEAD_TAIL_SIZE, HashIndex, full_hash, new_hasher, partial_hash, uncached_hash  # type: ignore
+
+
+# ----------------------------------------------------------------------------
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+# ----------------------------------------------------------------------------
+def digest(data):
+    hasher = new_hasher()
+    hasher.update(data)
+    return hasher.hexdigest()
+
+
+# ----------------------------------------------------------------------------
+def test_hashes():
+    with tempfile.TemporaryDirectory() as root:
+        data = os.urandom(3 * HEAD_TAIL_SIZE)
+        path = write(os.path.join(root, "a.ORF"), data)
+        assert full_hash(path) == uncached_hash(path) == digest(data)
+        # the middle is not read for the partial hash, the size is
+        middle = data[:HEAD_TAIL_SIZE] + b"x" * HEAD_TAIL_SIZE + data[-HEAD_TAIL_SIZE:]
+        assert partial_hash(write(os.path.join(root, "b.ORF"), middle)) == partial_hash(path)
+        assert partial_hash(write(os.path.join(root, "c.ORF"), data + b"x")) != partial_hash(path)
+        # a small file is read once
+        assert partial_hash(write(os.path.join(root, "d.ORF"), b"small"), 5) == partial_hash(os.path.join(root, "d.ORF"))
+
+
+# ----------------------------------------------------------------------------
+def test_find_duplicate():
+    with tempfile.TemporaryDirectory() as root:
+        files = os.path.join(root, "files")
+        data = os.urandom(3 * HEAD_TAIL_SIZE)
+        same_ends = data[:HEAD_TAIL_SIZE] + os.urandom(HEAD_TAIL_SIZE) + data[-HEAD_TAIL_SIZE:]
+        write(os.path.join(files, "card1", "a.ORF"), data)
+        write(os.path.join(files, "card1", "b.ORF"), same_ends)
+        write(os.path.join(files, "card1", "c.JPG"), b"other")
+
+        hashes = HashIndex(os.path.join(root, "gnarlypi.db"))
+        assert hashes.rebuild(files) == 3
+        size, partial = len(data), partial_hash(os.path.join(files, "card1", "a.ORF"))
+        # both match on the partial hash, neither full hash is known yet
+        assert sorted(hashes.candidates(size, partial)) == [("card1/a.ORF", None), ("card1/b.ORF", None)]
+
+        found = hashes.find_duplicate(files, size, partial, digest(data), exclude="card2/a.ORF")
+        assert found == os.path.join(files, "card1", "a.ORF")
+        # the full hashes worked out are kept
+        assert dict(hashes.candidates(size, partial))["card1/a.ORF"] == digest(data)
+
+        # the new file itself is not its own duplicate
+        hashes.record("card2/a.ORF", size, partial, digest(data))
+        assert hashes.find_duplicate(files, size, partial, digest(data), exclude="card1/a.ORF") is None
+        assert hashes.find_duplicate(files, size, partial, digest(b"different"), exclude="card2/a.ORF") is None
+
+
+# ----------------------------------------------------------------------------
+def test_removed_from_the_store():
+    with tempfile.TemporaryDirectory() as root:
+        files = os.path.join(root, "files")
+        data = b"photo" * 10
+        stored = write(os.path.join(files, "a.ORF"), data)
+        hashes = HashIndex(os.path.join(root, "gnarlypi.db"))
+        hashes.rebuild(files)
+        partial = partial_hash(stored)
+        os.remove(stored)
+        assert hashes.find_duplicate(files, len(data), partial, digest(data)) is None
+        # forgotten, so it is not looked for again
+        assert hashes.candidates(len(data), partial) == []
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_"):
+            func()
+            print(f"{name} ok")
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# check libs/hub.py matches topics as MQTT does and passes messages between
+# clients on a unix socket
+#
+# ./test_hub.py  or  python -m pytest tests/test_hub.py
+
+import os
+import sys
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from libs.hub import Hub, HubClient, topic_matches  # type: ignore
+
+
+# ----------------------------------------------------------------------------
+def test_topic_matches():
+    assert topic_matches("/photos/copydata", "/photos/copydata")
+    assert not topic_matches("/photos/copydata", "/photos/copydone")
+    assert topic_matches("#", "/photos/copydata")
+    assert topic_matches("/photos/#", "/photos/copydata")
+    assert topic_matches("/photos/#", "/photos/device/sda1")
+    assert topic_matches("/photos/+", "/photos/copydata")
+    assert not topic_matches("/photos/+", "/photos/device/sda1")
+    assert topic_matches("/+/+/sda1", "/photos/device/sda1")
+    assert not topic_matches("/photos/copydata/+", "/photos/copydata")
+    assert not topic_matches("/photos", "/photos/copydata")
+
+
+# ----------------------------------------------------------------------------
+def test_round_trip():
+    with tempfile.TemporaryDirectory() as path:
+        bridged = []
+        hub = Hub(os.path.join(path, "hub"), bridge=lambda *message: bridged.append(message))
+        threading.Thread(target=hub.serve_forever, daemon=True).start()
+
+        publisher = HubClient(hub.path)
+        subscriber = HubClient(hub.path)
+        subscriber.sock.settimeout(5)
+        # retained first, so it is there whenever the subscription arrives
+        publisher.publish("/photos/ready", '{"msg": "ready"}', retain=True)
+        subscriber.subscribe(["/photos/ready", "/photos/copydata"])
+        messages = subscriber.messages()
+        assert next(messages) == ("/photos/ready", '{"msg": "ready"}')
+
+        publisher.publish("/photos/other", "{}")
+        publisher.publish("/photos/copydata", '{"copied": 1}')
+        assert next(messages) == ("/photos/copydata", '{"copied": 1}')
+
+        # from the MQTT side, not passed back to the bridge
+        hub.inject("/photos/copydata", b'{"copied": 2}')
+        assert next(messages) == ("/photos/copydata", '{"copied": 2}')
+        assert [topic for topic, payload, retain in bridged] == [b"/photos/ready", b"/photos/other", b"/photos/copydata"]
+
+        publisher.close()
+        subscriber.close()
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_"):
+            func()
+            print(f"{name} ok")
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# check libs/indexspool.py batches copied files and recovers spool files left
+# open when gnarlypi stopped
+#
+# ./test_indexspool.py  or  python -m pytest tests/test_indexspool.py
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from libs.indexspool import OPEN_EXT, IndexSpool, pending_batches, read_batch, spool_dir  # type: ignore
+
+
+# ----------------------------------------------------------------------------
+def test_batches_by_size_and_device():
+    with tempfile.TemporaryDirectory() as store:
+        announced = []
+        spool = IndexSpool(store, 2, lambda path, count: announced.append((path, count)))
+        spool.add("/store/a.ORF", "sda1")
+        spool.add("/store/b.ORF", "sdb1")
+        assert announced == []
+        spool.add("/store/c.ORF", "sda1")
+        assert len(announced) == 1 and announced[0][1] == 2
+        assert read_batch(announced[0][0]) == ["/store/a.ORF", "/store/c.ORF"]
+
+        spool.close("sdb1")
+        # nothing open for this device, nothing to announce
+        spool.close("sdc1")
+        assert [count for path, count in announced] == [2, 1]
+        assert pending_batches(store) == sorted(path for path, count in announced)
+
+
+# ----------------------------------------------------------------------------
+def test_recover():
+    with tempfile.TemporaryDirectory() as store:
+        # gnarlypi stopped part way through a card
+        spool = IndexSpool(store, 100, lambda path, count: None)
+        spool.add("/store/a.ORF", "sda1")
+        spool.add("/store/b.ORF", "sda1")
+        assert pending_batches(store) == []
+
+        announced = []
+        restarted = IndexSpool(store, 100, lambda path, count: announced.append((path, count)))
+        assert restarted.recover() == 1
+        assert len(announced) == 1 and announced[0][1] == 2
+        assert pending_batches(store) == [announced[0][0]]
+        assert read_batch(announced[0][0]) == ["/store/a.ORF", "/store/b.ORF"]
+        assert not [name for name in os.listdir(spool_dir(store)) if name.endswith(OPEN_EXT)]
+        # and only once
+        assert restarted.recover() == 0
+
+
+# ----------------------------------------------------------------------------
+def test_read_missing_batch():
+    # already indexed and removed by a rescan
+    assert read_batch("/nonexistent/indexspool/batch.batch") == []
+    assert pending_batches("/nonexistent") == []
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_"):
+            func()
+            print(f"{name} ok")
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# check libs/manifest.py knows which versions of files are already in the
+# store, between runs and after being rebuilt from the store
+#
+# ./test_manifest.py  or  python -m pytest tests/test_manifest.py
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from libs.manifest import Manifest  # type: ignore
+
+
+# ----------------------------------------------------------------------------
+def test_lookup():
+    with tempfile.TemporaryDirectory() as root:
+        db_file = os.path.join(root, "gnarlypi.db")
+        manifest = Manifest(db_file)
+        assert not manifest.existed
+        manifest.record("DCIM/100OLYMP/P7110109.ORF", 1000, 1752224400.75)
+        # mtimes are compared in whole seconds, as some cards only keep those
+        assert manifest.contains("DCIM/100OLYMP/P7110109.ORF", 1000, 1752224400.2)
+        assert not manifest.contains("DCIM/100OLYMP/P7110109.ORF", 1001, 1752224400)
+        assert not manifest.contains("DCIM/100OLYMP/P7110109.ORF", 1000, 1752224401)
+        assert not manifest.contains("DCIM/100OLYMP/P7110110.ORF", 1000, 1752224400)
+
+        # kept between runs
+        reopened = Manifest(db_file)
+        assert reopened.existed
+        assert reopened.contains("DCIM/100OLYMP/P7110109.ORF", 1000, 1752224400)
+
+
+# ----------------------------------------------------------------------------
+def test_rebuild():
+    with tempfile.TemporaryDirectory() as root:
+        files = os.path.join(root, "files")
+        os.makedirs(os.path.join(files, "DCIM"))
+        for name, data in (("a.ORF", b"a" * 10), ("b.ORF", b"b" * 20), ("c.ORF.tmp", b"c"), ("c.ORF.tmp.resume", b"c")):
+            path = os.path.join(files, "DCIM", name)
+            with open(path, "wb") as f:
+                f.write(data)
+            os.utime(path, (1752224400, 1752224400))
+
+        db_file = os.path.join(root, "gnarlypi.db")
+        manifest = Manifest(db_file)
+        manifest.record("DCIM/gone.ORF", 5, 1752224400)
+        # part copied files are left out, and anything no longer there goes
+        assert manifest.rebuild(files) == 2
+        assert manifest.contains("DCIM/a.ORF", 10, 1752224400)
+        assert manifest.contains("DCIM/b.ORF", 20, 1752224400)
+        assert not manifest.contains("DCIM/gone.ORF", 5, 1752224400)
+        assert sorted(Manifest(db_file).entries) == ["DCIM/a.ORF", "DCIM/b.ORF"]
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_"):
+            func()
+            print(f"{name} ok")
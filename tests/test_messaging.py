@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# check libs/messaging.py queues messages for the sender thread by topic and
+# device, coalescing progress without losing another card's. Needs paho
+#
+# ./test_messaging.py  or  python -m pytest tests/test_messaging.py
+
+import os
+import sys
+import threading
+
+import pytest
+
+pytest.importorskip("paho.mqtt.client")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from libs.messaging import QUEUE_SIZE, Messaging  # type: ignore
+
+
+# ----------------------------------------------------------------------------
+def blocked_messaging():
+    """a Messaging whose sender holds the first message until released, so
+    everything published after it waits in the queue
+
+    Returns:
+        the Messaging, the list it sends to and the Event that releases it
+    """
+    messaging = Messaging()
+    sent = []
+    release = threading.Event()
+    started = threading.Event()
+
+    def send(subtopic, data, retain=False):
+        started.set()
+        release.wait(5)
+        sent.append((subtopic, dict(data)))
+
+    messaging._send = send
+    messaging.publish("/photos/startcopy", {})
+    assert started.wait(5)
+    return messaging, sent, release
+
+
+# ----------------------------------------------------------------------------
+def test_coalesce_per_device():
+    messaging, sent, release = blocked_messaging()
+    for copied in range(3):
+        messaging.publish("/photos/copydata", {"copied": copied, "device": "sda1"})
+        messaging.publish("/photos/copydata", {"copied": copied * 10, "device": "sdb1"})
+    release.set()
+    assert messaging.flush()
+
+    copydata = [(data["device"], data["copied"]) for topic, data in sent if topic == "/photos/copydata"]
+    # the latest for each card, in the order each was first queued
+    assert copydata == [("sda1", 2), ("sdb1", 20)]
+    assert messaging.stats()["/photos/copydata"]["coalesced"] == 4
+
+
+# ----------------------------------------------------------------------------
+def test_policies():
+    messaging, sent, release = blocked_messaging()
+    for n in range(3):
+        messaging.publish("/photos/fivelines", {"n": n})
+    for n in range(QUEUE_SIZE + 100):
+        messaging.publish("/photos/keepalive", {"n": n})
+    for n in range(10):
+        messaging.publish("/photos/endcopy", {"n": n})
+    release.set()
+    assert messaging.flush()
+
+    stats = messaging.stats()
+    # coalesced to the latest, keeping its place in the queue
+    assert [data["n"] for topic, data in sent if topic == "/photos/fivelines"] == [2]
+    assert sent[1][0] == "/photos/fivelines"
+    # dropped once the queue is full, the fivelines message fills one place
+    assert stats["/photos/keepalive"]["dropped"] == 101
+    assert stats["/photos/keepalive"]["sent"] == QUEUE_SIZE - 1
+    # kept however full the queue is
+    assert [data["n"] for topic, data in sent if topic == "/photos/endcopy"] == list(range(10))
+    assert stats["/photos/endcopy"]["dropped"] == 0 and stats["/photos/endcopy"]["sent"] == 10
+
+
+# ----------------------------------------------------------------------------
+def test_flush_timeout():
+    messaging, sent, release = blocked_messaging()
+    messaging.publish("/photos/endcopy", {})
+    # the sender is still held up, so the queue cannot empty
+    assert not messaging.flush(timeout=0.05)
+    release.set()
+    assert messaging.flush()
+    assert [topic for topic, data in sent] == ["/photos/startcopy", "/photos/endcopy"]
+    assert messaging.depth == 0
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_"):
+            func()
+            print(f"{name} ok")
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# check libs/resume.py only resumes a partial copy that matches the source
+#
+# ./test_resume.py  or  python -m pytest tests/test_resume.py
+
+import os
+import sys
+import hashlib
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from libs.resume import BlockSums, block_sums, resume_offset, save_partial, sidecar_name  # type: ignore
+
+BLOCK = 1000
+
+
+# ----------------------------------------------------------------------------
+def copy_that_fails(path, data, copied, damage=None):
+    """make a source file and a partial copy of it, as a copy that stopped
+    after copied bytes would, with the byte at damage changed in the copy
+
+    Returns:
+        (src, tmpdest, BlockSums of what was read)
+    """
+    src = os.path.join(path, "P7110109.ORF")
+    tmpdest = os.path.join(path, "copy.ORF.tmp")
+    with open(src, "wb") as f:
+        f.write(data)
+    blocks = BlockSums(BLOCK)
+    # read in chunks that do not line up with the blocks
+    for i in range(0, copied, 300):
+        blocks.update(data[i : min(i + 300, copied)])
+    partial = bytearray(data[:copied])
+    if damage is not None:
+        partial[damage] ^= 0xFF
+    with open(tmpdest, "wb") as f:
+        f.write(partial)
+    return src, tmpdest, blocks
+
+
+# ----------------------------------------------------------------------------
+def test_block_sums_match_the_file():
+    data = os.urandom(5500)
+    with tempfile.TemporaryDirectory() as path:
+        src, tmpdest, blocks = copy_that_fails(path, data, 5500)
+        assert blocks.sums == block_sums(src, BLOCK)
+        assert len(blocks.sums) == 5
+
+
+# ----------------------------------------------------------------------------
+def test_resume_from_last_complete_block():
+    data = os.urandom(10000)
+    with tempfile.TemporaryDirectory() as path:
+        src, tmpdest, blocks = copy_that_fails(path, data, 5500)
+        assert save_partial(tmpdest, os.stat(src), BLOCK, blocks.sums)
+        # the half block at the end is not kept
+        assert os.path.getsize(tmpdest) == 5000
+
+        hasher = hashlib.sha256()
+        resumed = BlockSums(BLOCK, hasher)
+        assert resume_offset(tmpdest, os.stat(src), BLOCK, resumed, src) == 5000
+        assert hasher.digest() == hashlib.sha256(data[:5000]).digest()
+        assert resumed.sums == blocks.sums
+        assert not os.path.exists(sidecar_name(tmpdest))
+
+
+# ----------------------------------------------------------------------------
+def test_damaged_copy_is_cut_back():
+    data = os.urandom(10000)
+    with tempfile.TemporaryDirectory() as path:
+        # what reached the partial file is not what was read from the card
+        src, tmpdest, blocks = copy_that_fails(path, data, 5500, damage=3500)
+        save_partial(tmpdest, os.stat(src), BLOCK, blocks.sums)
+        assert resume_offset(tmpdest, os.stat(src), BLOCK, None, src) == 3000
+
+
+# ----------------------------------------------------------------------------
+def test_source_no_longer_matches():
+    data = os.urandom(10000)
+    with tempfile.TemporaryDirectory() as path:
+        src, tmpdest, blocks = copy_that_fails(path, data, 5500)
+        stat = os.stat(src)
+        save_partial(tmpdest, stat, BLOCK, blocks.sums)
+        # the card gives something else for the last kept block this time,
+        # with the same size and time
+        changed = bytearray(data)
+        changed[4500] ^= 0xFF
+        with open(src, "wb") as f:
+            f.write(changed)
+        os.utime(src, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        assert resume_offset(tmpdest, os.stat(src), BLOCK, None, src) == 0
+        assert not os.path.exists(tmpdest)
+
+
+# ----------------------------------------------------------------------------
+def test_different_source_starts_again():
+    data = os.urandom(10000)
+    with tempfile.TemporaryDirectory() as path:
+        src, tmpdest, blocks = copy_that_fails(path, data, 5500)
+        save_partial(tmpdest, os.stat(src), BLOCK, blocks.sums)
+        with open(src, "ab") as f:
+            f.write(b"more")
+        assert resume_offset(tmpdest, os.stat(src), BLOCK, None, src) == 0
+        assert not os.path.exists(tmpdest)
+        assert not os.path.exists(sidecar_name(tmpdest))
+
+
+# ----------------------------------------------------------------------------
+def test_nothing_to_resume():
+    data = os.urandom(10000)
+    with tempfile.TemporaryDirectory() as path:
+        src, tmpdest, blocks = copy_that_fails(path, data, 500)
+        # not even one complete block, nothing worth keeping
+        assert not save_partial(tmpdest, os.stat(src), BLOCK, blocks.sums)
+        assert not os.path.exists(tmpdest)
+        assert resume_offset(tmpdest, os.stat(src), BLOCK, None, src) == 0
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_"):
+            func()
+            print(f"{name} ok")
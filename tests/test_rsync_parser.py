@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# check libs/rsync_parser.py turns rsync -i --progress output into events
+# however the reads split it, including \r and \n landing in different blocks
+#
+# ./test_rsync_parser.py  or  python -m pytest tests/test_rsync_parser.py
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from libs.rsync_parser import FileEvent, MessageEvent, ProgressEvent, RsyncParser, parse_line, read_events  # type: ignore
+
+OUTPUT = (
+    b">f+++++++++ 2026/P7110109.ORF\n"
+    b"        32,768   0%    0.00kB/s    0:00:00\r"
+    b"    19,616,732 100%   45.23MB/s    0:00:00 (xfr#1, to-chk=1/3)\r\n"
+    b".d..t...... 2026/\n"
+    b"rsync: some warning\n"
+)
+
+
+# ----------------------------------------------------------------------------
+def feed_all(blocks):
+    parser = RsyncParser()
+    events = []
+    for block in blocks:
+        events += parser.feed(block)
+    return events + parser.close()
+
+
+# ----------------------------------------------------------------------------
+def test_parse_line():
+    assert parse_line(b">f+++++++++ a b.ORF") == FileEvent(">f+++++++++", "a b.ORF", True)
+    assert parse_line(b".d..t...... 2026/") == FileEvent(".d..t......", "2026/", False)
+    assert parse_line(b"   1,024  50%  1.50MB/s  0:00:01") == ProgressEvent(1024, 50, 1572864, False, None, None)
+    assert parse_line(b"  2,048 100%  2.00kB/s  0:00:00 (xfr#2, ir-chk=5/9)") == ProgressEvent(2048, 100, 2048, True, 5, 9)
+    assert parse_line(b"sent 1 bytes") == MessageEvent("sent 1 bytes")
+    assert parse_line(b"   ") is None
+
+
+# ----------------------------------------------------------------------------
+def test_whole_output():
+    events = feed_all([OUTPUT])
+    assert [type(event).__name__ for event in events] == [
+        "FileEvent", "ProgressEvent", "ProgressEvent", "FileEvent", "MessageEvent"
+    ]
+    assert events[0].transferred and events[0].path == "2026/P7110109.ORF"
+    assert not events[1].done and events[2].done and events[2].copied == 19616732
+
+
+# ----------------------------------------------------------------------------
+def test_split_anywhere():
+    expected = feed_all([OUTPUT])
+    # every place a read could end, including between a \r and its \n
+    for split in range(1, len(OUTPUT)):
+        assert feed_all([OUTPUT[:split], OUTPUT[split:]]) == expected, split
+    # and a byte at a time
+    assert feed_all([OUTPUT[i : i + 1] for i in range(len(OUTPUT))]) == expected
+
+
+# ----------------------------------------------------------------------------
+def test_line_ends_split_across_blocks():
+    parser = RsyncParser()
+    # the \r ends the progress line, the \n that follows is an empty line
+    assert parser.feed(b"   1,024 100%  1.00kB/s  0:00:00 (xfr#1, to-chk=0/1)\r") == [
+        ProgressEvent(1024, 100, 1024, True, 0, 1)
+    ]
+    assert parser.feed(b"\n>f+++++++++ a.ORF") == []
+    # the last line has no line end, only close returns it
+    assert parser.close() == [FileEvent(">f+++++++++", "a.ORF", True)]
+    assert parser.close() == []
+
+
+# ----------------------------------------------------------------------------
+def test_read_events():
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, OUTPUT)
+    os.close(write_fd)
+    try:
+        assert list(read_events(read_fd, read_size=7)) == feed_all([OUTPUT])
+    finally:
+        os.close(read_fd)
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_"):
+            func()
+            print(f"{name} ok")
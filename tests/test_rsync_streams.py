@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# check libs/rsync_streams.py shares the files between the streams evenly and
+# works out what the rsync paths are relative to
+#
+# ./test_rsync_streams.py  or  python -m pytest tests/test_rsync_streams.py
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from libs.rsync_streams import shard_by_size, transfer_base  # type: ignore
+
+
+# ----------------------------------------------------------------------------
+def test_transfer_base():
+    # the index directory itself is made in the destination
+    assert transfer_base("/home/user/usb_data/index") == "/home/user/usb_data/"
+    # only what is in it
+    assert transfer_base("/home/user/usb_data/index/") == "/home/user/usb_data/index/"
+
+
+# ----------------------------------------------------------------------------
+def test_shard_by_size():
+    files = [("a.MOV", 900), ("b.ORF", 20), ("c.ORF", 500), ("d.ORF", 400), ("e.JPG", 10), ("f.ORF", 30)]
+    shards = shard_by_size(files, 2)
+    assert len(shards) == 2
+    # the biggest first, each to the stream with the least so far
+    assert shards[0] == [("a.MOV", 900), ("f.ORF", 30)]
+    assert shards[1] == [("c.ORF", 500), ("d.ORF", 400), ("b.ORF", 20), ("e.JPG", 10)]
+    assert sorted(item for shard in shards for item in shard) == sorted(files)
+
+
+# ----------------------------------------------------------------------------
+def test_shard_without_empty_shards():
+    assert shard_by_size([("a.ORF", 10), ("b.ORF", 20)], 4) == [[("b.ORF", 20)], [("a.ORF", 10)]]
+    assert shard_by_size([], 3) == []
+    # at least one stream, whatever is asked for
+    assert shard_by_size([("a.ORF", 10)], 0) == [[("a.ORF", 10)]]
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_"):
+            func()
+            print(f"{name} ok")
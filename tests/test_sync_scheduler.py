@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# check libs/sync_scheduler.py waits for things to go quiet before a backup,
+# backs off while the target cannot be reached, and does not lose changes
+# that arrive while a backup runs
+#
+# ./test_sync_scheduler.py  or  python -m pytest tests/test_sync_scheduler.py
+
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from libs.sync_scheduler import RETRY_DELAY, SyncScheduler  # type: ignore
+
+
+# ----------------------------------------------------------------------------
+def synced(debounce=30, interval=600, max_backoff=3600):
+    """a scheduler that has just finished a backup, with the clock at 1000
+
+    Returns:
+        SyncScheduler
+    """
+    scheduler = SyncScheduler(debounce=debounce, interval=interval, max_backoff=max_backoff)
+    scheduler.running_changes = scheduler.changes
+    scheduler.done(True)
+    scheduler.last_try = scheduler.last_change = 1000
+    return scheduler
+
+
+# ----------------------------------------------------------------------------
+def test_first_backup_after_starting():
+    scheduler = SyncScheduler(debounce=30)
+    now = scheduler.last_change
+    reason, timeout = scheduler._next(now)
+    assert reason is None and abs(timeout - 30) < 0.01
+    assert scheduler._next(now + 30) == ("change", 0)
+
+
+# ----------------------------------------------------------------------------
+def test_debounce():
+    scheduler = synced()
+    assert scheduler._next(1010) == (None, 590)
+    # a card being copied, each file puts the backup off again
+    for now in (1010, 1020, 1040):
+        scheduler.last_change = now
+        scheduler.changes += 1
+    assert scheduler._next(1060) == (None, 10)
+    assert scheduler._next(1070) == ("change", 0)
+
+
+# ----------------------------------------------------------------------------
+def test_periodic():
+    scheduler = synced(interval=600)
+    assert scheduler._next(1599) == (None, 1)
+    assert scheduler._next(1600) == ("periodic", 0)
+
+
+# ----------------------------------------------------------------------------
+def test_backoff():
+    scheduler = synced(max_backoff=4 * RETRY_DELAY)
+    delays = []
+    for _ in range(5):
+        scheduler.done(False, reachable=False)
+        reason, timeout = scheduler._next(1000)
+        assert reason is None
+        delays.append(timeout)
+        assert scheduler._next(1000 + timeout) == ("retry", 0)
+    # doubled for each failure, up to max_backoff
+    assert delays == [RETRY_DELAY, 2 * RETRY_DELAY, 4 * RETRY_DELAY, 4 * RETRY_DELAY, 4 * RETRY_DELAY]
+
+    # a retry still waits for the files to stop arriving
+    scheduler.changed()
+    scheduler.last_change = 1000 + 5 * RETRY_DELAY
+    assert scheduler._next(1000 + 4 * RETRY_DELAY)[0] is None
+    assert scheduler._next(1030 + 5 * RETRY_DELAY) == ("retry", 0)
+
+    # and once a backup works, back to normal
+    scheduler.done(True)
+    assert scheduler.failures == 0
+
+
+# ----------------------------------------------------------------------------
+def test_changes_during_a_backup():
+    scheduler = synced()
+    scheduler.changed()
+    scheduler.last_change = 1000
+    assert scheduler._next(1030) == ("change", 0)
+    # the backup starts, then another file arrives while it runs
+    scheduler.running_changes = scheduler.changes
+    scheduler.changed()
+    scheduler.last_change = 1040
+    scheduler.last_try = 1030
+    scheduler.done(True)
+    assert scheduler._next(1070) == ("change", 0)
+
+    # nothing new since that one was backed up
+    scheduler.running_changes = scheduler.changes
+    scheduler.last_try = 1070
+    scheduler.done(True)
+    assert scheduler._next(1100) == (None, 570)
+
+
+# ----------------------------------------------------------------------------
+def test_wait_skips_unreachable():
+    tries = []
+
+    def reachable():
+        tries.append(True)
+        return len(tries) > 1
+
+    # no wait between retries, so the test does not take RETRY_DELAY
+    scheduler = SyncScheduler(debounce=0, max_backoff=0, reachable=reachable)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(scheduler.wait()), daemon=True)
+    thread.start()
+    thread.join(5)
+    # the first try could not reach the target, so counts as a failure
+    assert result == ["retry"] and len(tries) == 2
+    assert scheduler.failures == 1
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_"):
+            func()
+            print(f"{name} ok")
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# check libs/syncer.py only sends what is new, skips directories that have not
+# changed since they were last complete, and carries on where a failed cycle
+# stopped
+#
+# ./test_syncer.py  or  python -m pytest tests/test_syncer.py
+
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from libs.syncer import LocalTransport, Syncer  # type: ignore
+
+
+# ----------------------------------------------------------------------------
+def make_file(path, data=b"photo", age=600):
+    """a file and its directories, all made age seconds ago so they have
+    settled"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    when = time.time() - age
+    os.utime(path, (when, when))
+    os.utime(os.path.dirname(path), (when, when))
+
+
+# ----------------------------------------------------------------------------
+def make_source(root):
+    source = os.path.join(root, "index")
+    make_file(os.path.join(source, "2026", "a.ORF"), b"a" * 100)
+    make_file(os.path.join(source, "2026", "b.ORF"), b"b" * 200)
+    make_file(os.path.join(source, "2026", "c.ORF.tmp"), b"partial")
+    make_file(os.path.join(source, "2027", "d.ORF"), b"d" * 50)
+    os.utime(source, (time.time() - 600, time.time() - 600))
+    return source
+
+
+# ----------------------------------------------------------------------------
+def test_sends_new_files_once():
+    with tempfile.TemporaryDirectory() as root:
+        source = make_source(root)
+        target = os.path.join(root, "backup")
+        os.makedirs(target)
+        syncer = Syncer(source, target, os.path.join(root, "gnarlypi.db"))
+
+        changed, dirs = syncer.changes()
+        # the index directory itself is made in the target, the .tmp is left out
+        assert [rel_path for src_path, rel_path, size, mtime in changed] == [
+            "index/2026/a.ORF", "index/2026/b.ORF", "index/2027/d.ORF"
+        ]
+        assert set(dirs) == {"index", "index/2026", "index/2027"}
+
+        progress = []
+        assert syncer.send(changed, dirs, lambda *args: progress.append(args)) == 3
+        with open(os.path.join(target, "index", "2026", "b.ORF"), "rb") as f:
+            assert f.read() == b"b" * 200
+        sent = os.stat(os.path.join(target, "index", "2026", "b.ORF"))
+        assert int(sent.st_mtime) == int(os.stat(os.path.join(source, "2026", "b.ORF")).st_mtime)
+        assert progress[-1][:5] == (os.path.join(source, "2027", "d.ORF"), 50, 50, 2, 3)
+
+        # nothing has changed
+        assert syncer.changes() == ([], {})
+
+        # a new file, only its directory is looked in again
+        make_file(os.path.join(source, "2027", "e.ORF"), b"e" * 10)
+        changed, dirs = syncer.changes()
+        assert [item[1] for item in changed] == ["index/2027/e.ORF"]
+        assert list(dirs) == ["index/2027"]
+
+
+# ----------------------------------------------------------------------------
+def test_already_in_the_target():
+    with tempfile.TemporaryDirectory() as root:
+        source = make_source(root)
+        target = os.path.join(root, "backup")
+        # copied before, e.g. by rsync, and one that is different
+        make_file(os.path.join(target, "index", "2026", "a.ORF"), b"a" * 100)
+        make_file(os.path.join(target, "index", "2026", "b.ORF"), b"b" * 20)
+        syncer = Syncer(source, target, os.path.join(root, "gnarlypi.db"))
+        changed, dirs = syncer.changes()
+        assert [item[1] for item in changed] == ["index/2026/b.ORF", "index/2027/d.ORF"]
+
+
+# ----------------------------------------------------------------------------
+class FailingTransport(LocalTransport):
+    """a LocalTransport that fails to send one file"""
+
+    def __init__(self, root, fail) -> None:
+        super().__init__(root)
+        self.fail = fail
+
+    def send(self, src_path, rel_path, mtime, progress=None):
+        if rel_path == self.fail:
+            raise OSError("connection lost")
+        super().send(src_path, rel_path, mtime, progress)
+
+
+# ----------------------------------------------------------------------------
+def test_carries_on_after_a_failure():
+    with tempfile.TemporaryDirectory() as root:
+        source = make_source(root)
+        target = os.path.join(root, "backup")
+        db_file = os.path.join(root, "gnarlypi.db")
+        syncer = Syncer(source, target, db_file, transport=FailingTransport(target, "index/2026/b.ORF"))
+        changed, dirs = syncer.changes()
+        assert syncer.send(changed, dirs) == 1
+        # no partial file is left behind
+        assert os.listdir(os.path.join(target, "index", "2026")) == ["a.ORF"]
+
+        # directories are not complete, so everything not sent is found again
+        syncer = Syncer(source, target, db_file, transport=LocalTransport(target))
+        changed, dirs = syncer.changes()
+        assert [item[1] for item in changed] == ["index/2026/b.ORF", "index/2027/d.ORF"]
+        assert syncer.send(changed, dirs) == 2
+        assert syncer.changes() == ([], {})
+
+
+# ----------------------------------------------------------------------------
+def test_trailing_slash_sends_the_contents():
+    with tempfile.TemporaryDirectory() as root:
+        source = make_source(root)
+        syncer = Syncer(source + "/", os.path.join(root, "backup"), os.path.join(root, "gnarlypi.db"))
+        changed, dirs = syncer.changes()
+        assert [item[1] for item in changed] == ["2026/a.ORF", "2026/b.ORF", "2027/d.ORF"]
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_"):
+            func()
+            print(f"{name} ok")
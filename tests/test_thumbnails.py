@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# check extract_preview finds the embedded preview in each kind of RAW file,
+# using small made up files laid out as the cameras write them
+#
+# ./test_thumbnails.py  or  python -m pytest tests/test_thumbnails.py
+
+import os
+import sys
+import struct
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from libs.thumbnails import ThumbCache, ThumbnailWorkers, extract_preview  # type: ignore
+
+LONG = 4
+UNDEFINED = 7
+TIFF_IFD = 13
+
+
+# ----------------------------------------------------------------------------
+def jpeg(size):
+    """something that looks enough like a JPEG, of size bytes"""
+    return b"\xff\xd8" + bytes(size - 4) + b"\xff\xd9"
+
+
+# ----------------------------------------------------------------------------
+def sized_jpeg(width, height, size):
+    """a JPEG with a start of frame giving its width and height"""
+    sof = b"\xff\xc0" + struct.pack(">HBHHB", 11, 8, height, width, 1) + bytes(3)
+    return b"\xff\xd8" + sof + bytes(size - len(sof) - 4) + b"\xff\xd9"
+
+
+# ----------------------------------------------------------------------------
+def ifd(endian, entries, next_ifd=0):
+    """an IFD from (tag, kind, count, value) entries, value is an int"""
+    data = struct.pack(endian + "H", len(entries))
+    for tag, kind, count, value in entries:
+        if kind == 3:
+            data += struct.pack(endian + "HHIHH", tag, kind, count, value, 0)
+        else:
+            data += struct.pack(endian + "HHII", tag, kind, count, value)
+    return data + struct.pack(endian + "I", next_ifd)
+
+
+# ----------------------------------------------------------------------------
+def tiff_header(endian, magic=42):
+    return (b"II" if endian == "<" else b"MM") + struct.pack(endian + "HI", magic, 8)
+
+
+# ----------------------------------------------------------------------------
+def subifd_raw(endian="<", magic=42, preview=jpeg(3000)):
+    """NEF, DNG, ARW and friends, the preview is in a SubIFD"""
+    sub = 8 + 18
+    return (
+        tiff_header(endian, magic)
+        + ifd(endian, [(0x014A, LONG, 1, sub)])
+        + ifd(endian, [(0x0201, LONG, 1, sub + 30), (0x0202, LONG, 1, len(preview))])
+        + preview
+    )
+
+
+# ----------------------------------------------------------------------------
+def strip_raw(endian=">"):
+    """CR2, the preview is the single old style JPEG strip of IFD0"""
+    preview = jpeg(3000)
+    return (
+        tiff_header(endian)
+        + ifd(endian, [(0x0103, 3, 1, 6), (0x0111, LONG, 1, 50), (0x0117, LONG, 1, len(preview))])
+        + preview
+    )
+
+
+# ----------------------------------------------------------------------------
+def panasonic_raw():
+    """RW2 and RWL, JpgFromRaw in IFD0"""
+    preview = jpeg(3000)
+    return tiff_header("<", 0x55) + ifd("<", [(0x002E, UNDEFINED, len(preview), 26)]) + preview
+
+
+# ----------------------------------------------------------------------------
+def olympus_raw(header=b"OLYMPUS\0II\x03\0"):
+    """ORF, a 160x120 thumbnail in IFD1 and the real preview in the MakerNote"""
+    preview = jpeg(3000)
+    thumb = jpeg(500)
+    ifd_at = len(header)
+    settings = ifd_at + 18
+    note = (
+        header
+        + ifd("<", [(0x2020, TIFF_IFD, 1, settings)])
+        + ifd("<", [(0x0101, LONG, 1, settings + 30), (0x0102, LONG, 1, len(preview))])
+        + preview
+    )
+    note_at = 8 + 18 + 30 + 18
+    thumb_at = note_at + len(note)
+    return (
+        tiff_header("<", 0x4F52)
+        + ifd("<", [(0x8769, LONG, 1, 56)], next_ifd=26)
+        + ifd("<", [(0x0201, LONG, 1, thumb_at), (0x0202, LONG, 1, len(thumb))])
+        + ifd("<", [(0x927C, UNDEFINED, len(note), note_at)])
+        + note
+        + thumb
+    )
+
+
+# ----------------------------------------------------------------------------
+def fuji_raw():
+    """RAF, the offset and length of the preview are at 84"""
+    preview = jpeg(3000)
+    header = b"FUJIFILMCCD-RAW 0201FF383501".ljust(84, b"\0")
+    return header + struct.pack(">II", 92, len(preview)) + preview
+
+
+# ----------------------------------------------------------------------------
+def canon_cr3():
+    """CR3, the PRVW box inside the preview uuid box"""
+    preview = jpeg(3000)
+    prvw = struct.pack(">I4s", 8 + 16 + len(preview), b"PRVW") + bytes(16) + preview
+    uuid = (
+        struct.pack(">I4s", 8 + 16 + 8 + len(prvw), b"uuid")
+        + bytes.fromhex("eaf42b5e1c984b88b9fbb7dc406e4d16")
+        + bytes(8)
+        + prvw
+    )
+    return struct.pack(">I4s", 16, b"ftyp") + b"crx " + bytes(4) + uuid
+
+
+# the preview extract_preview should find, 3000 bytes, in each RAW extension
+# gnarlypi copies that has one
+SAMPLES = {
+    ".dng": subifd_raw,
+    ".nef": subifd_raw,
+    ".nrw": subifd_raw,
+    ".arw": subifd_raw,
+    ".sr2": subifd_raw,
+    ".srf": subifd_raw,
+    ".srw": subifd_raw,
+    ".3fr": lambda: subifd_raw(">"),
+    ".fff": subifd_raw,
+    ".cr2": strip_raw,
+    ".rw2": panasonic_raw,
+    ".rwl": panasonic_raw,
+    ".orf": olympus_raw,
+    ".raf": fuji_raw,
+    ".cr3": canon_cr3,
+}
+
+
+# ----------------------------------------------------------------------------
+def preview_of(data, ext):
+    with tempfile.TemporaryDirectory() as path:
+        filename = os.path.join(path, f"sample{ext}")
+        with open(filename, "wb") as f:
+            f.write(data)
+        return extract_preview(filename)
+
+
+# ----------------------------------------------------------------------------
+def test_raw_previews():
+    for ext, make in SAMPLES.items():
+        preview = preview_of(make(), ext)
+        assert preview and len(preview) == 3000, ext
+
+
+# ----------------------------------------------------------------------------
+def test_om_system_makernote():
+    preview = preview_of(olympus_raw(b"OM SYSTEM\0\0\0II\x04\0"), ".orf")
+    assert preview and len(preview) == 3000
+
+
+# ----------------------------------------------------------------------------
+def test_not_a_preview():
+    # a JPEG offset pointing at something that is not a JPEG is ignored
+    assert preview_of(subifd_raw(preview=bytes(3000)), ".nef") is None
+    assert preview_of(b"not a photo at all", ".nef") is None
+
+
+# ----------------------------------------------------------------------------
+def test_smallest_big_enough_preview():
+    # a 160x120 thumbnail, a 640x480 preview and the full size one, each in
+    # one of three chained IFDs after IFD0
+    previews = [sized_jpeg(160, 120, 500), sized_jpeg(640, 480, 3000), sized_jpeg(5184, 3888, 9000)]
+    first = 8 + 18
+    at = first + 30 * len(previews)
+    tiff = tiff_header("<") + ifd("<", [(0x014A, LONG, 1, first)])
+    for i, preview in enumerate(previews):
+        next_ifd = first + 30 * (i + 1) if i < len(previews) - 1 else 0
+        tiff += ifd("<", [(0x0201, LONG, 1, at), (0x0202, LONG, 1, len(preview))], next_ifd)
+        at += len(preview)
+    assert preview_of(tiff + b"".join(previews), ".nef") == previews[1]
+
+
+# ----------------------------------------------------------------------------
+def test_cache_settles():
+    with tempfile.TemporaryDirectory() as path:
+        photos = []
+        for i in range(3):
+            photo = os.path.join(path, f"DSC_000{i}.NEF")
+            with open(photo, "wb") as f:
+                f.write(subifd_raw(preview=jpeg(3000 + i)))
+            photos.append(photo)
+        # too small for even one preview, each is removed as soon as it is made
+        cache = ThumbCache(os.path.join(path, "thumbs"), os.path.join(path, "gnarlypi.db"), 0)
+        workers = ThumbnailWorkers(cache, rate=0)
+        for photo in photos:
+            workers.add(photo)
+        workers.wait()
+        assert workers.made == 3 and cache.lookup(photos[0]) is None
+
+        # not made again, either when queued or when the indexer starts
+        for photo in photos:
+            workers.add(photo)
+        workers.wait()
+        assert workers.made == 3
+        sizes = {photo: os.path.getsize(photo) for photo in photos}
+        assert cache.unattempted(sizes) == []
+        sizes[photos[1]] += 1
+        assert cache.unattempted({**sizes, "/new.NEF": 10}) == ["/new.NEF", photos[1]]
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_"):
+            func()
+            print(f"{name} ok")